@@ -0,0 +1,44 @@
+"""Нормализованный справочник авторов.
+
+Каждый автор хранится один раз с «свёрнутым» ключом (casefold + схлопнутые
+пробелы), а books.author_id ссылается на него. Счётчик книг поддерживается
+триггерами (см. migrations.py), поэтому список авторов не требует агрегации по books.
+"""
+
+
+def fold_author(name):
+    return " ".join(("" if name is None else str(name)).split()).casefold()
+
+
+def get_author_id(cur, name):
+    """id автора по имени; создаёт запись, если такого автора ещё нет"""
+    key = fold_author(name)
+    cur.execute("SELECT id FROM authors WHERE key=?", (key,))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    cur.execute(
+        "INSERT INTO authors (name, key) VALUES (?, ?)",
+        (" ".join(("" if name is None else str(name)).split()), key),
+    )
+    return cur.lastrowid
+
+
+def recount_authors(cur):
+    """Полный пересчёт book_count (после миграции или ручных правок БД)"""
+    cur.execute("""
+        UPDATE authors SET book_count = (
+            SELECT COUNT(*) FROM books WHERE books.author_id = authors.id
+        )
+    """)
+
+
+def list_authors(conn):
+    """Авторы с количеством книг, упорядоченные по ключу"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, name, book_count FROM authors
+        WHERE book_count > 0
+        ORDER BY key
+    """)
+    return cur.fetchall()
@@ -0,0 +1,223 @@
+"""Проверка планов запросов: выборки списка, поиска и watcher идут по индексам.
+
+    python -m bench.check_query_plans            # код возврата 1 при регрессии
+    python -m bench.check_query_plans --verbose  # показать планы всех запросов
+
+Вызывает настоящие функции (get_books, get_books_by_tag, get_books_by_author,
+функции записи watcher и сканирования) на сгенерированной библиотеке,
+перехватывает выполненные SQL и для каждого делает EXPLAIN QUERY PLAN.
+Полный проход таблицы («SCAN books» без индекса) считается ошибкой, кроме
+явно разрешённых сценариев вроде полного списка книг.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from bench.generate_library import generate
+
+LIBRARY_TABLES = ("books", "tags", "book_tags", "authors")
+_SCAN_RE = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?")
+_SKIP_RE = re.compile(r"^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|PRAGMA)\b", re.I)
+
+
+@contextmanager
+def capture_statements():
+    """Собирает (sql, параметры) всех запросов, выполненных через TimedCursor"""
+    import metrics
+
+    statements = []
+    original = metrics.TimedCursor.execute
+
+    def execute(self, sql, *args):
+        statements.append((sql, args[0] if args else ()))
+        return original(self, sql, *args)
+
+    metrics.TimedCursor.execute = execute
+    try:
+        yield statements
+    finally:
+        metrics.TimedCursor.execute = original
+
+
+def explain(conn, sql, params):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def partial_indexes(conn):
+    """Частичные индексы: их полный проход читает только подходящие строки"""
+    return {
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND sql LIKE '% WHERE %'"
+        )
+    }
+
+
+def full_scans(plan, allowed, partial=()):
+    """Полные проходы по таблицам библиотеки, не входящие в allowed"""
+    found = []
+    for detail in plan:
+        match = _SCAN_RE.match(detail)
+        if not match or match.group(1) not in LIBRARY_TABLES:
+            continue
+        if match.group(1) not in allowed and match.group(2) not in partial:
+            found.append(detail)
+    return found
+
+
+def plan_problems(conn, fn, allowed, partial=()):
+    """Выполняет fn и возвращает (полные проходы, [(sql, план)]) его запросов"""
+    with capture_statements() as statements:
+        fn()
+    problems = []
+    plans = []
+    for sql, params in statements:
+        if _SKIP_RE.match(sql):
+            continue
+        plan = explain(conn, sql, params)
+        plans.append((sql, plan))
+        problems += full_scans(plan, allowed, partial)
+    return problems, plans
+
+
+def scenarios(desktop, ws, watcher, sample):
+    """имя → (функция, таблицы, которые разрешено читать целиком)"""
+    import books_db
+
+    tag, tag2, author, book_id, title, path = sample
+
+    def in_tx(fn, *args):
+        # функции записи выполняются в транзакции, которая затем откатывается;
+        # их after_commit отбрасываются, как у откаченной команды писателя
+        def run():
+            conn = ws.connect()
+            cur = conn.cursor()
+            ws.writer._after_commit = []
+            try:
+                fn(cur, *args)
+            finally:
+                ws.writer._after_commit = None
+                conn.rollback()
+                conn.close()
+
+        return run
+
+    return {
+        # полный список: проход по индексу в нужном порядке вместо сортировки
+        "web get_books()": (lambda: ws.get_books(), ("books",)),
+        "web get_books(sort=author)": (lambda: ws.get_books(sort="author"), ("books",)),
+        "web get_books(author)": (lambda: ws.get_books(author=author), ()),
+        "web get_books(favorite)": (lambda: ws.get_books(favorite=True), ()),
+        "web get_books(author, favorite)": (
+            lambda: ws.get_books(author=author, favorite=True),
+            (),
+        ),
+        "web get_books(tags)": (lambda: ws.get_books(tags=[tag, tag2]), ()),
+        "web get_books(tags, author)": (
+            lambda: ws.get_books(tags=[tag], author=author),
+            (),
+        ),
+        "web get_books(query)": (lambda: ws.get_books(query="книга"), ()),
+        "web get_books(query с опечаткой)": (lambda: ws.get_books(query="кнмга"), ()),
+        # запрос короче триграммы ищется LIKE по всем книгам
+        "web get_books(короткий query)": (lambda: ws.get_books(query="кн"), ("books",)),
+        "web get_book": (lambda: ws.get_book(book_id), ()),
+        "_find_book_id": (in_tx(books_db._find_book_id, title, author), ()),
+        "web _update_book": (
+            in_tx(ws._update_book, book_id, title, "", author, "", "ru", [tag]),
+            (),
+        ),
+        "web _toggle_fav": (in_tx(ws._toggle_fav, book_id), ()),
+        "web check_db_files_exist": (ws.check_db_files_exist, ("books",)),
+        "desktop get_books()": (lambda: desktop.get_books(), ("books",)),
+        "desktop get_books(filter)": (lambda: desktop.get_books("книга"), ()),
+        "desktop search_by_author": (lambda: desktop.get_books_by_author(author), ()),
+        "desktop search_by_tag": (lambda: desktop.get_books_by_tag(tag), ()),
+        "desktop get_tags_for_book": (lambda: desktop.get_tags_for_book(book_id), ()),
+        "_add_or_update_book": (
+            in_tx(books_db._add_or_update_book, title, "", author, "", "ru", path, [tag]),
+            (),
+        ),
+        "_save_tags": (in_tx(books_db._save_tags, book_id, [tag2]), ()),
+        "watcher _remove_book": (in_tx(watcher._remove_book, path), ()),
+    }
+
+
+def pick_sample(ws):
+    conn = ws.connect()
+    tags = [row[0] for row in conn.execute("""
+        SELECT tags.name FROM tags JOIN book_tags ON tags.id = book_tags.tag_id
+        GROUP BY tags.id ORDER BY COUNT(*) DESC LIMIT 2
+    """)]
+    book = conn.execute("SELECT id, title, author, bnf_path FROM books LIMIT 1").fetchone()
+    conn.close()
+    return tags[0], tags[1], book["author"], book["id"], book["title"], book["bnf_path"]
+
+
+def check(desktop, ws, watcher, verbose=False):
+    """Проверяет все сценарии; возвращает количество ошибок"""
+    conn = ws.connect()
+    partial = partial_indexes(conn)
+    # индекс тегов строится один раз при первом обращении — это не запрос списка
+    ws.tag_index.ensure_loaded(ws.connect)
+    failures = 0
+    for name, (fn, allowed) in scenarios(desktop, ws, watcher, pick_sample(ws)).items():
+        problems, plans = plan_problems(conn, fn, allowed, partial)
+        failures += bool(problems)
+        print(f"{'FAIL' if problems else 'ok  '} {name}")
+        for detail in problems:
+            print(f"       {detail}")
+        if verbose or problems:
+            for sql, plan in plans:
+                print("       " + " ".join(sql.split())[:110])
+                for detail in plan:
+                    print(f"         {detail}")
+    conn.close()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo)
+
+    workdir = tempfile.mkdtemp(prefix="library-plans-")
+    try:
+        library = os.path.join(workdir, "library")
+        generate(library, books=args.books, md_size_kb=(1, 2), seed=args.seed)
+        os.chdir(workdir)
+        import catalog_cache
+        import library_watcher
+        import main as desktop
+        import search_cache
+        import web_server as ws
+
+        # проверяем SQL-вариант get_books; снимок каталога читает таблицы целиком,
+        # а попадание в кэш поиска не выполнило бы запрос вовсе
+        catalog_cache.ENABLED = False
+        search_cache.ENABLED = False
+        ws.get_library_path = lambda: library
+        desktop.init_db()
+        ws.scan_folder_worker(library)
+        ws.writer.call(lambda cur: cur.execute("UPDATE books SET favorite = (id % 10 = 0)"))
+        failures = check(desktop, ws, library_watcher, args.verbose)
+    finally:
+        os.chdir(repo)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nСценариев с полным проходом таблиц: {failures}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Проверка писателя БД: блокировка записи и вызовы после COMMIT.
+
+    python -m bench.check_writer_lock   # код возврата 1, если Future не завершился
+
+Другое соединение держит BEGIN IMMEDIATE дольше busy_timeout писателя (так
+делают desktop-приложение, веб-сервер и утилиты, пишущие в ту же БД). Все
+команды пачки, включая ещё не начатые, должны получить ошибку «database is
+locked», а после снятия блокировки писатель должен снова записывать.
+
+after_commit откаченной команды (и всей несостоявшейся транзакции) не
+вызывается; у успешной — вызывается до того, как готов её Future.
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import TimeoutError
+
+
+def check(commands, hold):
+    """Возвращает количество ошибок"""
+    import db_writer
+
+    db_writer.BUSY_TIMEOUT_MS = 200
+    writer = db_writer.DbWriter()
+    writer.call(
+        lambda cur: cur.execute("CREATE TABLE IF NOT EXISTS t (id INTEGER PRIMARY KEY)")
+    )
+
+    called = []
+
+    def insert(cur, i, fail=False):
+        cur.execute("INSERT INTO t VALUES (?)", (i,))
+        writer.after_commit(called.append, i)
+        if fail:
+            raise ValueError(i)
+
+    other = sqlite3.connect(db_writer.DB_FILE, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    futures = [writer.submit(insert, i) for i in range(commands)]
+    failures = 0
+    deadline = time.monotonic() + hold
+    for i, future in enumerate(futures):
+        try:
+            future.result(timeout=max(deadline - time.monotonic(), 0))
+            print(f"FAIL команда {i} выполнена при чужой блокировке")
+            failures += 1
+        except TimeoutError:
+            print(f"FAIL команда {i} не завершилась за {hold} с ({future._state})")
+            failures += 1
+        except sqlite3.OperationalError as e:
+            print(f"ok   команда {i}: {e}")
+    other.execute("ROLLBACK")
+    other.close()
+    if called:
+        print(f"FAIL after_commit несостоявшейся транзакции: {called}")
+        failures += 1
+
+    try:
+        writer.call(insert, commands)
+        print("ok   запись после снятия блокировки")
+    except Exception as e:
+        print(f"FAIL запись после снятия блокировки: {e}")
+        failures += 1
+    if called != [commands]:
+        print(f"FAIL after_commit до готовности Future: {called}")
+        failures += 1
+
+    # откаченная команда в одной транзакции с успешной
+    del called[:]
+    failed = writer.submit(insert, commands + 1, True)
+    writer.call(insert, commands + 2)
+    if failed.exception() is None or called != [commands + 2]:
+        print(f"FAIL after_commit откаченной команды: {called}")
+        failures += 1
+    else:
+        print("ok   after_commit только у зафиксированных команд")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commands", type=int, default=5)
+    parser.add_argument(
+        "--hold", type=float, default=5.0, help="сколько ждать ответа, с"
+    )
+    args = parser.parse_args(argv)
+
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo)
+
+    workdir = tempfile.mkdtemp(prefix="library-writer-")
+    try:
+        os.chdir(workdir)
+        failures = check(args.commands, args.hold)
+    finally:
+        os.chdir(repo)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nОшибок: {failures}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Генератор синтетической библиотеки для бенчмарков и нагрузочных тестов.
+
+    python -m bench.generate_library /tmp/lib --books 10000 --seed 1
+"""
+
+import argparse
+import json
+import os
+import random
+
+WORDS_RU = (
+    "время жизнь человек дело день рука работа слово место вопрос лицо глаз "
+    "сторона дом друг город земля голова мир дорога ночь книга история война"
+).split()
+WORDS_EN = (
+    "time life man work day hand word place question face eye side house "
+    "friend city land head world road night book story war light sea"
+).split()
+TAG_WORDS = (
+    "фантастика детектив роман история классика поэзия приключения драма "
+    "sci-fi fantasy mystery thriller horror biography essay humor war"
+).split()
+
+
+def _sentence(rng, words, n):
+    return " ".join(rng.choice(words) for _ in range(n)).capitalize() + "."
+
+
+def _markdown(rng, words, size_kb, chapters):
+    """Текст ~size_kb КБ c заголовками глав и разделов"""
+    parts = []
+    target = size_kb * 1024
+    per_chapter = max(target // max(chapters, 1), 200)
+    for ch in range(1, chapters + 1):
+        parts.append(f"# {_sentence(rng, words, 3)[:-1]} {ch}\n")
+        written = 0
+        section = 1
+        while written < per_chapter:
+            if rng.random() < 0.1:
+                parts.append(f"\n## {_sentence(rng, words, 2)[:-1]} {ch}.{section}\n")
+                section += 1
+            line = _sentence(rng, words, rng.randint(6, 20))
+            parts.append(line + "\n")
+            written += len(line.encode("utf-8"))
+        parts.append("\n")
+    return "".join(parts)
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        lang, _, weight = part.partition("=")
+        mix[lang.strip()] = float(weight)
+    return mix
+
+
+def generate(
+    root,
+    books=1000,
+    tags_per_book=(0, 4),
+    tag_pool=60,
+    authors=300,
+    author_skew=1.2,
+    lang_mix="ru=0.5,en=0.2,en-ru=0.3",
+    md_size_kb=(4, 64),
+    chapters=(3, 20),
+    depth=3,
+    fanout=8,
+    seed=1,
+):
+    """Создаёт дерево книг с .bnf и .md файлами; возвращает список путей .bnf"""
+    rng = random.Random(seed)
+    tags = [
+        f"{rng.choice(TAG_WORDS)}-{i}" if i >= len(TAG_WORDS) else TAG_WORDS[i]
+        for i in range(tag_pool)
+    ]
+    author_names = [
+        f"{rng.choice(WORDS_RU).capitalize()} {rng.choice(WORDS_RU).capitalize()}ов {i}"
+        for i in range(authors)
+    ]
+    # распределение Ципфа: несколько плодовитых авторов и длинный хвост
+    author_weights = [1 / (i + 1) ** author_skew for i in range(authors)]
+    mix = _parse_mix(lang_mix)
+    langs, lang_weights = list(mix), list(mix.values())
+
+    paths = []
+    for i in range(books):
+        folder = root
+        for level in range(rng.randint(0, depth)):
+            folder = os.path.join(folder, f"d{level}_{rng.randrange(fanout)}")
+        os.makedirs(folder, exist_ok=True)
+
+        author = rng.choices(author_names, author_weights)[0]
+        title = f"{_sentence(rng, WORDS_RU, rng.randint(1, 4))[:-1]} {i}"
+        lang = rng.choices(langs, lang_weights)[0]
+        base = os.path.join(folder, f"{title} [{author}]")
+        data = {
+            "title": title,
+            "orig_name": f"{_sentence(rng, WORDS_EN, 3)[:-1]} {i}" if lang != "ru" else "",
+            "author": author,
+            "description": " ".join(
+                _sentence(rng, WORDS_RU, rng.randint(5, 15))
+                for _ in range(rng.randint(1, 5))
+            ),
+            "lang": lang,
+            "tags": rng.sample(tags, rng.randint(*tags_per_book)),
+        }
+        with open(base + ".bnf", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+
+        size = rng.randint(*md_size_kb)
+        n_chapters = rng.randint(*chapters)
+        if lang == "en-ru":
+            text_rng = random.Random(rng.random())
+            with open(base + ".en.md", "w", encoding="utf-8") as f:
+                f.write(_markdown(text_rng, WORDS_EN, size, n_chapters))
+            with open(base + ".ru.md", "w", encoding="utf-8") as f:
+                f.write(_markdown(text_rng, WORDS_RU, size, n_chapters))
+        else:
+            words = WORDS_EN if lang == "en" else WORDS_RU
+            with open(base + ".md", "w", encoding="utf-8") as f:
+                f.write(_markdown(rng, words, size, n_chapters))
+        paths.append(base + ".bnf")
+    return paths
+
+
+def _range(text):
+    lo, _, hi = text.partition("-")
+    return int(lo), int(hi or lo)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root")
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--tags-per-book", type=_range, default=(0, 4))
+    parser.add_argument("--tag-pool", type=int, default=60)
+    parser.add_argument("--authors", type=int, default=300)
+    parser.add_argument("--author-skew", type=float, default=1.2)
+    parser.add_argument("--lang-mix", default="ru=0.5,en=0.2,en-ru=0.3")
+    parser.add_argument("--md-size-kb", type=_range, default=(4, 64))
+    parser.add_argument("--chapters", type=_range, default=(3, 20))
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    paths = generate(
+        args.root,
+        books=args.books,
+        tags_per_book=args.tags_per_book,
+        tag_pool=args.tag_pool,
+        authors=args.authors,
+        author_skew=args.author_skew,
+        lang_mix=args.lang_mix,
+        md_size_kb=args.md_size_kb,
+        chapters=args.chapters,
+        depth=args.depth,
+        seed=args.seed,
+    )
+    print(f"Создано {len(paths)} книг в {args.root}")
+
+
+if __name__ == "__main__":
+    main()
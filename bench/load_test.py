@@ -0,0 +1,292 @@
+"""Нагрузочный тест веб-сервера на сгенерированной библиотеке.
+
+    python -m bench.load_test --books 2000 --clients 16 --duration 30
+    python -m bench.load_test --url http://nas:5050 --duration 60   # уже запущенный сервер
+
+Запускает web_server.app в потоке (threaded werkzeug) и гоняет смешанный
+трафик из пула клиентов: список с фильтрами по тегам, поиск, просмотр книг,
+избранное и редактирование. Выводит p50/p95/p99, пропускную способность и
+ошибки, в том числе «database is locked».
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import quote, urlencode, urlsplit
+
+from bench.generate_library import generate
+
+# вес каждого типа запросов в общем потоке
+MIX = {
+    "index": 20,
+    "index_tags": 20,
+    "search": 15,
+    "author": 5,
+    "book": 25,
+    "toggle_fav": 10,
+    "edit": 5,
+}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.locked = 0
+
+    def record(self, kind, elapsed, error=None, locked=False):
+        with self._lock:
+            self.latencies[kind].append(elapsed)
+            if error:
+                self.errors[(kind, error)] += 1
+            if locked:
+                self.locked += 1
+
+
+class Catalog:
+    """Данные, из которых строятся запросы (читаются из БД один раз)"""
+
+    def __init__(self, books, tags, authors):
+        self.books = books  # [(id, lang, title, author, description, tags)]
+        self.tags = tags
+        self.authors = authors
+
+
+def load_catalog(db_file):
+    import sqlite3
+
+    conn = sqlite3.connect(db_file)
+    books = []
+    for book_id, lang, title, author, description in conn.execute(
+        "SELECT id, lang, title, author, description FROM books"
+    ):
+        tags = [
+            r[0]
+            for r in conn.execute(
+                """SELECT tags.name FROM tags JOIN book_tags ON tags.id = book_tags.tag_id
+                   WHERE book_tags.book_id=?""",
+                (book_id,),
+            )
+        ]
+        books.append((book_id, lang, title, author, description, tags))
+    tags = [r[0] for r in conn.execute("SELECT name FROM tags")]
+    authors = [r[0] for r in conn.execute("SELECT DISTINCT author FROM books")]
+    conn.close()
+    return Catalog(books, tags, authors)
+
+
+def make_request(rng, catalog, kind):
+    """(метод, путь, тело) для запроса данного типа"""
+    if kind == "index":
+        return "GET", "/?" + urlencode({"sort": rng.choice(["title", "author"])}), None
+    if kind == "index_tags":
+        tags = rng.sample(catalog.tags, min(len(catalog.tags), rng.randint(1, 3)))
+        return "GET", "/?" + urlencode([("tag", t) for t in tags]), None
+    if kind == "search":
+        word = rng.choice(catalog.books)[2].split()[0]
+        return "GET", "/?" + urlencode({"q": word[: rng.randint(2, len(word))]}), None
+    if kind == "author":
+        return "GET", "/?" + urlencode({"author": rng.choice(catalog.authors)}), None
+
+    book_id, lang, title, author, description, tags = rng.choice(catalog.books)
+    if kind == "book":
+        ver = rng.choice(["ru", "en", "en-ru"]) if lang == "en-ru" else None
+        return "GET", f"/book/{book_id}" + (f"?ver={ver}" if ver else ""), None
+    if kind == "toggle_fav":
+        return "GET", f"/toggle_fav/{book_id}?from=book", None
+    # edit: сохраняем ту же книгу, слегка меняя описание
+    form = {
+        "title": title,
+        "orig_name": "",
+        "author": author,
+        "description": (description or "") + " ",
+        "lang": lang or "ru",
+        "tags": ", ".join(tags),
+    }
+    return "POST", f"/edit/{book_id}", urlencode(form)
+
+
+def client_loop(base_url, catalog, stats, deadline, seed):
+    rng = random.Random(seed)
+    kinds = list(MIX)
+    weights = [MIX[k] for k in kinds]
+    url = urlsplit(base_url)
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    while time.monotonic() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        method, path, body = make_request(rng, catalog, kind)
+        headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+        start = time.perf_counter()
+        try:
+            conn.request(method, quote(path, safe="/?=&%"), body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            elapsed = time.perf_counter() - start
+            locked = b"database is locked" in data
+            error = None
+            if response.status >= 400:
+                error = f"HTTP {response.status}"
+            elif locked or "Ошибка".encode("utf-8") in data[:200]:
+                error = "app error"
+            stats.record(kind, elapsed, error, locked)
+        except Exception as e:
+            stats.record(kind, time.perf_counter() - start, e.__class__.__name__)
+            conn.close()
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    conn.close()
+
+
+def start_local_server(library, workdir, port):
+    """Поднимает web_server.app в фоне; возвращает (url, server, счётчик исключений)"""
+    os.chdir(workdir)
+    import main as desktop
+    import web_server as ws
+    from flask import got_request_exception
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    ws.get_library_path = lambda: library
+    desktop.init_db()
+    print("Сканирование библиотеки...")
+    ws.scan_folder_worker(library)
+
+    server_errors = defaultdict(int)
+
+    def on_exception(sender, exception, **extra):
+        server_errors[f"{exception.__class__.__name__}: {exception}"[:120]] += 1
+
+    got_request_exception.connect(on_exception, ws.app, weak=False)
+    server = make_server(
+        "127.0.0.1", port, ws.app, threaded=True, request_handler=QuietHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server, server_errors
+
+
+def report(stats, elapsed, server_errors):
+    total = sum(len(v) for v in stats.latencies.values())
+    errors = sum(stats.errors.values())
+    rows = {}
+    print(f"\n{'запрос':12s} {'кол-во':>8s} {'p50, мс':>9s} {'p95, мс':>9s} {'p99, мс':>9s} {'ошибок':>7s}")
+    for kind in list(MIX) + ["all"]:
+        if kind == "all":
+            values = sorted(x for v in stats.latencies.values() for x in v)
+            kind_errors = errors
+        else:
+            values = sorted(stats.latencies.get(kind, []))
+            kind_errors = sum(n for (k, _), n in stats.errors.items() if k == kind)
+        row = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "errors": kind_errors,
+        }
+        rows[kind] = row
+        print(
+            f"{kind:12s} {row['count']:8d} {row['p50'] * 1000:9.1f} "
+            f"{row['p95'] * 1000:9.1f} {row['p99'] * 1000:9.1f} {kind_errors:7d}"
+        )
+    print(f"\nВсего запросов: {total}, {total / elapsed:.1f} запр/с")
+    print(f"Ошибок: {errors} ({errors / max(total, 1):.2%}), из них database is locked: {stats.locked}")
+    for (kind, error), n in sorted(stats.errors.items()):
+        print(f"  {kind}: {error} × {n}")
+    for error, n in sorted(server_errors.items()):
+        print(f"  сервер: {error} × {n}")
+    return {
+        "elapsed": elapsed,
+        "requests": total,
+        "throughput": total / elapsed,
+        "errors": errors,
+        "error_rate": errors / max(total, 1),
+        "locked": stats.locked + sum(n for e, n in server_errors.items() if "locked" in e),
+        "by_kind": rows,
+        "server_errors": dict(server_errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="адрес уже запущенного сервера")
+    parser.add_argument("--db", help="БД этого сервера (для выбора книг и тегов)")
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--out", help="JSON с результатами")
+    parser.add_argument(
+        "--max-error-rate",
+        type=float,
+        default=None,
+        help="завершиться с кодом 1, если доля ошибок больше",
+    )
+    args = parser.parse_args(argv)
+
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo)
+    out = os.path.abspath(args.out) if args.out else None
+
+    workdir = None
+    server_errors = {}
+    if args.url:
+        if not args.db:
+            parser.error("--url требует --db")
+        base_url, db_file = args.url, args.db
+    else:
+        workdir = tempfile.mkdtemp(prefix="library-load-")
+        library = os.path.join(workdir, "library")
+        print(f"Генерация {args.books} книг...")
+        generate(library, books=args.books, md_size_kb=(2, 32), seed=args.seed)
+        base_url, server, server_errors = start_local_server(library, workdir, args.port)
+        db_file = os.path.join(workdir, "library.db")
+
+    catalog = load_catalog(db_file)
+    stats = Stats()
+    print(f"{args.clients} клиентов, {args.duration} с → {base_url}")
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(
+            target=client_loop,
+            args=(base_url, catalog, stats, deadline, args.seed * 1000 + i),
+            daemon=True,
+        )
+        for i in range(args.clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = report(stats, time.monotonic() - started, server_errors)
+
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.max_error_rate is not None and result["error_rate"] > args.max_error_rate:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
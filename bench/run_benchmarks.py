@@ -0,0 +1,260 @@
+"""Воспроизводимые бенчмарки библиотеки; результат — JSON для сравнения коммитов.
+
+    python -m bench.run_benchmarks --books 5000 --out bench/results/HEAD.json
+    python -m bench.run_benchmarks --books 5000 --compare bench/results/old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import queue
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.generate_library import generate
+
+
+def _timeit(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+class Runner:
+    def __init__(self, library, repeat, only=None):
+        self.library = library
+        self.repeat = repeat
+        self.only = only
+        self.results = {}
+
+    def bench(self, name, fn, repeat=None, setup=False, **extra):
+        if self.only and not any(part in name for part in self.only):
+            if setup:  # остальным бенчмаркам нужен результат этого шага
+                fn()
+            return
+        result = _timeit(fn, repeat or self.repeat)
+        result.update(extra)
+        self.results[name] = result
+        print(f"{name:50s} median {result['median'] * 1000:10.2f} ms")
+
+    def skip(self, name, reason):
+        if self.only and not any(part in name for part in self.only):
+            return
+        self.results[name] = {"skipped": reason}
+        print(f"{name:50s} пропущено: {reason}")
+
+
+def bench_scan(r, ws):
+    # первый проход идёт по пустой БД, второй — повторное сканирование
+    r.bench(
+        "scan_folder_worker/cold",
+        lambda: ws.scan_folder_worker(r.library),
+        repeat=1,
+        setup=True,
+    )
+    r.bench("scan_folder_worker/rescan", lambda: ws.scan_folder_worker(r.library), repeat=1)
+
+
+def bench_get_books(r, ws):
+    # в .bnf избранного нет — отмечаем каждую десятую книгу
+    ws.writer.call(lambda cur: cur.execute("UPDATE books SET favorite = (id % 10 = 0)"))
+    conn = ws.connect()
+    ws.tag_index.build(conn)
+    tags = [row[0] for row in conn.execute("""
+        SELECT tags.name FROM tags JOIN book_tags ON tags.id = book_tags.tag_id
+        GROUP BY tags.id ORDER BY COUNT(*) DESC LIMIT 3
+    """)]
+    author = conn.execute("""
+        SELECT author FROM books GROUP BY author ORDER BY COUNT(*) DESC LIMIT 1
+    """).fetchone()[0]
+    conn.close()
+
+    cases = {
+        "all": {},
+        "sort_author": {"sort": "author"},
+        "query": {"query": "книга"},
+        "favorite": {"favorite": True},
+        "author": {"author": author},
+        "tags1": {"tags": tags[:1]},
+        "tags2": {"tags": tags[:2]},
+        "tags3": {"tags": tags[:3]},
+        "tags2+author": {"tags": tags[:2], "author": author},
+        "tags1+favorite": {"tags": tags[:1], "favorite": True},
+        "query+tags1": {"query": "книга", "tags": tags[:1]},
+        "query+author+favorite": {"query": "книга", "author": author, "favorite": True},
+    }
+    def uncached(kwargs):
+        # кэш результатов чистим перед каждым повтором — меряем сам поиск
+        ws.search_cache.clear()
+        return ws.get_books(**kwargs)
+
+    for name, kwargs in cases.items():
+        rows = len(ws.get_books(**kwargs))
+        r.bench(f"get_books/{name}", lambda kw=kwargs: uncached(kw), rows=rows)
+        # повторный одинаковый запрос отдаётся из кэша результатов
+        ws.get_books(**kwargs)
+        r.bench(
+            f"get_books/{name}/cached", lambda kw=kwargs: ws.get_books(**kw), rows=rows
+        )
+
+
+def bench_view_book(r, ws):
+    conn = ws.connect()
+    by_lang = dict(conn.execute("SELECT lang, MIN(id) FROM books GROUP BY lang").fetchall())
+    conn.close()
+    client = ws.app.test_client()
+    variants = [("ru", None), ("en", None), ("en-ru", "ru"), ("en-ru", "en"), ("en-ru", "en-ru")]
+    for lang, ver in variants:
+        book_id = by_lang.get(lang)
+        name = f"view_book/{lang}" + (f"?ver={ver}" if ver else "")
+        if book_id is None:
+            r.skip(name, f"нет книг с lang={lang}")
+            continue
+        url = f"/book/{book_id}" + (f"?ver={ver}" if ver else "")
+        r.bench(name, lambda u=url: client.get(u))
+
+
+def bench_watcher(r, ws, burst):
+    import library_watcher
+    from watchdog.events import FileModifiedEvent
+
+    handler = library_watcher.LibraryWatcher(queue.Queue())
+    conn = ws.connect()
+    paths = [row[0] for row in conn.execute("SELECT bnf_path FROM books LIMIT ?", (burst,))]
+    conn.close()
+
+    def run():
+        for path in paths:
+            handler.dispatch(FileModifiedEvent(path))
+
+    r.bench(f"watcher/burst{len(paths)}", run, repeat=1, events=len(paths))
+
+
+def bench_tk(r, main):
+    try:
+        import tkinter as tk
+
+        app = main.LibraryApp.__new__(main.LibraryApp)
+        tk.Tk.__init__(app)
+        app.withdraw()
+    except Exception as e:
+        r.skip("tk/refresh_books", f"нет дисплея ({e.__class__.__name__})")
+        return
+    try:
+        app.create_widgets()
+        r.bench("tk/refresh_books", app.refresh_books)
+        app.search_var.set("книга")
+        r.bench("tk/refresh_books?search", app.refresh_books)
+    finally:
+        app.destroy()
+
+
+def compare(current, baseline):
+    print(f"\n{'бенчмарк':50s} {'было, мс':>10s} {'стало, мс':>10s} {'x':>7s}")
+    for name, res in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old or "median" not in old or "median" not in res:
+            continue
+        ratio = res["median"] / old["median"] if old["median"] else float("inf")
+        print(
+            f"{name:50s} {old['median'] * 1000:10.2f} {res['median'] * 1000:10.2f} {ratio:7.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--md-size-kb", type=int, nargs=2, default=(4, 64))
+    parser.add_argument("--library", help="готовая библиотека вместо генерации")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--burst", type=int, default=200, help="событий watcher")
+    parser.add_argument("--only", nargs="*", help="подстроки имён бенчмарков")
+    parser.add_argument("--out", help="куда записать JSON с результатами")
+    parser.add_argument("--compare", help="JSON предыдущего прогона")
+    parser.add_argument("--keep", action="store_true", help="не удалять рабочий каталог")
+    args = parser.parse_args(argv)
+
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, repo)
+    out = os.path.abspath(args.out) if args.out else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+
+    workdir = tempfile.mkdtemp(prefix="library-bench-")
+    library = os.path.abspath(args.library) if args.library else os.path.join(workdir, "library")
+    if not args.library:
+        print(f"Генерация {args.books} книг в {library}...")
+        generate(library, books=args.books, md_size_kb=tuple(args.md_size_kb), seed=args.seed)
+
+    # БД создаётся в рабочем каталоге: модули открывают "library.db" относительно cwd
+    os.chdir(workdir)
+    random.seed(args.seed)
+    import main as desktop
+    import web_server as ws
+
+    ws.get_library_path = lambda: library
+
+    desktop.init_db()
+    r = Runner(library, args.repeat, args.only)
+    bench_scan(r, ws)
+    bench_get_books(r, ws)
+    bench_view_book(r, ws)
+    bench_watcher(r, ws, args.burst)
+    bench_tk(r, desktop)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "books": args.books if not args.library else None,
+            "seed": args.seed,
+            "library": args.library,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": r.results,
+    }
+    if out:
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {out}")
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    if args.keep:
+        print(f"Рабочий каталог: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
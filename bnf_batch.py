@@ -0,0 +1,125 @@
+"""Пакетное создание .bnf для текстов, у которых ещё нет метаданных.
+
+    python bnf_batch.py ПАПКА --dry-run   # показать, что будет создано
+    python bnf_batch.py ПАПКА             # создать .bnf и добавить книги в БД
+
+Ищет .md (и пары .en.md/.ru.md) без .bnf рядом, выводит название и автора из
+имени «Название [Автор].md» так же, как BnfEditor, записывает файлы атомарно
+в пуле потоков и добавляет все новые книги в БД одной транзакцией писателя.
+Запускать из папки приложения — там лежит library.db.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import books_db
+import library_watcher
+from bnf_io import metadata_from_filename, split_text_name, write_bnf
+from catalog_cache import prune_change_log
+from db_writer import writer
+from migrations import migrate, update_statistics
+
+
+def find_missing(folder):
+    """Пути текстов книг без .bnf — по одному на книгу (для пары — .en.md)"""
+    found = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        names = set(files)
+        books = {}
+        for file in sorted(files):
+            parsed = split_text_name(file)
+            # скрытые и временные файлы атомарной записи не книги
+            if parsed is None or file.startswith("."):
+                continue
+            base_name, _ = parsed
+            if f"{base_name}.bnf" not in names:
+                books.setdefault(base_name, os.path.join(root, file))
+        found.extend(books.values())
+    return found
+
+
+def _create(text_path):
+    """Метаданные по имени текста и запись .bnf; None, если .bnf уже появился"""
+    bnf_path, data = metadata_from_filename(text_path)
+    if os.path.exists(bnf_path):
+        return None
+    write_bnf(bnf_path, data)
+    return bnf_path, data
+
+
+def _ingest(cur, books):
+    for bnf_path, data in books:
+        books_db._add_or_update_book(
+            cur,
+            data["title"],
+            data["orig_name"],
+            data["author"],
+            data["description"],
+            lang=data["lang"],
+            bnf_path=bnf_path,
+            tags=data["tags"],
+        )
+    return len(books)
+
+
+def generate(folder, workers=8, dry_run=False, ingest=True):
+    """Создаёт .bnf для текстов без метаданных; возвращает [(путь .bnf, данные)]"""
+    # в БД пути хранятся так же, как их записывает сканирование библиотеки
+    folder = os.path.abspath(folder)
+    texts = find_missing(folder)
+    if dry_run:
+        planned = [metadata_from_filename(path) for path in texts]
+        for bnf_path, data in planned:
+            print(
+                f"{os.path.relpath(bnf_path, folder)}: {data['title']!r}"
+                f" [{data['author']}] {data['lang']}"
+            )
+        print(f"Будет создано .bnf: {len(planned)}")
+        return planned
+
+    created = []
+    errors = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(path, pool.submit(_create, path)) for path in texts]
+        for path, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                errors += 1
+                print(f"Ошибка {path}: {e}")
+                continue
+            if result is not None:
+                created.append(result)
+    print(f"Создано .bnf: {len(created)}, ошибок: {errors}")
+
+    if ingest and created:
+        conn = library_watcher.connect()
+        migrate(conn)
+        conn.close()
+        # одна команда писателя — одна транзакция на все книги
+        added = writer.call(_ingest, created)
+        writer.call(update_statistics)
+        writer.call(prune_change_log)
+        print(f"Добавлено в БД: {added}")
+    return created
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("folder")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--no-db", action="store_true", help="только записать .bnf, БД не трогать"
+    )
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.folder):
+        parser.error(f"нет папки {args.folder}")
+    generate(args.folder, args.workers, args.dry_run, ingest=not args.no_db)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
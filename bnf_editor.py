@@ -1,12 +1,18 @@
 #!/usr/bin/python
 import json
 import os
-import re
+import sqlite3
 import sys
 import tkinter as tk
 from tkinter import filedialog, ttk
 
+from bnf_io import metadata_from_filename, write_bnf
 from dialog_manager import DialogManager
+from suggest import suggest_index
+from suggest_entry import SuggestPopup, index_fetch
+
+# БД библиотеки для подсказок тегов (редактор запускают из папки приложения)
+DB_FILE = "library.db"
 
 
 class BnfEditor:
@@ -85,8 +91,14 @@ class BnfEditor:
         ttk.Label(
             main_frame, text="Теги (через запятую):", font=("Arial", 10, "bold")
         ).grid(row=row, column=0, sticky="w", pady=5)
-        ttk.Entry(main_frame, textvariable=self.tags_var, width=50).grid(
-            row=row, column=1, sticky="ew", padx=5, pady=5
+        self.tags_entry = ttk.Entry(main_frame, textvariable=self.tags_var, width=50)
+        self.tags_entry.grid(row=row, column=1, sticky="ew", padx=5, pady=5)
+        self.load_suggestions()
+        SuggestPopup(
+            self.tags_entry,
+            self.tags_var,
+            index_fetch(suggest_index, ["tag"]),
+            separator=",",
         )
         row += 1
 
@@ -119,6 +131,17 @@ class BnfEditor:
             side=tk.LEFT, padx=5
         )
 
+    def load_suggestions(self):
+        """Теги библиотеки для подсказок; без БД редактор работает и так"""
+        if not os.path.exists(DB_FILE):
+            return
+        try:
+            suggest_index.ensure_loaded(
+                lambda: sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True)
+            )
+        except sqlite3.Error:
+            pass
+
     def on_lang_change(self, event=None):
         if self.lang_var.get() != "ru":
             self.orig_label.grid()
@@ -131,17 +154,11 @@ class BnfEditor:
 
     def load_from_filename(self, filepath):
         """Парсинг названия и автора из имени файла .md"""
-        base_dir = os.path.dirname(filepath)
-        base_name = os.path.splitext(os.path.basename(filepath))[0]  # без .md
-        self.metadata_path = os.path.join(base_dir, f"{base_name}.bnf")
-
-        # Проверяем формат "Название [Автор]"
-        match = re.match(r"^(.*?)(?:\[(.*?)\])?$", base_name)
-        if match:
-            title = match.group(1).strip()
-            author = match.group(2).strip() if match.group(2) else ""
-            self.title_var.set(title)
-            self.author_var.set(author)
+        self.metadata_path, data = metadata_from_filename(filepath)
+        self.title_var.set(data["title"])
+        self.author_var.set(data["author"])
+        self.lang_var.set(data["lang"])
+        self.on_lang_change()
 
         # Если рядом уже есть bnf → загрузим его
         if os.path.exists(self.metadata_path):
@@ -185,8 +202,7 @@ class BnfEditor:
                 return
 
         try:
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            write_bnf(save_path, data, indent=4)
             DialogManager.show_dialog("Успех", f"Метаданные сохранены в {save_path}")
             self.metadata_path = save_path
         except Exception as e:
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import re
+import stat
+import tempfile
+import threading
+
+import text_access
+
+# Файлы, записанные самим приложением: путь → sha1 содержимого.
+# Watcher сверяется с этим списком и не перечитывает собственные записи.
+_own_writes = {}
+_lock = threading.Lock()
+
+
+# суффиксы текстов книги и язык, который они означают (длинные первыми);
+# выводятся из text_access.TEXT_SUFFIXES, у общего «.md» язык — первый (ru)
+TEXT_SUFFIXES = tuple(
+    sorted(
+        {
+            suffix: lang
+            for (lang, _), suffix in reversed(text_access.TEXT_SUFFIXES.items())
+        }.items(),
+        key=lambda item: -len(item[0]),
+    )
+)
+
+
+def split_text_name(filename):
+    """(имя без суффикса, lang) для текста книги или None для других файлов"""
+    for suffix, lang in TEXT_SUFFIXES:
+        if filename.endswith(suffix) and len(filename) > len(suffix):
+            return filename[: -len(suffix)], lang
+    return None
+
+
+def metadata_from_filename(filepath):
+    """(путь .bnf, метаданные) по имени текста «Название [Автор].md»"""
+    filename = os.path.basename(filepath)
+    base_name, lang = split_text_name(filename) or (
+        os.path.splitext(filename)[0],
+        "ru",
+    )
+    match = re.match(r"^(.*?)(?:\[(.*?)\])?$", base_name)
+    title = match.group(1).strip() or base_name
+    author = match.group(2).strip() if match.group(2) else ""
+    bnf_path = os.path.join(os.path.dirname(filepath), f"{base_name}.bnf")
+    # порядок полей как у BnfEditor.save_metadata
+    return bnf_path, {
+        "title": title,
+        "author": author,
+        "orig_name": "",
+        "lang": lang,
+        "tags": [],
+        "description": "",
+    }
+
+
+def _key(path):
+    return os.path.realpath(path)
+
+
+def is_temp_file(path):
+    """Временный файл атомарной записи (".<имя>.bnf.XXXX.tmp")"""
+    name = os.path.basename(path)
+    return name.startswith(".") and name.endswith(".tmp")
+
+
+def write_bnf(path, data, indent=4):
+    """Атомарно записывает .bnf: временный файл рядом + os.replace.
+
+    Watcher никогда не видит наполовину записанный JSON, а хэш записанного
+    содержимого запоминается, чтобы watcher распознал собственную запись.
+    """
+    payload = json.dumps(data, ensure_ascii=False, indent=indent).encode("utf-8")
+    with _lock:
+        _own_writes[_key(path)] = hashlib.sha1(payload).hexdigest()
+
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=folder
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp создаёт файл с правами 0600 — сохраняем права оригинала
+        mode = stat.S_IMODE(os.stat(path).st_mode) if os.path.exists(path) else 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with _lock:
+            _own_writes.pop(_key(path), None)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def is_own_write(path):
+    """True, если текущее содержимое файла записано этим процессом"""
+    key = _key(path)
+    with _lock:
+        digest = _own_writes.get(key)
+    if digest is None:
+        return False
+    try:
+        with open(path, "rb") as f:
+            current = hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return False
+    if current == digest:
+        # запись не снимаем: на одну замену watcher может прислать
+        # несколько событий (moved + modified)
+        return True
+    # файл изменили снаружи — дальше это обычные события
+    with _lock:
+        if _own_writes.get(key) == digest:
+            del _own_writes[key]
+    return False
@@ -0,0 +1,136 @@
+"""Команды записи книг — общие для веб-сервера, desktop-приложения и watcher.
+
+Функции с cur выполняются в потоке писателя (db_writer); книга ищется по
+свёрнутым названию и автору (title_key, authors.key), как в списках, поэтому
+«Война и мир» Льва Толстого и «ВОЙНА И МИР» «лев  толстой» — одна книга,
+откуда бы она ни пришла: сканирование, наблюдатель, bnf_batch или форма
+редактирования.
+"""
+
+import text_search
+from authors import fold_author, get_author_id
+from db_writer import writer
+from migrations import description_snippet, fold_title
+from suggest import suggest_index
+from tag_index import tag_index
+
+
+def add_or_update_book(
+    title, orig_name, author, description, lang=None, bnf_path=None, tags=None
+):
+    """Ставит запись книги в очередь писателя; возвращает Future с id книги"""
+    return writer.submit(
+        _add_or_update_book, title, orig_name, author, description, lang, bnf_path, tags
+    )
+
+
+def _add_or_update_book(
+    cur, title, orig_name, author, description, lang=None, bnf_path=None, tags=None
+):
+    book_id = _find_book_id(cur, title, author)
+    author_id = get_author_id(cur, author)
+    if book_id:
+        cur.execute(
+            """
+            UPDATE books SET title=?, title_key=?, orig_name=?, author=?, author_id=?,
+                             description=?, description_snippet=?, lang=?, bnf_path=?
+            WHERE id=?
+        """,
+            (
+                title,
+                fold_title(title),
+                orig_name,
+                author,
+                author_id,
+                description,
+                description_snippet(description),
+                lang,
+                bnf_path,
+                book_id,
+            ),
+        )
+    else:
+        cur.execute(
+            """
+            INSERT INTO books (title, title_key, orig_name, author, author_id, description,
+                               description_snippet, lang, bnf_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                title,
+                fold_title(title),
+                orig_name,
+                author,
+                author_id,
+                description,
+                description_snippet(description),
+                lang,
+                bnf_path,
+            ),
+        )
+        book_id = cur.lastrowid
+    if tags is not None:
+        _save_tags(cur, book_id, tags)
+    writer.after_commit(tag_index.refresh_books, cur.connection, [book_id])
+    writer.after_commit(suggest_index.refresh_books, cur.connection, [book_id])
+    text_search.refresh_books(cur, [book_id])
+    return book_id
+
+
+def _find_book_id(cur, title, author):
+    cur.execute(
+        """
+        SELECT id FROM books
+        WHERE title_key = ?
+          AND author_id = (SELECT id FROM authors WHERE key=?)
+    """,
+        (fold_title(title), fold_author(author)),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _save_tags(cur, book_id, tags):
+    """Привести теги книги к списку tags: лишние связи удалить, новые добавить"""
+    new_tags = {t.strip() for t in tags if t.strip()}
+
+    cur.execute(
+        """
+        SELECT tags.name FROM tags
+        JOIN book_tags ON tags.id = book_tags.tag_id
+        WHERE book_tags.book_id = ?
+    """,
+        (book_id,),
+    )
+    current_tags = {row[0] for row in cur.fetchall()}
+
+    to_delete = current_tags - new_tags
+    if to_delete:
+        cur.execute(
+            """
+            DELETE FROM book_tags
+            WHERE book_id = ?
+              AND tag_id IN (SELECT id FROM tags WHERE name IN ({}))
+        """.format(",".join("?" * len(to_delete))),
+            (book_id, *to_delete),
+        )
+
+    # порядок добавления — как в списке: от него зависят id новых тегов
+    for tag in dict.fromkeys(t.strip() for t in tags):
+        if tag not in new_tags or tag in current_tags:
+            continue
+        cur.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
+        cur.execute("SELECT id FROM tags WHERE name=?", (tag,))
+        tag_id = cur.fetchone()[0]
+        cur.execute(
+            "INSERT OR IGNORE INTO book_tags (book_id, tag_id) VALUES (?, ?)",
+            (book_id, tag_id),
+        )
+
+
+def _delete_books(cur, book_ids):
+    for book_id in book_ids:
+        cur.execute("DELETE FROM books WHERE id=?", (book_id,))
+        writer.after_commit(tag_index.remove_book, book_id)
+        writer.after_commit(suggest_index.remove_book, book_id)
+    text_search.refresh_books(cur, book_ids)
@@ -0,0 +1,425 @@
+"""Снимок каталога в памяти процесса для отдачи списков книг без SQLite.
+
+Каждое изменение books, book_tags и объёма текстов (text_stats) триггеры
+пишут в change_log (см. migrations.py); номер последней записи — поколение
+БД. Перед отдачей списка сверяется поколение: если оно сдвинулось,
+перечитываются только изменённые книги, и публикуется новый неизменяемый
+снимок. Потоки Flask всегда видят целый снимок, поэтому результаты между
+ними согласованы. Записи других процессов (desktop-приложение) попадают в
+тот же журнал.
+
+Отключается переменной окружения LIBRARY_CATALOG_CACHE=0.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from array import array
+
+import metrics
+import text_search
+from authors import fold_author
+from migrations import fold_title
+
+ENABLED = os.environ.get("LIBRARY_CATALOG_CACHE", "1") != "0"
+# если изменилась заметная доля книг, дешевле перечитать всё
+FULL_REBUILD_RATIO = 0.25
+# сколько последних записей журнала оставлять при чистке
+CHANGE_LOG_KEEP = 10000
+
+catalog_refreshes = metrics.counter(
+    "library_catalog_refresh_total", "Catalog snapshot refreshes by kind"
+)
+catalog_refresh_duration = metrics.histogram(
+    "library_catalog_refresh_seconds", "Catalog snapshot refresh time"
+)
+
+
+def _fold(s):
+    return "" if s is None else str(s).casefold()
+
+
+def generation(cur):
+    """(первая, последняя) запись журнала изменений; последняя — поколение БД"""
+    cur.execute("SELECT MIN(seq), MAX(seq) FROM change_log")
+    first, last = cur.fetchone()
+    return first or 0, last or 0
+
+
+def prune_change_log(cur, keep=CHANGE_LOG_KEEP):
+    """Удаляет старые записи журнала; отставшие снимки перестроятся целиком"""
+    cur.execute(
+        "DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - ?",
+        (keep,),
+    )
+
+
+class BookRecord:
+    __slots__ = (
+        "id",
+        "title",
+        "orig_name",
+        "author",
+        "description_snippet",
+        "lang",
+        "bnf_path",
+        "favorite",
+        "words",
+        "tags",
+        "title_key",
+        "author_key",
+        "search_text",
+    )
+
+    def __init__(self, row, tags):
+        (
+            self.id,
+            self.title,
+            self.orig_name,
+            self.author,
+            self.description_snippet,
+            self.lang,
+            self.bnf_path,
+            self.favorite,
+            self.words,  # по самой длинной версии текста; None — не посчитан
+        ) = row
+        self.tags = tuple(tags)
+        self.title_key = fold_title(self.title)
+        self.author_key = _fold(self.author)
+        # поля, по которым ищет q, одной строкой (как LIKE по каждому из них);
+        # полных описаний в снимке нет — по ним ищет CatalogCache.select
+        self.search_text = "\n".join(
+            _fold(s) for s in (self.title, self.orig_name, self.author, *self.tags)
+        )
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "orig_name": self.orig_name,
+            "description_snippet": self.description_snippet,
+            "author": self.author,
+            "lang": self.lang,
+            "tags": list(self.tags),
+            "favorite": self.favorite,
+            "words": self.words,
+        }
+
+
+class CatalogSnapshot:
+    """Неизменяемое состояние каталога на одно поколение БД"""
+
+    __slots__ = (
+        "generation",
+        "books",
+        "by_title",
+        "by_author",
+        "by_words",
+        "title_rank",
+        "author_rank",
+        "words_rank",
+        "tags",
+        "authors",
+        "favorites",
+    )
+
+    def __init__(
+        self, generation, books, by_title, by_author, by_words, tags, authors, old=None
+    ):
+        self.generation = generation
+        self.books = books  # id → BookRecord
+        self.by_title = by_title  # array id, по (title_key, id)
+        self.by_author = by_author  # array id, по (author_key, id)
+        self.by_words = by_words  # array id, по убыванию объёма, затем id
+        # позиции в порядке сортировки; от старого снимка, если порядок тот же
+        if old is not None and old.by_title is by_title:
+            self.title_rank = old.title_rank
+        else:
+            self.title_rank = {book_id: i for i, book_id in enumerate(by_title)}
+        if old is not None and old.by_author is by_author:
+            self.author_rank = old.author_rank
+        else:
+            self.author_rank = {book_id: i for i, book_id in enumerate(by_author)}
+        if old is not None and old.by_words is by_words:
+            self.words_rank = old.words_rank
+        else:
+            self.words_rank = {book_id: i for i, book_id in enumerate(by_words)}
+        self.tags = tags  # тег (casefold) → array id по возрастанию
+        self.authors = authors  # fold_author → array id по возрастанию
+        self.favorites = frozenset(b.id for b in books.values() if b.favorite)
+
+    def select(
+        self,
+        query=None,
+        tags=None,
+        author=None,
+        sort="title",
+        favorite=False,
+        match=None,
+        described=frozenset(),
+    ):
+        """Записи книг по тем же правилам, что и SQL-вариант get_books.
+
+        match — результат text_search.search для query; без него query ищется
+        подстрокой по записям снимка, а described — id книг, в полном описании
+        которых query нашёлся.
+        """
+        ids = None
+        postings = []
+        for tag in tags or ():
+            postings.append(self.tags.get(_fold(tag), ()))
+        if author:
+            postings.append(self.authors.get(fold_author(author), ()))
+        if postings:
+            postings.sort(key=len)
+            ids = set(postings[0])
+            for posting in postings[1:]:
+                ids.intersection_update(posting)
+        if favorite:
+            ids = set(self.favorites) if ids is None else ids & self.favorites
+        if match is not None:
+            found, fuzzy = match
+            found = [i for i in found if i in self.books and (ids is None or i in ids)]
+            if fuzzy:  # похожие книги — в порядке похожести
+                return [self.books[i] for i in found]
+            ids = set(found)
+        elif query:
+            q = _fold(query)
+            candidates = self.books if ids is None else ids
+            ids = {
+                i
+                for i in candidates
+                if i in described or q in self.books[i].search_text
+            }
+
+        if sort == "author":
+            order, rank = self.by_author, self.author_rank
+        elif sort == "words":
+            order, rank = self.by_words, self.words_rank
+        else:
+            order, rank = self.by_title, self.title_rank
+        if ids is None:
+            result = order
+        elif len(ids) * 8 < len(order):
+            result = sorted(ids, key=rank.__getitem__)
+        else:
+            result = [i for i in order if i in ids]
+        return [self.books[i] for i in result]
+
+
+def _title_order(books):
+    return lambda i: (books[i].title_key, i)
+
+
+def _author_order(books):
+    return lambda i: (books[i].author_key, i)
+
+
+def _words_order(books):
+    return lambda i: (-(books[i].words or 0), i)
+
+
+def _postings(books, key_fn):
+    postings = {}
+    for book_id in sorted(books):
+        for key in key_fn(books[book_id]):
+            postings.setdefault(key, []).append(book_id)
+    return {key: array("q", ids) for key, ids in postings.items()}
+
+
+def _tag_keys(record):
+    return {_fold(t) for t in record.tags}
+
+
+def _author_keys(record):
+    return (fold_author(record.author),)
+
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def snapshot(self, conn):
+        """Снимок, соответствующий текущему поколению БД"""
+        snapshot = self._snapshot
+        cur = conn.cursor()
+        if snapshot is not None and generation(cur)[1] == snapshot.generation:
+            return snapshot
+        with self._lock:
+            # другой поток мог обновить снимок, пока ждали блокировку
+            started = time.perf_counter()
+            snapshot = self._refresh(conn, self._snapshot)
+            catalog_refresh_duration.observe(time.perf_counter() - started)
+            self._snapshot = snapshot
+        return snapshot
+
+    def select(
+        self,
+        conn,
+        query=None,
+        tags=None,
+        author=None,
+        sort="title",
+        favorite=False,
+        snapshot=None,
+    ):
+        if snapshot is None:
+            snapshot = self.snapshot(conn)
+        match = text_search.search(conn, query) if query else None
+        described = frozenset()
+        if query and match is None:
+            described = _description_matches(conn, query)
+        return snapshot.select(query, tags, author, sort, favorite, match, described)
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def _refresh(self, conn, old):
+        cur = conn.cursor()
+        # журнал и строки читаем в одной транзакции чтения — одно поколение
+        cur.execute("BEGIN")
+        try:
+            first, gen = generation(cur)
+            if old is not None and old.generation == gen:
+                return old
+            changed = None
+            if old is not None and first <= old.generation + 1:
+                cur.execute(
+                    "SELECT DISTINCT book_id FROM change_log WHERE seq > ?",
+                    (old.generation,),
+                )
+                changed = [row[0] for row in cur.fetchall()]
+                if len(changed) > FULL_REBUILD_RATIO * max(len(old.books), 1):
+                    changed = None
+            records = _load_records(cur, changed)
+        finally:
+            conn.rollback()
+
+        if changed is None:
+            catalog_refreshes.inc(kind="full")
+            return _build(gen, records)
+        catalog_refreshes.inc(kind="incremental")
+        return _apply(old, gen, changed, records)
+
+
+def _load_records(cur, book_ids=None):
+    """id → BookRecord для указанных книг (или всех, если book_ids is None)"""
+    where = ""
+    params = ()
+    if book_ids is not None:
+        where = "WHERE {} IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(book_ids),)
+    cur.execute(
+        """
+        SELECT book_tags.book_id, tags.name FROM book_tags
+        JOIN tags ON tags.id = book_tags.tag_id
+        """
+        + where.format("book_tags.book_id")
+        # порядок тегов как у get_tags_for_book (индекс book_id, tag_id)
+        + " ORDER BY book_tags.book_id, book_tags.tag_id",
+        params,
+    )
+    book_tags = {}
+    for book_id, name in cur.fetchall():
+        book_tags.setdefault(book_id, []).append(name)
+    cur.execute(
+        """
+        SELECT id, title, orig_name, author, description_snippet, lang, bnf_path, favorite,
+            (SELECT MAX(words) FROM text_stats WHERE book_id = books.id)
+        FROM books
+        """
+        + where.format("id"),
+        params,
+    )
+    return {
+        row[0]: BookRecord(row, book_tags.get(row[0], ())) for row in cur.fetchall()
+    }
+
+
+def _description_matches(conn, query):
+    """id книг, в описании которых есть query (короткий запрос без индекса)"""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id FROM books WHERE instr(UNI_LOWER(description), ?) > 0",
+        (_fold(query),),
+    )
+    return frozenset(row[0] for row in cur.fetchall())
+
+
+def _build(gen, books):
+    return CatalogSnapshot(
+        gen,
+        books,
+        array("q", sorted(books, key=_title_order(books))),
+        array("q", sorted(books, key=_author_order(books))),
+        array("q", sorted(books, key=_words_order(books))),
+        _postings(books, _tag_keys),
+        _postings(books, _author_keys),
+    )
+
+
+def _apply(old, gen, changed, records):
+    """Новый снимок: старый плюс перечитанные книги changed"""
+    books = dict(old.books)
+    for book_id in changed:
+        books.pop(book_id, None)
+    books.update(records)
+
+    by_title = old.by_title
+    if _keys_changed(old.books, records, changed, "title_key"):
+        by_title = _merge_order(by_title, changed, records, _title_order(books))
+    by_author = old.by_author
+    if _keys_changed(old.books, records, changed, "author_key"):
+        by_author = _merge_order(by_author, changed, records, _author_order(books))
+    by_words = old.by_words
+    if _keys_changed(old.books, records, changed, "words"):
+        by_words = _merge_order(by_words, changed, records, _words_order(books))
+    tags = _merge_postings(old.tags, old.books, changed, records, _tag_keys)
+    authors = _merge_postings(old.authors, old.books, changed, records, _author_keys)
+    return CatalogSnapshot(
+        gen, books, by_title, by_author, by_words, tags, authors, old
+    )
+
+
+def _keys_changed(old_books, records, changed, attr):
+    """Меняется ли порядок сортировки: книга добавлена, удалена или сменила ключ"""
+    for book_id in changed:
+        if book_id not in old_books or book_id not in records:
+            return True
+        if getattr(old_books[book_id], attr) != getattr(records[book_id], attr):
+            return True
+    return False
+
+
+def _merge_order(order, changed, records, key):
+    changed = set(changed)
+    kept = (i for i in order if i not in changed)
+    return array("q", heapq.merge(kept, sorted(records, key=key), key=key))
+
+
+def _merge_postings(postings, old_books, changed, records, key_fn):
+    affected = set()
+    for book_id in changed:
+        before = set(key_fn(old_books[book_id])) if book_id in old_books else set()
+        after = set(key_fn(records[book_id])) if book_id in records else set()
+        affected |= before ^ after
+    if not affected:
+        return postings
+    changed = set(changed)
+    postings = dict(postings)
+    for key in affected:
+        ids = {i for i in postings.get(key, ()) if i not in changed}
+        ids.update(i for i, record in records.items() if key in key_fn(record))
+        if ids:
+            postings[key] = array("q", sorted(ids))
+        else:
+            postings.pop(key, None)
+    return postings
+
+
+# Общий снимок процесса веб-сервера
+catalog = CatalogCache()
@@ -0,0 +1,188 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+from metrics import TimedConnection
+
+DB_FILE = "library.db"
+
+# сколько команд из очереди объединяется в одну транзакцию
+MAX_BATCH = 500
+# сколько ждать блокировку записи, которую держит другой процесс, мс
+BUSY_TIMEOUT_MS = 5000
+
+batch_sizes = metrics.histogram(
+    "library_db_writer_batch_size",
+    "Commands per writer transaction",
+    buckets=(1, 2, 5, 10, 50, 100, 500),
+)
+batch_duration = metrics.histogram(
+    "library_db_writer_batch_seconds", "Writer transaction time"
+)
+
+
+def connect():
+    conn = sqlite3.connect(DB_FILE, isolation_level=None, factory=TimedConnection)
+
+    # Универсальная регистронезависимая коллация (Unicode)
+    def _cmp(a, b):
+        a = "" if a is None else str(a)
+        b = "" if b is None else str(b)
+        aa = a.casefold()
+        bb = b.casefold()
+        return (aa > bb) - (aa < bb)  # -1, 0, 1
+
+    conn.create_collation("UNI_NOCASE", _cmp)
+    # На всякий случай функция для ручного приведения
+    conn.create_function(
+        "UNI_LOWER", 1, lambda s: "" if s is None else str(s).casefold()
+    )
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return conn
+
+
+class DbWriter:
+    """Единственный писатель в БД.
+
+    Все изменения (Flask, watcher, сканирование) приходят сюда как команды
+    `fn(cur, *args)` и выполняются в одном потоке на одном соединении.
+    Накопившиеся в очереди команды объединяются в одну транзакцию, каждая
+    команда — в своём SAVEPOINT, так что ошибка одной не откатывает соседей.
+    Читатели работают в WAL-режиме и писателя не ждут.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._before_commit = []
+        # отложенные до COMMIT вызовы текущей команды и всей пачки
+        self._after_commit = None
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            # WAL сохраняется в файле БД, поэтому включаем его сразу,
+            # до того как читатели откроют свои соединения
+            conn = connect()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.close()
+            self._thread = threading.Thread(
+                target=self._run, name="db-writer", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Поставить команду в очередь; возвращает Future с результатом fn"""
+        self.start()
+        future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """Синхронный вариант submit: ждёт фиксации транзакции"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def flush(self):
+        """Дождаться выполнения всех поставленных ранее команд"""
+        self.call(lambda cur: None)
+
+    def before_commit(self, fn):
+        """fn(cur) выполняется в конце каждой транзакции писателя, перед COMMIT.
+
+        Для отложенной работы, которую выгоднее сделать один раз на пачку
+        команд (например, обновить поисковый индекс).
+        """
+        self._before_commit.append(fn)
+
+    def after_commit(self, fn, *args):
+        """Вызвать fn(*args) после COMMIT транзакции текущей команды.
+
+        Только из команды писателя. Для состояния в памяти (индексы тегов,
+        подсказок): если команда или вся транзакция откатится, вызов
+        отбрасывается и память не расходится с БД.
+        """
+        self._after_commit.append((fn, args))
+
+    def _run(self):
+        conn = connect()
+        cur = conn.cursor()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            results = []
+            callbacks = []
+            started = time.perf_counter()
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                for fn, args, kwargs, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    cur.execute("SAVEPOINT cmd")
+                    self._after_commit = []
+                    try:
+                        results.append((future, fn(cur, *args, **kwargs), None))
+                        cur.execute("RELEASE cmd")
+                        callbacks.extend(self._after_commit)
+                    except Exception as e:
+                        cur.execute("ROLLBACK TO cmd")
+                        cur.execute("RELEASE cmd")
+                        results.append((future, None, e))
+                    finally:
+                        self._after_commit = None
+                for fn in self._before_commit:
+                    cur.execute("SAVEPOINT hook")
+                    try:
+                        fn(cur)
+                    except Exception as e:
+                        print(f"Ошибка в before_commit {fn.__name__}: {e}")
+                        cur.execute("ROLLBACK TO hook")
+                    cur.execute("RELEASE hook")
+                cur.execute("COMMIT")
+                batch_sizes.observe(len(batch))
+                batch_duration.observe(time.perf_counter() - started)
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                # транзакция не состоялась (например, БД заблокирована другим
+                # процессом дольше busy_timeout) — ошибку получают все команды
+                # пачки, и ещё не начатые тоже, иначе их ждали бы вечно
+                for fn, args, kwargs, future in batch:
+                    if future.done():
+                        continue
+                    if future.running() or future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+                continue
+
+            for fn, args in callbacks:
+                try:
+                    fn(*args)
+                except Exception as e:
+                    print(f"Ошибка в after_commit {fn.__name__}: {e}")
+
+            # результаты отдаём только после COMMIT и after_commit: вызвавший
+            # сразу видит обновлённые индексы
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+
+writer = DbWriter()
+
+metrics.register_collector(
+    lambda: [
+        "# TYPE library_db_writer_queue_depth gauge",
+        f"library_db_writer_queue_depth {writer._queue.qsize()}",
+    ]
+)
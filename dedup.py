@@ -0,0 +1,401 @@
+"""Поиск почти одинаковых книг по тексту (MinHash и LSH).
+
+Текст разбивается на шинглы — последовательности из SHINGLE_WORDS слов, —
+и сворачивается в подпись из NUM_HASHES чисел: доля совпавших позиций в двух
+подписях оценивает долю общих шинглов (сходство Жаккара). Подпись строится
+за один проход по хешам шинглов (one permutation hashing: младшие биты хеша
+выбирают позицию, старшие — значение, пустые позиции берут значение
+соседней справа), поэтому файл читается один раз и построчно.
+
+Чтобы не сравнивать все пары текстов, подпись режется на BANDS полос по ROWS
+чисел: кандидатами становятся тексты, у которых совпала хотя бы одна полоса
+целиком, и только их сходство проверяется по всей подписи. Подписи хранятся
+в таблице text_signatures и пересчитываются, когда у файла меняются mtime
+или размер.
+
+Расчёт (refresh) идёт после сканирования библиотеки, из командной строки
+или в фоне по кнопке на странице; пары со сходством не ниже MIN_THRESHOLD
+сохраняются в text_duplicates. Страница только читает их и объединяет книги
+с похожими текстами в группы для выбранного порога.
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import library_watcher
+import metrics
+from db_writer import writer
+from migrations import migrate
+from text_access import text_path
+
+SHINGLE_WORDS = 5
+NUM_HASHES = 128
+# 32 полосы по 4 числа: пара с сходством 0.5 становится кандидатом с
+# вероятностью ~0.87, с сходством 0.8 — почти наверняка
+BANDS = 32
+ROWS = NUM_HASHES // BANDS
+# порог сходства по умолчанию
+THRESHOLD = 0.8
+# самый низкий порог, который можно выбрать: пары ниже него не хранятся
+MIN_THRESHOLD = 0.3
+
+_WORD_RE = re.compile(r"\w+")
+_EMPTY = 1 << 32
+
+signatures_computed = metrics.counter(
+    "library_dedup_signatures_total", "Text MinHash signatures by cache result"
+)
+dedup_duration = metrics.histogram(
+    "library_dedup_seconds", "Near-duplicate search time"
+)
+
+# один расчёт за раз: первый расчёт подписей читает все тексты
+_lock = threading.Lock()
+
+
+def shingle_hashes(path):
+    """Множество 64-битных хешей шинглов файла (файл читается построчно)"""
+    hashes = set()
+    window = deque(maxlen=SHINGLE_WORDS)
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            for word in _WORD_RE.findall(line.casefold()):
+                window.append(word)
+                if len(window) == SHINGLE_WORDS:
+                    digest = hashlib.blake2b(
+                        " ".join(window).encode(), digest_size=8
+                    ).digest()
+                    hashes.add(int.from_bytes(digest, "little"))
+    return hashes
+
+
+def signature(hashes):
+    """Подпись array("I") длины NUM_HASHES или None для пустого текста"""
+    if not hashes:
+        return None
+    bins = [_EMPTY] * NUM_HASHES
+    for h in hashes:
+        i = h % NUM_HASHES
+        value = h >> 32
+        if value < bins[i]:
+            bins[i] = value
+    # пустая позиция берёт значение ближайшей заполненной справа (по кругу) —
+    # у одинаковых текстов пустые позиции совпадают, и заполнятся они одинаково
+    if _EMPTY in bins:
+        source = list(bins)
+        value = None
+        # два круга: на первом находится значение для хвоста массива
+        for i in reversed(range(2 * NUM_HASHES)):
+            k = i % NUM_HASHES
+            if source[k] != _EMPTY:
+                value = source[k]
+            elif value is not None:
+                bins[k] = value
+    return array("I", bins)
+
+
+def file_signature(path):
+    """Подпись файла в виде bytes для кэша (выполняется в процессах пула)"""
+    sig = signature(shingle_hashes(path))
+    return None if sig is None else sig.tobytes()
+
+
+def similarity(a, b):
+    """Оценка сходства Жаккара по двум подписям"""
+    return sum(x == y for x, y in zip(a, b)) / NUM_HASHES
+
+
+def book_texts(conn):
+    """[(id книги, версия или None, путь)] существующих текстов"""
+    texts = []
+    for book_id, lang, bnf_path in conn.execute(
+        "SELECT id, lang, bnf_path FROM books WHERE bnf_path IS NOT NULL"
+    ):
+        versions = ("en", "ru") if lang == "en-ru" else (None,)
+        for ver in versions:
+            path = text_path(bnf_path, lang, ver)
+            if path and os.path.isfile(path):
+                texts.append((book_id, ver, path))
+    return texts
+
+
+def _store_signatures(cur, rows, paths):
+    cur.executemany(
+        """
+        INSERT OR REPLACE INTO text_signatures (path, mtime_ns, size, signature)
+        VALUES (?, ?, ?, ?)
+    """,
+        rows,
+    )
+    # тексты, которых больше нет в библиотеке
+    cur.execute("SELECT path FROM text_signatures")
+    gone = [(path,) for (path,) in cur.fetchall() if path not in paths]
+    cur.executemany("DELETE FROM text_signatures WHERE path=?", gone)
+
+
+def load_signatures(conn, paths, workers=None, progress=None):
+    """{путь: подпись или None}; устаревшие и новые подписи пересчитываются.
+
+    workers > 1 считает подписи в процессах; progress(готово, всего) вызывается
+    по мере расчёта.
+    """
+    cached = {
+        path: (mtime_ns, size, blob)
+        for path, mtime_ns, size, blob in conn.execute(
+            "SELECT path, mtime_ns, size, signature FROM text_signatures"
+        )
+    }
+    result = {}
+    stale = []  # (путь, mtime_ns, размер)
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entry = cached.get(path)
+        if entry and entry[:2] == (st.st_mtime_ns, st.st_size):
+            result[path] = entry[2]
+        else:
+            stale.append((path, st.st_mtime_ns, st.st_size))
+    signatures_computed.inc(len(result), result="cached")
+
+    rows = []
+    if stale:
+        stale_paths = [path for path, _, _ in stale]
+        if workers and workers > 1 and len(stale) > 1:
+            # spawn: расчёт идёт и из потоков веб-сервера
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            blobs = pool.map(file_signature, stale_paths, chunksize=8)
+        else:
+            pool = None
+            blobs = map(file_signature, stale_paths)
+        try:
+            done = zip(stale, blobs)
+            for n, ((path, mtime_ns, size), blob) in enumerate(done, 1):
+                result[path] = blob
+                rows.append((path, mtime_ns, size, blob))
+                if progress:
+                    progress(n, len(stale))
+        finally:
+            if pool:
+                pool.shutdown()
+        signatures_computed.inc(len(stale), result="computed")
+    if rows or len(cached) > len(result):
+        writer.call(_store_signatures, rows, set(result))
+
+    for path, blob in result.items():
+        if blob is not None:
+            sig = array("I")
+            sig.frombytes(blob)
+            result[path] = sig
+    return result
+
+
+def candidate_pairs(signatures):
+    """Пары индексов подписей, совпавших хотя бы в одной полосе"""
+    pairs = set()
+    for band in range(BANDS):
+        buckets = defaultdict(list)
+        start = band * ROWS
+        for i, sig in enumerate(signatures):
+            buckets[tuple(sig[start : start + ROWS])].append(i)
+        for items in buckets.values():
+            for a in range(len(items)):
+                for b in range(a + 1, len(items)):
+                    pairs.add((items[a], items[b]))
+    return pairs
+
+
+def find_pairs(conn, workers=None, progress=None):
+    """(пары, число текстов с подписью); пара — (id, версия, id, версия,
+    сходство) книг со сходством не ниже MIN_THRESHOLD"""
+    texts = book_texts(conn)
+    signatures = load_signatures(
+        conn, [path for _, _, path in texts], workers, progress
+    )
+    items = [
+        (book_id, ver, signatures[path])
+        for book_id, ver, path in texts
+        if signatures.get(path) is not None
+    ]
+    pairs = []
+    for a, b in candidate_pairs([sig for _, _, sig in items]):
+        book_a, ver_a, sig_a = items[a]
+        book_b, ver_b, sig_b = items[b]
+        if book_a == book_b:
+            continue
+        score = similarity(sig_a, sig_b)
+        if score >= MIN_THRESHOLD:
+            pairs.append((book_a, ver_a, book_b, ver_b, score))
+    return pairs, len(items)
+
+
+def _store_pairs(cur, pairs, texts):
+    cur.execute("DELETE FROM text_duplicates")
+    cur.executemany(
+        """
+        INSERT INTO text_duplicates (book_a, version_a, book_b, version_b, score)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+        pairs,
+    )
+    cur.execute(
+        "INSERT OR REPLACE INTO dedup_state (id, computed_at, texts) VALUES (1, ?, ?)",
+        (time.time(), texts),
+    )
+
+
+def refresh(conn, workers=None, progress=None):
+    """Пересчитать и сохранить пары похожих текстов; сколько пар найдено"""
+    with _lock:
+        started = time.perf_counter()
+        pairs, texts = find_pairs(conn, workers, progress)
+        writer.call(_store_pairs, pairs, texts)
+        dedup_duration.observe(time.perf_counter() - started)
+        return len(pairs)
+
+
+def refreshing():
+    """Идёт ли сейчас расчёт"""
+    return _lock.locked()
+
+
+def start_refresh(connect, workers=None):
+    """refresh в фоновом потоке; False, если расчёт уже идёт"""
+    if refreshing():
+        return False
+
+    def run():
+        conn = connect()
+        try:
+            refresh(conn, workers or os.cpu_count())
+        except Exception as e:
+            print(f"Похожие тексты: {e}")
+        finally:
+            conn.close()
+
+    threading.Thread(target=run, name="dedup", daemon=True).start()
+    return True
+
+
+def computed_at(conn):
+    """Время последнего расчёта (unix) или None, если расчёта ещё не было"""
+    row = conn.execute("SELECT computed_at FROM dedup_state WHERE id=1").fetchone()
+    return row[0] if row else None
+
+
+def stored_clusters(conn, threshold=THRESHOLD):
+    """Группы похожих книг по сохранённым парам, крупные первыми.
+
+    Группа — {"books": [{"id", "title", "author", "lang", "version",
+    "score"}]}, где score — наибольшее сходство текста книги с другой книгой
+    группы.
+    """
+    pairs = conn.execute(
+        """
+        SELECT book_a, version_a, book_b, version_b, score FROM text_duplicates
+        WHERE score >= ?
+    """,
+        (threshold,),
+    ).fetchall()
+
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    best = {}  # (id книги, версия) → наибольшее сходство
+    for book_a, ver_a, book_b, ver_b, score in pairs:
+        parent[find(book_a)] = find(book_b)
+        for key in ((book_a, ver_a), (book_b, ver_b)):
+            best[key] = max(best.get(key, 0), score)
+
+    groups = defaultdict(list)
+    for (book_id, ver), score in best.items():
+        groups[find(book_id)].append((book_id, ver, score))
+    info = {}
+    if best:
+        ids = sorted({book_id for book_id, _ in best})
+        for row in conn.execute(
+            """
+            SELECT id, title, author, lang FROM books
+            WHERE id IN (SELECT value FROM json_each(?))
+        """,
+            (json.dumps(ids),),
+        ):
+            info[row[0]] = row[1:]
+    clusters = []
+    for members in groups.values():
+        books = []
+        for book_id, ver, score in sorted(members, key=lambda m: (-m[2], m[0])):
+            title, author, lang = info.get(book_id, ("", "", ""))
+            books.append(
+                {
+                    "id": book_id,
+                    "title": title,
+                    "author": author,
+                    "lang": lang,
+                    "version": ver,
+                    "score": round(score, 3),
+                }
+            )
+        clusters.append({"books": books})
+    clusters.sort(key=lambda c: (-len(c["books"]), c["books"][0]["id"]))
+    return clusters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help=f"порог сходства текстов (по умолчанию {THRESHOLD})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="процессов для расчёта подписей",
+    )
+    args = parser.parse_args(argv)
+
+    conn = library_watcher.connect()
+    migrate(conn)
+
+    def progress(done, total):
+        if done == total or done % 100 == 0:
+            print(f"Подписи: {done}/{total}", file=sys.stderr)
+
+    refresh(conn, args.workers, progress)
+    clusters = stored_clusters(conn, max(args.threshold, MIN_THRESHOLD))
+    conn.close()
+    for n, cluster in enumerate(clusters, 1):
+        print(f"Группа {n}:")
+        for book in cluster["books"]:
+            version = f" [{book['version']}]" if book["version"] else ""
+            print(
+                f"  {book['id']}: {book['author']} — {book['title']}{version}"
+                f" ({book['score']:.2f})"
+            )
+    print(f"Групп похожих книг: {len(clusters)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,54 @@
+import fnmatch
 import json
+import os
+import re
 import sqlite3
 
 from watchdog.events import FileSystemEventHandler
 
+import metrics
+import text_access
+import text_stats
+from bnf_io import is_own_write, is_temp_file
+from books_db import _delete_books, add_or_update_book
+from db_writer import writer
+from metrics import TimedConnection
+
 DB_FILE = "library.db"
 
 
+def _globs(name, default):
+    """Список шаблонов из переменной окружения (через запятую) или default"""
+    value = os.environ.get(name)
+    if not value:
+        return list(default)
+    return [p.strip() for p in value.split(",") if p.strip()]
+
+
+# какие файлы watcher обрабатывает (по имени файла)
+WATCH_INCLUDE = _globs("LIBRARY_WATCH_INCLUDE", ("*.bnf", "*.md"))
+# что пропускать: шаблон проверяется для каждой части пути внутри библиотеки,
+# так что ".*" отсекает и .git/, и swap-файлы редакторов, и временные файлы
+WATCH_EXCLUDE = _globs(
+    "LIBRARY_WATCH_EXCLUDE",
+    (".*", "*~", "*.swp", "#*#", "@eaDir", "#recycle", "Thumbs.db", "__pycache__"),
+)
+
+watcher_events = metrics.counter(
+    "library_watcher_events_total", "Filesystem events received by the watcher"
+)
+watcher_ignored = metrics.counter(
+    "library_watcher_events_ignored_total",
+    "Events dropped by the watcher include/exclude patterns",
+)
+watcher_own_writes = metrics.counter(
+    "library_watcher_own_writes_skipped_total",
+    "Events skipped because the app wrote the file itself",
+)
+
+
 def connect():
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
 
     # Универсальная регистронезависимая коллация (Unicode)
     def _cmp(a, b):
@@ -27,10 +68,13 @@ def connect():
 
 def handle_file_event(file):
     if file.endswith(".bnf"):
+        # собственные записи приложения уже отражены в БД
+        if is_own_write(file):
+            watcher_own_writes.inc()
+            return
         try:
             with open(file, "r", encoding="utf-8") as f:
                 data = json.load(f)
-                print(data)
             add_or_update_book(
                 data.get("title", ""),
                 data.get("orig_name", ""),
@@ -39,131 +83,108 @@ def handle_file_event(file):
                 lang=data.get("lang"),
                 bnf_path=file,
                 tags=data.get("tags", []),
-            )
+            ).result()
+            # события .md могли прийти раньше, чем книга появилась в БД
+            text_stats.refresh_bnf(file, data.get("lang"))
         except Exception as e:
-            print("error on loading file")
-            pass
-
-
-def add_or_update_book(
-    title, orig_name, author, description, lang=None, bnf_path=None, tags=None
-):
-    book_id = find_book_id(title, author)
-    conn = connect()
-    cur = conn.cursor()
-    if book_id:
-        print("updating book id")
-        cur.execute(
-            """
-            UPDATE books SET title=?, orig_name=?, author=?, description=?, lang=?, bnf_path=?
-            WHERE id=?
-        """,
-            (title, orig_name, author, description, lang, bnf_path, book_id),
-        )
-    else:
-        print("creating new book")
-        cur.execute(
-            """
-            INSERT OR IGNORE INTO books (title, orig_name, author, description, lang, bnf_path)
-            VALUES (?, ?, ?, ?, ?)
-        """,
-            (title, orig_name, author, description, lang, bnf_path),
-        )
-        book_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    if tags:
-        save_tags(book_id, tags)
-
-
-def find_book_id(title, author):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM books WHERE title=? AND author=?", (title, author))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else None
-
-
-def save_tags(book_id, tags):
-    conn = connect()
-    cur = conn.cursor()
-
-    # приводим список тегов к уникальному виду, убираем пробелы
-    new_tags = {t.strip() for t in tags}
-
-    # получаем текущие теги книги
-    cur.execute(
-        """
-        SELECT t.name
-        FROM tags t
-        JOIN book_tags bt ON t.id = bt.tag_id
-        WHERE bt.book_id = ?
-    """,
-        (book_id,),
-    )
-    current_tags = {row[0] for row in cur.fetchall()}
-
-    # теги для удаления и добавления
-    to_delete = current_tags - new_tags
-    to_add = new_tags - current_tags
-
-    # удаляем ненужные связи
-    if to_delete:
-        cur.execute(
-            """
-            DELETE FROM book_tags
-            WHERE book_id = ?
-              AND tag_id IN (
-                SELECT id FROM tags WHERE name IN ({})
-              )
-        """.format(",".join("?" * len(to_delete))),
-            (book_id, *to_delete),
-        )
-
-    # добавляем новые
-    for tag in to_add:
-        cur.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
-        cur.execute("SELECT id FROM tags WHERE name=?", (tag,))
-        tag_id = cur.fetchone()[0]
-        cur.execute(
-            "INSERT OR IGNORE INTO book_tags (book_id, tag_id) VALUES (?, ?)",
-            (book_id, tag_id),
-        )
-
-    conn.commit()
-    conn.close()
+            print(f"Ошибка {file}: {e}")
+
+
+def handle_content_event(file):
+    """Текст книги (.md, .en.md, .ru.md) изменился: сброс кэшей и статистика"""
+    text_access.invalidate(file)
+    text_stats.refresh_text(file)
 
 
 def remove_book_from_db(file):
     """Удалить запись о книге, если удалён .bnf"""
     if file.endswith(".bnf"):
-        conn = connect()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM books WHERE bnf_path=?", (file,))
-        conn.commit()
-        conn.close()
-        print(f"Удалена книга из БД (файл {file})")
+        writer.call(_remove_book, file)
+
+
+def _remove_book(cur, file):
+    cur.execute("SELECT id FROM books WHERE bnf_path=?", (file,))
+    _delete_books(cur, [row[0] for row in cur.fetchall()])
+
+
+def _glob_regex(patterns):
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns) or "(?!)")
+
+
+def is_text_file(path):
+    return path.endswith(".md")
 
 
 class LibraryWatcher(FileSystemEventHandler):
-    def __init__(self, queue):
+    """События файлов библиотеки: .bnf → БД, тексты .md → кэши и статистика.
+
+    Лишние события (редакторы, .git, миниатюры NAS) отсекаются в dispatch
+    по шаблонам include/exclude, до обработчиков. root — корень библиотеки:
+    exclude проверяется только для частей пути внутри него.
+    """
+
+    def __init__(self, queue, root=None, include=None, exclude=None):
         self.queue = queue
+        self.root = root
+        self._include = _glob_regex(WATCH_INCLUDE if include is None else include)
+        self._exclude = _glob_regex(WATCH_EXCLUDE if exclude is None else exclude)
+
+    def wanted(self, path):
+        path = os.fsdecode(path)
+        if not self._include.match(os.path.basename(path)):
+            return False
+        return self.wanted_dir(path)
+
+    def wanted_dir(self, path):
+        """Не попадает ли путь под exclude (для папок проверяется только он)"""
+        path = os.fsdecode(path)
+        rel = os.path.relpath(path, self.root) if self.root else os.path.basename(path)
+        if rel == os.curdir:
+            return True
+        return not any(self._exclude.match(part) for part in rel.split(os.sep))
+
+    def dispatch(self, event):
+        paths = [event.src_path]
+        if getattr(event, "dest_path", None):
+            paths.append(event.dest_path)
+        if event.is_directory or not any(self.wanted(p) for p in paths):
+            watcher_ignored.inc()
+            return
+        super().dispatch(event)
 
     def on_created(self, event):
-        print(f"on_created {event.src_path}")
-        if not event.is_directory:
-            handle_file_event(event.src_path)
-            self.queue.put(("created", event.src_path))
+        watcher_events.inc(type="created")
+        if is_text_file(event.src_path):
+            handle_content_event(event.src_path)
+            return
+        handle_file_event(event.src_path)
+        self.queue.put(("created", event.src_path))
 
     def on_deleted(self, event):
-        print(f"on_deleted {event.src_path}")
-        if not event.is_directory:
+        watcher_events.inc(type="deleted")
+        if is_text_file(event.src_path):
+            handle_content_event(event.src_path)
+            return
+        remove_book_from_db(event.src_path)
+        self.queue.put(("deleted", event.src_path))
+
+    def on_moved(self, event):
+        watcher_events.inc(type="moved")
+        for path in (event.src_path, event.dest_path):
+            if is_text_file(path):
+                handle_content_event(path)
+        # атомарная запись (временный файл + rename) приходит как перемещение
+        if event.src_path.endswith(".bnf") and not is_temp_file(event.src_path):
             remove_book_from_db(event.src_path)
             self.queue.put(("deleted", event.src_path))
+        if event.dest_path.endswith(".bnf"):
+            handle_file_event(event.dest_path)
+            self.queue.put(("modified", event.dest_path))
 
     def on_modified(self, event):
-        print(f"on_modified {event.src_path}")
-        if not event.is_directory:
-            handle_file_event(event.src_path)
-            self.queue.put(("modified", event.src_path))
+        watcher_events.inc(type="modified")
+        if is_text_file(event.src_path):
+            handle_content_event(event.src_path)
+            return
+        handle_file_event(event.src_path)
+        self.queue.put(("modified", event.src_path))
@@ -13,14 +13,46 @@ from tkinter import filedialog, messagebox, ttk
 
 from watchdog.observers import Observer
 
+import dedup
+import metrics
+import recommend
+import suggest
+import text_search
+import text_stats
+from authors import fold_author, list_authors
+from bnf_io import write_bnf
+from books_db import _delete_books, add_or_update_book
+from catalog_cache import generation, prune_change_log
+from db_writer import writer
 from library_watcher import LibraryWatcher
+from metrics import TimedConnection
+from migrations import description_snippet, migrate, update_statistics
+from polling_watcher import PollingWatcher, use_polling
+from scan_jobs import scan_library, scan_manager
+from search_cache import in_order, make_key, search_cache
+from suggest import suggest_index
+from suggest_entry import SuggestPopup, index_fetch
+from tag_index import tag_index
 
 DB_FILE = "library.db"
 
+# Колонки строки списка — явным списком: таблица books расширяется
+# миграциями, а строки распаковываются в кортежи фиксированной длины;
+# вместо описания берётся его начало (description_snippet)
+BOOK_COLUMNS = (
+    "books.id, books.title, books.orig_name, books.author, books.description_snippet, "
+    "books.lang, books.bnf_path, books.favorite"
+)
+# те же колонки с полным описанием — для карточки книги
+BOOK_DETAIL_COLUMNS = BOOK_COLUMNS.replace("description_snippet", "description")
+
+# поиск в приложении, как и прежний LIKE, не заглядывает в описания
+SEARCH_COLUMNS = ("title", "orig_name", "author", "tags")
+
 
 # --- Работа с БД ---
 def connect():
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
 
     # Универсальная регистронезависимая коллация (Unicode)
     def _cmp(a, b):
@@ -39,57 +71,9 @@ def connect():
 
 
 def init_db():
+    """Создаёт или обновляет схему БД (см. migrations.py)"""
     conn = connect()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            orig_name TEXT,
-            author TEXT,
-            description TEXT,
-            lang TEXT,
-            bnf_path TEXT,
-            favorite INTEGER DEFAULT 0
-        )
-        """)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS tags (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT UNIQUE
-    )
-    """)
-    cur.execute("""
-        CREATE UNIQUE INDEX IF NOT EXISTS idx_books_author_title ON books (author, title)
-    """)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS book_tags (
-        book_id INTEGER,
-        tag_id INTEGER,
-        UNIQUE(book_id, tag_id),
-        FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE,
-        FOREIGN KEY(tag_id) REFERENCES tags(id) ON DELETE CASCADE
-    )
-    """)
-    conn.commit()
-    conn.close()
-
-
-def save_tags(book_id, tags):
-    conn = connect()
-    cur = conn.cursor()
-    for tag in tags:
-        tag = tag.strip()
-        if not tag:
-            continue
-        cur.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
-        cur.execute("SELECT id FROM tags WHERE name=?", (tag,))
-        tag_id = cur.fetchone()[0]
-        cur.execute(
-            "INSERT OR IGNORE INTO book_tags (book_id, tag_id) VALUES (?, ?)",
-            (book_id, tag_id),
-        )
-    conn.commit()
+    migrate(conn)
     conn.close()
 
 
@@ -109,43 +93,68 @@ def get_tags_for_book(book_id):
     return tags
 
 
-def add_or_update_book(
-    title, orig_name, author, description, lang=None, bnf_path=None, tags=None
-):
-    book_id = find_book_id(title, author)
+def get_book_words(book_ids):
+    """id → число слов самой длинной версии текста (для колонки «Объём»)"""
     conn = connect()
     cur = conn.cursor()
-    if book_id:
-        cur.execute(
-            """
-            UPDATE books SET title=?, orig_name=?, author=?, description=?, lang=?, bnf_path=?
-            WHERE id=?
-        """,
-            (title, orig_name, author, description, lang, bnf_path, book_id),
-        )
-    else:
-        cur.execute(
-            """
-            INSERT INTO books (title, orig_name, author, description, lang, bnf_path)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """,
-            (title, orig_name, author, description, lang, bnf_path),
-        )
-        book_id = cur.lastrowid
-    conn.commit()
+    cur.execute(
+        """
+        SELECT book_id, MAX(words) FROM text_stats
+        WHERE book_id IN (SELECT value FROM json_each(?))
+        GROUP BY book_id
+    """,
+        (json.dumps(list(book_ids)),),
+    )
+    words = dict(cur.fetchall())
     conn.close()
-    if tags:
-        save_tags(book_id, tags)
+    return words
 
 
 def get_books(filter_text=""):
     conn = connect()
     cur = conn.cursor()
-    if filter_text:
+    ids = search_cache.lookup(
+        generation(cur)[1],
+        make_key("desktop", filter_text),
+        lambda: _search_book_ids(cur, filter_text),
+    )
+    cur.execute(
+        f"""
+        SELECT {BOOK_COLUMNS} FROM books
+        WHERE id IN (SELECT value FROM json_each(?))
+    """,
+        (json.dumps(ids),),
+    )
+    rows = in_order(cur.fetchall(), ids)
+    conn.close()
+    return rows
+
+
+def _search_book_ids(cur, filter_text):
+    """id книг для строки поиска в порядке списка"""
+    match = (
+        text_search.search(cur.connection, filter_text, SEARCH_COLUMNS)
+        if filter_text
+        else None
+    )
+    if match is not None:
+        # триграммный индекс: подстрока или похожие книги
+        found, fuzzy = match
+        if fuzzy:
+            return found
+        cur.execute(
+            """
+            SELECT id FROM books
+            WHERE id IN (SELECT value FROM json_each(?))
+            ORDER BY title_key
+        """,
+            (json.dumps(found),),
+        )
+    elif filter_text:
         f = filter_text.casefold()
         cur.execute(
             """
-            SELECT DISTINCT books.*
+            SELECT DISTINCT books.id
             FROM books
             LEFT JOIN book_tags ON books.id = book_tags.book_id
             LEFT JOIN tags ON tags.id = book_tags.tag_id
@@ -153,59 +162,71 @@ def get_books(filter_text=""):
                OR UNI_LOWER(books.orig_name) LIKE UNI_LOWER(?)
                OR UNI_LOWER(books.author) LIKE UNI_LOWER(?)
                OR UNI_LOWER(tags.name)    LIKE UNI_LOWER(?)
-            ORDER BY UNI_LOWER(books.title)
+            ORDER BY books.title_key
         """,
             (f"%{f}%", f"%{f}%", f"%{f}%", f"%{f}%"),
         )
     else:
-        cur.execute("SELECT * FROM books ORDER BY UNI_LOWER(title)")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+        cur.execute("SELECT id FROM books ORDER BY title_key")
+    return [row[0] for row in cur.fetchall()]
 
 
 def get_book(book_id):
     conn = connect()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM books WHERE id=?", (book_id,))
+    cur.execute(f"SELECT {BOOK_DETAIL_COLUMNS} FROM books WHERE id=?", (book_id,))
     book = cur.fetchone()
     conn.close()
     return book
 
 
-# --- GUI ---
-def check_db_files_exist():
-    """Удаляем из БД записи, у которых нет .bnf файла"""
+def get_books_by_author(author):
     conn = connect()
     cur = conn.cursor()
-    cur.execute("SELECT id, bnf_path FROM books")
-    rows = cur.fetchall()
-
-    deleted = 0
-    for book_id, path in rows:
-        if not os.path.exists(path):
-            cur.execute("DELETE FROM books WHERE id=?", (book_id,))
-            deleted += 1
-
-    if deleted:
-        conn.commit()
-        print(f"Удалено {deleted} записей без файлов.")
+    cur.execute(
+        f"""
+        SELECT {BOOK_COLUMNS} FROM books
+        WHERE author_id = (SELECT id FROM authors WHERE key=?)
+        ORDER BY title_key
+    """,
+        (fold_author(author),),
+    )
+    books = cur.fetchall()
+    conn.close()
+    return books
 
 
-def find_book_id(title, author):
+def get_books_by_tag(tag):
+    tag_index.ensure_loaded(connect)
+    ids = tag_index.select([tag])
     conn = connect()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT id FROM books
-        WHERE UNI_LOWER(title)  = UNI_LOWER(?)
-          AND UNI_LOWER(author) = UNI_LOWER(?)
+        f"""
+        SELECT {BOOK_COLUMNS} FROM books
+        WHERE id IN (SELECT value FROM json_each(?))
+        ORDER BY title_key
     """,
-        (title, author),
+        (json.dumps(ids),),
     )
-    row = cur.fetchone()
+    books = cur.fetchall()
     conn.close()
-    return row[0] if row else None
+    return books
+
+
+# --- GUI ---
+def check_db_files_exist():
+    """Удаляем из БД записи, у которых нет .bnf файла"""
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute("SELECT id, bnf_path FROM books")
+    rows = cur.fetchall()
+    conn.close()
+
+    missing = [book_id for book_id, path in rows if not os.path.exists(path)]
+    if missing:
+        writer.call(_delete_books, missing)
+        print(f"Удалено {len(missing)} записей без файлов.")
 
 
 def open_folder(file_path):
@@ -294,8 +315,12 @@ class LibraryApp(tk.Tk):
         os.makedirs(self.library_path, exist_ok=True)
 
         self.create_widgets()
+        tag_index.ensure_loaded(connect)
+        suggest_index.ensure_loaded(connect)
         check_db_files_exist()
         self.refresh_books()
+        text_stats.start_backfill(connect)
+        recommend.start_background(connect)
 
         self.event_queue = queue.Queue()
         self.start_watcher()
@@ -310,6 +335,12 @@ class LibraryApp(tk.Tk):
         search_entry = ttk.Entry(top_frame, textvariable=self.search_var)
         search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
         search_entry.bind("<Return>", lambda e: self.refresh_books())
+        SuggestPopup(
+            search_entry,
+            self.search_var,
+            index_fetch(suggest_index, suggest.FIELDS, limit=5, connect=connect),
+            on_pick=lambda value: self.refresh_books(),
+        )
 
         ttk.Button(top_frame, text="🔎", width=3, command=self.refresh_books).pack(
             side=tk.LEFT, padx=2
@@ -321,6 +352,12 @@ class LibraryApp(tk.Tk):
         ttk.Button(
             top_frame, text="Сканировать папку", command=self.scan_folder_dialog
         ).pack(side=tk.LEFT, padx=2)
+        ttk.Button(top_frame, text="Авторы", command=self.show_authors).pack(
+            side=tk.LEFT, padx=2
+        )
+        ttk.Button(top_frame, text="Статистика", command=self.show_metrics).pack(
+            side=tk.LEFT, padx=2
+        )
 
         # Основная область
         main_frame = ttk.Frame(self)
@@ -333,6 +370,7 @@ class LibraryApp(tk.Tk):
             "title": 300,
             "orig_name": 300,
             "lang": 50,
+            "words": 80,
             "description": 500,
             "tags": 300,
         }
@@ -345,12 +383,18 @@ class LibraryApp(tk.Tk):
                 "title",
                 "orig_name",
                 "lang",
+                "words",
                 "description",
                 "tags",
             ),
             show="headings",
         )
-        sort_orders = {"author": True, "title": True, "orig_name": True}
+        self.sort_orders = {
+            "author": True,
+            "title": True,
+            "orig_name": True,
+            "words": False,
+        }
 
         self.tree.heading("id", text="ID")
         self.tree.heading(
@@ -365,6 +409,9 @@ class LibraryApp(tk.Tk):
             command=lambda: self.sort_column("orig_name"),
         )
         self.tree.heading("lang", text="Язык")
+        self.tree.heading(
+            "words", text="Объём", command=lambda: self.sort_column("words")
+        )
         self.tree.heading("description", text="Описание")
         self.tree.heading("tags", text="Теги")
         for col in self.tree["columns"]:
@@ -387,14 +434,27 @@ class LibraryApp(tk.Tk):
         self.details_text.pack(side=tk.RIGHT, fill=tk.BOTH)
 
         # Статус-бар
+        status_frame = ttk.Frame(self)
+        status_frame.pack(fill=tk.X, side=tk.BOTTOM)
         self.status_var = tk.StringVar(value="Готово")
-        ttk.Label(self, textvariable=self.status_var, anchor="w").pack(
-            fill=tk.X, side=tk.BOTTOM
+        ttk.Label(status_frame, textvariable=self.status_var, anchor="w").pack(
+            side=tk.LEFT, fill=tk.X, expand=True
+        )
+        # прогресс сканирования (показывается только во время скана)
+        self.scan_progress = ttk.Progressbar(
+            status_frame, orient="horizontal", length=200, mode="determinate"
+        )
+        self.scan_cancel_button = ttk.Button(
+            status_frame, text="Отменить", command=self.cancel_scan
         )
 
     def start_watcher(self):
         """Запуск watchdog в отдельном потоке"""
-        event_handler = LibraryWatcher(self.event_queue)
+        event_handler = LibraryWatcher(self.event_queue, root=self.library_path)
+        if use_polling(self.library_path):
+            # сетевая папка: inotify не работает, сверяем снимки
+            PollingWatcher(event_handler, self.library_path).start()
+            return
         observer = Observer()
         observer.schedule(event_handler, self.library_path, recursive=True)
         observer_thread = threading.Thread(target=observer.start, daemon=True)
@@ -418,6 +478,9 @@ class LibraryApp(tk.Tk):
     def sort_column(self, col):
         # получаем все элементы
         data = [(self.tree.set(k, col), k) for k in self.tree.get_children("")]
+        if col == "words":
+            # числа, а не строки; не посчитанные — в конце по убыванию
+            data = [(int(val) if val else -1, k) for val, k in data]
         # сортируем
         data.sort(reverse=not self.sort_orders[col])
         for index, (val, k) in enumerate(data):
@@ -432,51 +495,101 @@ class LibraryApp(tk.Tk):
     def search_by_author(self, author):
         self.search_var.set(author)
         self.tree.delete(*self.tree.get_children())
-        conn = connect()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT * FROM books
-            WHERE UNI_LOWER(author) = UNI_LOWER(?)
-            ORDER BY UNI_LOWER(title)
-        """,
-            (author,),
-        )
-        books = cur.fetchall()
-        conn.close()
+        books = get_books_by_author(author)
 
+        words = get_book_words(book[0] for book in books)
         for book in books:
             book_id, title, orig_name, author, desc, lang, bnf_path, favorite = book
             tags = ", ".join(get_tags_for_book(book_id))
             self.tree.insert(
-                "", tk.END, values=(book_id, author, title, orig_name, lang, desc, tags)
+                "",
+                tk.END,
+                values=(
+                    book_id,
+                    author,
+                    title,
+                    orig_name,
+                    lang,
+                    words.get(book_id, ""),
+                    desc,
+                    tags,
+                ),
             )
 
         self.status_var.set(f"Найдено книг автора '{author}': {len(books)}")
 
+    def show_authors(self):
+        """Окно со списком авторов (читает только таблицу authors)"""
+        conn = connect()
+        authors = list_authors(conn)
+        conn.close()
+
+        dialog = tk.Toplevel(self)
+        dialog.title("Авторы")
+        dialog.geometry("400x500")
+
+        tree = ttk.Treeview(dialog, columns=("name", "count"), show="headings")
+        tree.heading("name", text="Автор")
+        tree.heading("count", text="Книг")
+        tree.column("name", width=300)
+        tree.column("count", width=60, anchor="e")
+        for _, name, book_count in authors:
+            tree.insert("", tk.END, values=(name, book_count))
+
+        scrollbar = ttk.Scrollbar(dialog, orient="vertical", command=tree.yview)
+        tree.configure(yscroll=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+
+        def on_open(event=None):
+            sel = tree.selection()
+            if sel:
+                self.search_by_author(str(tree.item(sel[0])["values"][0]))
+
+        tree.bind("<Double-1>", on_open)
+        tree.bind("<Return>", on_open)
+
+    def show_metrics(self):
+        """Панель с метриками процесса, обновляется раз в секунду"""
+        dialog = tk.Toplevel(self)
+        dialog.title("Статистика")
+        dialog.geometry("700x400")
+        text = tk.Text(dialog, wrap=tk.NONE, font=("TkFixedFont", 9))
+        text.pack(fill=tk.BOTH, expand=True)
+
+        def update():
+            if not dialog.winfo_exists():
+                return
+            text.config(state="normal")
+            text.delete(1.0, tk.END)
+            text.insert(tk.END, metrics.summary())
+            text.config(state="disabled")
+            dialog.after(1000, update)
+
+        update()
+
     def search_by_tag(self, tag):
         self.search_var.set(tag)
         self.tree.delete(*self.tree.get_children())
-        conn = connect()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT books.* FROM books
-            JOIN book_tags ON books.id = book_tags.book_id
-            JOIN tags ON tags.id = book_tags.tag_id
-            WHERE UNI_LOWER(tags.name) = UNI_LOWER(?)
-            ORDER BY UNI_LOWER(books.title)
-        """,
-            (tag,),
-        )
-        books = cur.fetchall()
-        conn.close()
+        books = get_books_by_tag(tag)
 
+        words = get_book_words(book[0] for book in books)
         for book in books:
             book_id, title, orig_name, author, desc, lang, bnf_path, favorite = book
             tags = ", ".join(get_tags_for_book(book_id))
             self.tree.insert(
-                "", tk.END, values=(book_id, author, title, orig_name, lang, desc, tags)
+                "",
+                tk.END,
+                values=(
+                    book_id,
+                    author,
+                    title,
+                    orig_name,
+                    lang,
+                    words.get(book_id, ""),
+                    desc,
+                    tags,
+                ),
             )
 
         self.status_var.set(f"Найдено книг с тегом '{tag}': {len(books)}")
@@ -492,12 +605,24 @@ class LibraryApp(tk.Tk):
         self.tree.delete(*self.tree.get_children())
         books = get_books(self.search_var.get())
         restored_item = None
+        words = get_book_words(book[0] for book in books)
 
         for book in books:
             book_id, title, orig_name, author, desc, lang, bnf_path, favorite = book
             tags = ", ".join(get_tags_for_book(book_id))
             item = self.tree.insert(
-                "", tk.END, values=(book_id, author, title, orig_name, lang, desc, tags)
+                "",
+                tk.END,
+                values=(
+                    book_id,
+                    author,
+                    title,
+                    orig_name,
+                    lang,
+                    words.get(book_id, ""),
+                    desc,
+                    tags,
+                ),
             )
             if selected_book_id == str(book_id):
                 restored_item = item
@@ -515,7 +640,17 @@ class LibraryApp(tk.Tk):
         book_id, title, orig_name, author, desc, lang, bnf_path, favorite = book
         tags = ", ".join(get_tags_for_book(book_id))
         self.tree.item(
-            position, values=(book_id, author, title, orig_name, lang, desc, tags)
+            position,
+            values=(
+                book_id,
+                author,
+                title,
+                orig_name,
+                lang,
+                get_book_words([book_id]).get(book_id, ""),
+                description_snippet(desc),
+                tags,
+            ),
         )
         self.show_details()
 
@@ -619,6 +754,22 @@ class LibraryApp(tk.Tk):
                         self.details_text.insert(tk.END, ", ", "value")
             self.details_text.insert(tk.END, "\n\n", "value")
 
+            # Объём (у en-ru — по каждой версии)
+            conn = connect()
+            stats = text_stats.get_stats(conn, book_id)
+            conn.close()
+            if stats:
+                self.details_text.insert(tk.END, "Объём:", "label")
+                for version, st in stats.items():
+                    prefix = "" if version == "md" else f"{version}: "
+                    self.details_text.insert(
+                        tk.END,
+                        f"\n{prefix}{st['words']} слов, {st['chars']} знаков, "
+                        f"заголовков: {st['headings']}, чтение ~{st['reading_time']}",
+                        "value",
+                    )
+                self.details_text.insert(tk.END, "\n\n", "value")
+
             # --- Новое: кнопка "Открыть папку" ---
             if bnf_path and os.path.exists(bnf_path):
                 folder_name = f"open_folder_{book_id}"
@@ -708,7 +859,14 @@ class LibraryApp(tk.Tk):
 
         ttk.Label(dialog, text="Теги (через запятую)").pack(anchor="w")
         tags_var = tk.StringVar(value=", ".join(tags))
-        ttk.Entry(dialog, textvariable=tags_var).pack(fill="x")
+        tags_entry = ttk.Entry(dialog, textvariable=tags_var)
+        tags_entry.pack(fill="x")
+        SuggestPopup(
+            tags_entry,
+            tags_var,
+            index_fetch(suggest_index, ["tag"], connect=connect),
+            separator=",",
+        )
 
         ttk.Label(dialog, text="Описание").pack(anchor="w")
         desc_text = tk.Text(dialog, height=5)
@@ -732,7 +890,7 @@ class LibraryApp(tk.Tk):
                 new_lang,
                 bnf_path,
                 new_tags,
-            )
+            ).result()
 
             # обновляем bnf-файл
             if bnf_path and os.path.exists(bnf_path):
@@ -749,8 +907,7 @@ class LibraryApp(tk.Tk):
                             "tags": new_tags,
                         }
                     )
-                    with open(bnf_path, "w", encoding="utf-8") as f:
-                        json.dump(data, f, ensure_ascii=False, indent=2)
+                    write_bnf(bnf_path, data, indent=2)
                 except Exception as e:
                     messagebox.showerror("Ошибка", f"Не удалось обновить .bnf: {e}")
 
@@ -806,7 +963,7 @@ class LibraryApp(tk.Tk):
                     lang=data.get("lang"),
                     bnf_path=filepath,
                     tags=data.get("tags", []),
-                )
+                ).result()
                 self.refresh_books()
                 messagebox.showinfo("Импорт", f"Импортировано: {data.get('title')}")
             except Exception as e:
@@ -821,46 +978,69 @@ class LibraryApp(tk.Tk):
         if not folder:
             return
 
-        thread = threading.Thread(
-            target=self._scan_folder_worker, args=(folder,), daemon=True
+        # если эта папка уже сканируется — просто показываем её прогресс
+        self.scan_job = scan_manager.start(
+            folder, self._scan_folder_worker, on_done=self._after_scan
         )
-        thread.start()
-
-    def _scan_folder_worker(self, folder):
-        count = 0
-
-        for root, _, files in os.walk(folder):
-            for file in files:
-                if file.endswith(".bnf"):
-                    try:
-                        with open(os.path.join(root, file), "r", encoding="utf-8") as f:
-                            data = json.load(f)
-
-                        add_or_update_book(
-                            data.get("title", ""),
-                            data.get("orig_name", ""),
-                            data.get("author", ""),
-                            data.get("description", ""),
-                            lang=data.get("lang"),
-                            bnf_path=os.path.join(root, file),
-                            tags=data.get("tags", []),
-                        )
-                        count += 1
-                    except Exception as e:
-                        print(f"Ошибка {file}: {e}")
-
+        self.scan_progress.pack(side=tk.RIGHT, padx=5)
+        self.scan_cancel_button.pack(side=tk.RIGHT)
+        # за одним сканированием следит один цикл опроса, иначе итог
+        # показывался бы столько раз, сколько раз нажали «сканировать»
+        if getattr(self, "_polled_job", None) is not self.scan_job:
+            self._polled_job = self.scan_job
+            self._poll_scan(self.scan_job)
+
+    def cancel_scan(self):
+        if getattr(self, "scan_job", None):
+            self.scan_job.cancel()
+
+    def _scan_folder_worker(self, job):
+        scan_library(job.folder, job, add_or_update_book)
         check_db_files_exist()
+        writer.call(update_statistics)
+        writer.call(prune_change_log)
+
+    def _after_scan(self, job):
+        """Долгие расчёты по текстам — в фоне, когда сканирование уже завершено"""
+        if job.state == "done":
+            text_stats.start_backfill(connect)
+            dedup.start_refresh(connect)
+
+    def _poll_scan(self, job):
+        """Вызывается в главном потоке, пока идёт сканирование job"""
+        p = job.snapshot()
+        self.scan_progress.configure(maximum=max(p["discovered"], 1), value=p["written"])
+        status = f"Сканирование: {p['written']}/{p['discovered']}, {p['rate']} книг/с"
+        if p["eta"] is not None:
+            status += f", осталось ~{int(p['eta'])} с"
+        self.status_var.set(status)
+
+        if p["state"] == "running":
+            self.after(200, self._poll_scan, job)
+        else:
+            if self._polled_job is job:
+                self._polled_job = None
+            self._scan_folder_done(p)
 
-        # передаём результат в главный поток
-        self.after(0, self._scan_folder_done, count)
-
-    def _scan_folder_done(self, count):
+    def _scan_folder_done(self, p):
+        self.scan_progress.pack_forget()
+        self.scan_cancel_button.pack_forget()
         self.refresh_books()
-        messagebox.showinfo("Сканирование", f"Добавлено или обновлено {count} книг")
+        if p["state"] == "cancelled":
+            messagebox.showinfo(
+                "Сканирование", f"Отменено, записано {p['written']} книг"
+            )
+        elif p["state"] == "failed":
+            messagebox.showerror("Сканирование", p["error"])
+        else:
+            messagebox.showinfo(
+                "Сканирование", f"Добавлено или обновлено {p['written']} книг"
+            )
 
 
 if __name__ == "__main__":
     init_db()
+    writer.start()
     app = LibraryApp()
     app.mainloop()
     style = ttk.Style()
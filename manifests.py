@@ -0,0 +1,107 @@
+"""Упакованные манифесты: все .bnf папки библиотеки в одном файле.
+
+Сканирование сохраняет в каждой папке .library-manifest.jsonl — строку на
+каждый .bnf с его mtime, размером и содержимым. Холодный импорт (новая БД)
+читает один файл на папку вместо тысяч мелких .bnf и открывает отдельный
+.bnf только там, где mtime или размер разошлись с манифестом.
+
+Включается переменной окружения LIBRARY_MANIFESTS=1: манифесты пишутся
+рядом с файлами пользователя.
+"""
+
+import json
+import os
+import stat
+import tempfile
+
+import metrics
+
+ENABLED = os.environ.get("LIBRARY_MANIFESTS", "0") == "1"
+MANIFEST_NAME = ".library-manifest.jsonl"
+FORMAT_VERSION = 1
+
+manifest_entries = metrics.counter(
+    "library_manifest_entries_total", ".bnf reads served from manifests by result"
+)
+
+
+def load(folder):
+    """имя .bnf → (mtime_ns, size, данные); пусто, если манифеста нет или он битый"""
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != FORMAT_VERSION:
+                return {}
+            entries = {}
+            for line in f:
+                name, mtime_ns, size, data = json.loads(line)
+                entries[name] = (mtime_ns, size, data)
+            return entries
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def save(folder, entries):
+    """Атомарно переписывает манифест папки; False, если папка только для чтения"""
+    lines = [json.dumps({"version": FORMAT_VERSION}) + "\n"]
+    for name in sorted(entries):
+        lines.append(
+            json.dumps([name, *entries[name]], ensure_ascii=False, separators=(",", ":"))
+            + "\n"
+        )
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f"{MANIFEST_NAME}.", suffix=".tmp", dir=folder
+        )
+    except OSError:
+        return False
+    path = os.path.join(folder, MANIFEST_NAME)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        # mkstemp создаёт файл с правами 0600 — как в bnf_io.write_bnf
+        mode = stat.S_IMODE(os.stat(path).st_mode) if os.path.exists(path) else 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+class DirectoryReader:
+    """Чтение .bnf одной папки через её манифест.
+
+    Для каждого файла сверяются mtime и размер; совпало — данные берутся
+    из манифеста, иначе файл читается. save() после прохода по папке
+    обновляет манифест, если что-то изменилось.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.old = load(folder) if ENABLED else {}
+        self.entries = {}
+
+    def read(self, name):
+        path = os.path.join(self.folder, name)
+        if not ENABLED:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        st = os.stat(path)
+        entry = self.old.get(name)
+        if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+            manifest_entries.inc(result="hit")
+            self.entries[name] = entry
+            return entry[2]
+        manifest_entries.inc(result="miss")
+        with open(path, "r", encoding="utf-8") as f:
+            # mtime того содержимого, которое прочитали
+            st = os.fstat(f.fileno())
+            data = json.load(f)
+        self.entries[name] = (st.st_mtime_ns, st.st_size, data)
+        return data
+
+    def save(self):
+        if ENABLED and self.entries != self.old:
+            save(self.folder, self.entries)
@@ -0,0 +1,242 @@
+"""Простейшие метрики в памяти процесса и вывод в формате Prometheus."""
+
+import re
+import sqlite3
+import threading
+import time
+
+_lock = threading.Lock()
+_metrics = {}  # имя → метрика, в порядке регистрации
+_collectors = []  # функции, возвращающие строки метрик на момент вывода
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}  # кортеж меток → значение
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        return [f"{self.name}{_label_str(k)} {v}" for k, v in self.values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        return [f"{self.name}{_label_str(k)} {v}" for k, v in self.values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # [счётчики по корзинам..., сумма, количество]
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        lines = []
+        for key, counts in self.values.items():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(
+                    f"{self.name}_bucket{_label_str(key + (('le', bound),))} {count}"
+                )
+            lines.append(
+                f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {counts[-1]}"
+            )
+            lines.append(f"{self.name}_sum{_label_str(key)} {counts[-2]:.6f}")
+            lines.append(f"{self.name}_count{_label_str(key)} {counts[-1]}")
+        return lines
+
+
+def _register(metric):
+    with _lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name, help_text):
+    return _register(Counter(name, help_text))
+
+
+def gauge(name, help_text):
+    return _register(Gauge(name, help_text))
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help_text, buckets))
+
+
+def register_collector(fn):
+    """fn() → список строк в формате Prometheus, вызывается при каждом выводе"""
+    _collectors.append(fn)
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            lines += metric.header()
+            lines += metric.render()
+    for fn in _collectors:
+        lines += fn()
+    return "\n".join(lines) + "\n"
+
+
+# --- SQL ---
+sql_statements = counter(
+    "library_sql_statements_total", "SQL statements started (trace callback)"
+)
+sql_vm_steps = counter(
+    "library_sql_vm_steps_total", "SQLite VM instructions (progress handler)"
+)
+sql_duration = histogram(
+    "library_sql_duration_seconds", "SQL statement time including fetch"
+)
+
+_PROGRESS_STEPS = 1000
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+([\w\"]+)", re.IGNORECASE)
+
+
+def statement_label(sql):
+    """Короткая метка запроса: «select:books», «insert:tags», …"""
+    sql = sql.lstrip()
+    if sql.startswith("--"):  # операторы внутри триггеров
+        return "trigger"
+    verb = sql.split(None, 1)[0].lower() if sql else ""
+    match = _TABLE_RE.search(sql)
+    return f"{verb}:{match.group(1).strip(chr(34))}" if match else verb
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий время execute + fetch по каждой метке запроса"""
+
+    _label = None
+    _elapsed = 0.0
+
+    def _flush(self):
+        if self._label is not None:
+            sql_duration.observe(self._elapsed, statement=self._label)
+            self._label = None
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def execute(self, sql, *args):
+        self._flush()
+        self._label, self._elapsed = statement_label(sql), 0.0
+        self._timed(super().execute, sql, *args)
+        return self
+
+    def executemany(self, sql, *args):
+        self._flush()
+        self._label, self._elapsed = statement_label(sql), 0.0
+        self._timed(super().executemany, sql, *args)
+        return self
+
+    def fetchone(self):
+        return self._timed(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(super().fetchmany, *args)
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._flush()
+        return rows
+
+    def close(self):
+        self._flush()
+        super().close()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Фабрика соединений для sqlite3.connect(..., factory=TimedConnection)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        def on_progress():
+            sql_vm_steps.inc(_PROGRESS_STEPS)
+            return 0  # 0 — продолжать выполнение
+
+        self.set_trace_callback(
+            lambda sql: sql_statements.inc(statement=statement_label(sql))
+        )
+        self.set_progress_handler(on_progress, _PROGRESS_STEPS)
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+
+def summary():
+    """Короткая текстовая сводка для панели статуса desktop-приложения"""
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            if isinstance(metric, Histogram):
+                for key, counts in sorted(
+                    metric.values.items(), key=lambda kv: -kv[1][-2]
+                )[:10]:
+                    label = ",".join(str(v) for _, v in key)
+                    avg = counts[-2] / counts[-1] * 1000 if counts[-1] else 0
+                    lines.append(
+                        f"{metric.name} [{label}]: {counts[-1]} шт., "
+                        f"всего {counts[-2] * 1000:.1f} мс, среднее {avg:.2f} мс"
+                    )
+            else:
+                for key, value in metric.values.items():
+                    label = ",".join(str(v) for _, v in key)
+                    lines.append(f"{metric.name} [{label}]: {value}")
+    for fn in _collectors:
+        lines += [line for line in fn() if not line.startswith("#")]
+    return "\n".join(lines)
@@ -0,0 +1,468 @@
+"""Версионированные миграции схемы БД.
+
+Номер применённой миграции хранится в PRAGMA user_version. Каждая миграция
+выполняется ровно один раз в своей транзакции вместе с записью нового номера,
+поэтому прерванный запуск не оставляет схему в промежуточном состоянии.
+Проверка планов запросов: python -m bench.check_query_plans
+"""
+
+import sqlite3
+
+
+# длина описания в списках книг (остальное — на странице книги)
+SNIPPET_CHARS = 160
+# тег с таким числом книг и меньше — «редкий» для пересчёта похожих книг
+RARE_TAG_BOOKS = 50
+
+
+def fold_title(title):
+    """Ключ названия: порядок совпадает с коллацией UNI_NOCASE"""
+    return ("" if title is None else str(title)).casefold()
+
+
+def description_snippet(description):
+    """Начало описания одной строкой для списков"""
+    text = " ".join(("" if description is None else str(description)).split())
+    if len(text) <= SNIPPET_CHARS:
+        return text
+    return text[: SNIPPET_CHARS - 1].rstrip() + "…"
+
+
+def _base_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            orig_name TEXT,
+            author TEXT,
+            description TEXT,
+            lang TEXT,
+            bnf_path TEXT,
+            favorite INTEGER DEFAULT 0
+        )
+        """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE
+    )
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_books_author_title ON books (author, title)
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS book_tags (
+        book_id INTEGER,
+        tag_id INTEGER,
+        UNIQUE(book_id, tag_id),
+        FOREIGN KEY(book_id) REFERENCES books(id) ON DELETE CASCADE,
+        FOREIGN KEY(tag_id) REFERENCES tags(id) ON DELETE CASCADE
+    )
+    """)
+
+
+def _authors(cur):
+    """Справочник авторов и перенос в него авторов из books.author"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS authors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            key TEXT UNIQUE,
+            book_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    if "author_id" not in _columns(cur, "books"):
+        cur.execute(
+            "ALTER TABLE books ADD COLUMN author_id INTEGER REFERENCES authors(id)"
+        )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_books_author_id ON books (author_id, title)"
+    )
+
+    # счётчики книг ведут триггеры — любая запись в books их обновляет
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_books_author_ins AFTER INSERT ON books
+        WHEN NEW.author_id IS NOT NULL
+        BEGIN
+            UPDATE authors SET book_count = book_count + 1 WHERE id = NEW.author_id;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_books_author_del AFTER DELETE ON books
+        WHEN OLD.author_id IS NOT NULL
+        BEGIN
+            UPDATE authors SET book_count = book_count - 1 WHERE id = OLD.author_id;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_books_author_upd AFTER UPDATE OF author_id ON books
+        WHEN OLD.author_id IS NOT NEW.author_id
+        BEGIN
+            UPDATE authors SET book_count = book_count - 1 WHERE id = OLD.author_id;
+            UPDATE authors SET book_count = book_count + 1 WHERE id = NEW.author_id;
+        END
+    """)
+
+    # правила authors.fold_author на момент миграции — повторены здесь, чтобы
+    # их последующие изменения не меняли уже выпущенную миграцию
+    cur.execute("SELECT key, id FROM authors")
+    author_ids = dict(cur.fetchall())
+    cur.execute("SELECT id, author FROM books WHERE author_id IS NULL ORDER BY id")
+    rows = cur.fetchall()
+    for book_id, author in rows:
+        name = " ".join(("" if author is None else str(author)).split())
+        key = name.casefold()
+        if key not in author_ids:
+            cur.execute("INSERT INTO authors (name, key) VALUES (?, ?)", (name, key))
+            author_ids[key] = cur.lastrowid
+        cur.execute(
+            "UPDATE books SET author_id=? WHERE id=?", (author_ids[key], book_id)
+        )
+    if rows:
+        cur.execute("""
+            UPDATE authors SET book_count = (
+                SELECT COUNT(*) FROM books WHERE books.author_id = authors.id
+            )
+        """)
+
+
+def _lookup_indexes(cur):
+    """Ключ названия и индексы под все выборки списка, watcher и сканирования"""
+    if "title_key" not in _columns(cur, "books"):
+        cur.execute("ALTER TABLE books ADD COLUMN title_key TEXT")
+    cur.execute("SELECT id, title FROM books")
+    cur.executemany(
+        "UPDATE books SET title_key=? WHERE id=?",
+        [(fold_title(title), book_id) for book_id, title in cur.fetchall()],
+    )
+
+    # поиск книги при записи и список, отсортированный по названию
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_books_title_key ON books (title_key, author_id)"
+    )
+    # книги автора сразу в порядке названий
+    cur.execute("DROP INDEX IF EXISTS idx_books_author_id")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_books_author_title_key ON books (author_id, title_key)"
+    )
+    # удаление по пути (watcher) и проверка файлов (покрывающий: id — rowid)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_books_bnf_path ON books (bnf_path)")
+    # избранное — малая доля книг, частичный индекс сразу упорядочен
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_books_favorite ON books (title_key) WHERE favorite=1"
+    )
+    # книги по тегу и каскадное удаление тега
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_tags_tag ON book_tags (tag_id, book_id)"
+    )
+
+
+def _change_log(cur):
+    """Журнал изменений книг для снимка каталога (catalog_cache.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL
+        )
+    """)
+    # повторное сканирование перезаписывает книги теми же значениями —
+    # такие UPDATE поколение не сдвигают
+    changed = " OR ".join(
+        f"OLD.{c} IS NOT NEW.{c}"
+        for c in (
+            "title",
+            "orig_name",
+            "author",
+            "description",
+            "lang",
+            "bnf_path",
+            "favorite",
+        )
+    )
+    for table, event, when, row in (
+        ("books", "INSERT", "", "NEW.id"),
+        ("books", "UPDATE", f"WHEN {changed}", "NEW.id"),
+        ("books", "DELETE", "", "OLD.id"),
+        ("book_tags", "INSERT", "", "NEW.book_id"),
+        ("book_tags", "DELETE", "", "OLD.book_id"),
+    ):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_log_{event.lower()} AFTER {event} ON {table}
+            {when}
+            BEGIN
+                INSERT INTO change_log (book_id) VALUES ({row});
+            END
+        """)
+
+
+def _book_search(cur):
+    """Триграммный индекс FTS5 для поиска (text_search.py)"""
+    try:
+        cur.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS book_search USING fts5(
+                title, orig_name, author, tags, description, tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError:
+        # SQLite без FTS5 или старше 3.34 — поиск останется на LIKE
+        return
+    # книги, ждущие переиндексации до конца транзакции писателя
+    cur.execute("CREATE TABLE IF NOT EXISTS search_dirty (book_id INTEGER PRIMARY KEY)")
+    # те же поля, что пишет text_search.flush_pending
+    cur.execute("DELETE FROM book_search")
+    cur.execute("""
+        INSERT INTO book_search (rowid, title, orig_name, author, tags, description)
+        SELECT id, title, orig_name, author, (
+            SELECT group_concat(tags.name, ', ') FROM book_tags
+            JOIN tags ON tags.id = book_tags.tag_id
+            WHERE book_tags.book_id = books.id
+        ), description
+        FROM books
+    """)
+
+
+def _reading_positions(cur):
+    """Позиции чтения по версиям текста (reading_positions.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS reading_positions (
+            book_id INTEGER NOT NULL,
+            version TEXT NOT NULL,
+            anchor TEXT,
+            line INTEGER NOT NULL DEFAULT 1,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (book_id, version)
+        ) WITHOUT ROWID
+    """)
+    # внешние ключи в соединениях не включены — чистим сами
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_books_positions_del AFTER DELETE ON books
+        BEGIN
+            DELETE FROM reading_positions WHERE book_id = OLD.id;
+        END
+    """)
+
+
+def _description_snippet(cur):
+    """Короткое описание для списков — без чтения полного description"""
+    if "description_snippet" not in _columns(cur, "books"):
+        cur.execute("ALTER TABLE books ADD COLUMN description_snippet TEXT")
+    cur.execute("SELECT id, description FROM books")
+    cur.executemany(
+        "UPDATE books SET description_snippet=? WHERE id=?",
+        [(description_snippet(d), book_id) for book_id, d in cur.fetchall()],
+    )
+
+
+def _book_neighbors(cur):
+    """Похожие книги по тегам и очередь их пересчёта (recommend.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS book_neighbors (
+            book_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            neighbor_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (book_id, rank)
+        ) WITHOUT ROWID
+    """)
+    # чьи списки задевает изменение книги
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_book_neighbors_neighbor ON book_neighbors (neighbor_id)"
+    )
+    cur.execute("CREATE TABLE IF NOT EXISTS neighbors_dirty (book_id INTEGER PRIMARY KEY)")
+    # у редкого тега вместе с числом книг заметно меняется вес (IDF) — его
+    # книги тоже пересчитываются; у частого тега одна книга вес почти не двигает
+    for event, row in (("INSERT", "NEW"), ("DELETE", "OLD")):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_book_tags_neighbors_{event.lower()}
+            AFTER {event} ON book_tags
+            BEGIN
+                INSERT OR IGNORE INTO neighbors_dirty (book_id) VALUES ({row}.book_id);
+                INSERT OR IGNORE INTO neighbors_dirty (book_id)
+                    SELECT book_id FROM book_tags
+                    WHERE tag_id = {row}.tag_id
+                      AND (SELECT COUNT(*) FROM (
+                               SELECT 1 FROM book_tags WHERE tag_id = {row}.tag_id
+                               LIMIT {RARE_TAG_BOOKS + 1}
+                           )) <= {RARE_TAG_BOOKS};
+            END
+        """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_books_neighbors_del AFTER DELETE ON books
+        BEGIN
+            INSERT OR IGNORE INTO neighbors_dirty (book_id)
+                SELECT book_id FROM book_neighbors WHERE neighbor_id = OLD.id;
+            DELETE FROM book_neighbors WHERE book_id = OLD.id OR neighbor_id = OLD.id;
+            DELETE FROM neighbors_dirty WHERE book_id = OLD.id;
+        END
+    """)
+    # первый расчёт — в фоне, пачками (см. recommend.refresh_neighbors)
+    cur.execute("INSERT OR IGNORE INTO neighbors_dirty (book_id) SELECT id FROM books")
+
+
+def _text_signatures(cur):
+    """Кэш MinHash-подписей текстов по mtime и размеру файла (dedup.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS text_signatures (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            signature BLOB
+        ) WITHOUT ROWID
+    """)
+
+
+def _text_stats(cur):
+    """Статистика текстов книг по версиям (text_stats.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS text_stats (
+            book_id INTEGER NOT NULL,
+            version TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            words INTEGER NOT NULL,
+            chars INTEGER NOT NULL,
+            headings INTEGER NOT NULL,
+            PRIMARY KEY (book_id, version)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_books_text_stats_del AFTER DELETE ON books
+        BEGIN
+            DELETE FROM text_stats WHERE book_id = OLD.id;
+        END
+    """)
+    # объём книги виден в списках — снимок каталога должен его перечитать;
+    # повторный подсчёт с тем же результатом поколение не сдвигает
+    for event, when, row in (
+        ("INSERT", "", "NEW.book_id"),
+        ("UPDATE", "WHEN OLD.words IS NOT NEW.words", "NEW.book_id"),
+        ("DELETE", "", "OLD.book_id"),
+    ):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_text_stats_log_{event.lower()}
+            AFTER {event} ON text_stats
+            {when}
+            BEGIN
+                INSERT INTO change_log (book_id) VALUES ({row});
+            END
+        """)
+    # заполняет text_stats.backfill: подсчёт читает все тексты
+
+
+def _text_duplicates(cur):
+    """Найденные пары похожих текстов и время расчёта (dedup.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS text_duplicates (
+            book_a INTEGER NOT NULL,
+            version_a TEXT,
+            book_b INTEGER NOT NULL,
+            version_b TEXT,
+            score REAL NOT NULL
+        )
+    """)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_text_duplicates_a ON text_duplicates(book_a)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_text_duplicates_b ON text_duplicates(book_b)"
+    )
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dedup_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            computed_at REAL NOT NULL,
+            texts INTEGER NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_books_text_duplicates_del AFTER DELETE ON books
+        BEGIN
+            DELETE FROM text_duplicates WHERE book_a = OLD.id OR book_b = OLD.id;
+        END
+    """)
+    # заполняет dedup.refresh: после сканирования или из командной строки
+
+
+def _book_tags_version(cur):
+    """Счётчик изменений связей книга–тег для матрицы похожих книг (recommend.py)"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS book_tags_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO book_tags_version (id, version) VALUES (1, 0)")
+    # матрица зависит от связей и от числа книг (IDF); избранное, описания и
+    # статистика текстов её не меняют и счётчик не двигают
+    for table, event in (
+        ("book_tags", "INSERT"),
+        ("book_tags", "DELETE"),
+        ("books", "INSERT"),
+        ("books", "DELETE"),
+    ):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE book_tags_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+
+
+# (версия, функция) — только добавлять в конец, применённые не менять
+MIGRATIONS = [
+    (1, _base_schema),
+    (2, _authors),
+    (3, _lookup_indexes),
+    (4, _change_log),
+    (5, _book_search),
+    (6, _reading_positions),
+    (7, _description_snippet),
+    (8, _book_neighbors),
+    (9, _text_signatures),
+    (10, _text_stats),
+    (11, _text_duplicates),
+    (12, _book_tags_version),
+]
+
+
+def _columns(cur, table):
+    return [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Применяет недостающие миграции; возвращает список применённых версий"""
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # транзакциями управляем сами
+    applied = []
+    try:
+        cur = conn.cursor()
+        for version, fn in MIGRATIONS:
+            if schema_version(conn) >= version:
+                continue
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                # другой процесс мог успеть раньше, пока ждали блокировку
+                if schema_version(conn) < version:
+                    fn(cur)
+                    cur.execute(f"PRAGMA user_version = {version}")
+                    applied.append(version)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        if applied:
+            update_statistics(cur)
+        cur.execute("PRAGMA optimize")
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def update_statistics(cur):
+    """ANALYZE для планировщика; вызывается после миграций и сканирования"""
+    cur.execute("PRAGMA analysis_limit = 1000")
+    cur.execute("ANALYZE")
@@ -0,0 +1,250 @@
+"""Наблюдение за библиотекой опросом — для SMB/NFS, где inotify молчит.
+
+Снимок библиотеки (папка → mtime, файлы с mtime/размером/inode, подпапки)
+хранится на диске. Каждый проход заново перечитывает только папки, у которых
+сменился mtime: добавление, удаление и переименование файла меняют mtime
+папки. Правка файла на месте его не меняет, поэтому раз в FULL_CHECK_EVERY
+проходов сверяются файлы всех папок. Разница снимков превращается в те же
+события watchdog (создание, изменение, удаление, перемещение по inode) и
+передаётся обработчику LibraryWatcher, а он кладёт их в общую очередь.
+
+Режим выбирается переменной LIBRARY_WATCH_MODE: auto (опрос для сетевых
+файловых систем), poll или inotify. Интервал — LIBRARY_POLL_INTERVAL
+(секунды), доля времени на обход — LIBRARY_POLL_BUDGET.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from watchdog.events import (
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+import metrics
+
+WATCH_MODE = os.environ.get("LIBRARY_WATCH_MODE", "auto")
+POLL_INTERVAL = float(os.environ.get("LIBRARY_POLL_INTERVAL", "30"))
+# обход занимает не больше этой доли времени, остальное — паузы
+POLL_BUDGET = float(os.environ.get("LIBRARY_POLL_BUDGET", "0.1"))
+# каждый N-й проход сверяет файлы во всех папках, а не только в изменённых
+FULL_CHECK_EVERY = 10
+SNAPSHOT_FILE = "library.snapshot.json"
+SNAPSHOT_VERSION = 1
+
+NETWORK_FILESYSTEMS = {
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "fuse.sshfs",
+    "9p",
+    "afs",
+}
+
+poll_events = metrics.counter(
+    "library_poll_events_total", "Events produced by the polling watcher"
+)
+poll_duration = metrics.histogram(
+    "library_poll_seconds", "Polling watcher pass time (including throttling)"
+)
+
+
+def filesystem_type(path):
+    """Тип файловой системы по /proc/mounts или None (не Linux)"""
+    try:
+        with open("/proc/mounts", "r", encoding="utf-8") as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    for mount, kind in mounts:
+        mount = mount.replace("\\040", " ")
+        inside = path == mount or path.startswith(mount.rstrip("/") + "/")
+        if inside and len(mount) > len(best):
+            best, fstype = mount, kind
+    return fstype
+
+
+def use_polling(root):
+    if WATCH_MODE == "poll":
+        return True
+    if WATCH_MODE == "inotify":
+        return False
+    return filesystem_type(root) in NETWORK_FILESYSTEMS
+
+
+class PollingWatcher:
+    def __init__(
+        self,
+        handler,
+        root,
+        interval=POLL_INTERVAL,
+        budget=POLL_BUDGET,
+        snapshot_file=SNAPSHOT_FILE,
+    ):
+        self.handler = handler
+        self.root = os.path.abspath(root)
+        self.interval = interval
+        self.budget = min(max(budget, 0.01), 1.0)
+        self.snapshot_file = snapshot_file
+        # относительный путь папки → [mtime_ns, {имя: [mtime_ns, size, inode]}, [подпапки]]
+        self.dirs = self._load()
+        self._polls = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._resumed = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="library-poll", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Ошибка опроса {self.root}: {e}")
+            self._stop.wait(self.interval)
+
+    def _load(self):
+        try:
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != SNAPSHOT_VERSION or data.get("root") != self.root:
+            return None
+        return data["dirs"]
+
+    def _save(self):
+        payload = json.dumps(
+            {"version": SNAPSHOT_VERSION, "root": self.root, "dirs": self.dirs},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        folder = os.path.dirname(os.path.abspath(self.snapshot_file))
+        fd, tmp_path = tempfile.mkstemp(prefix=".snapshot.", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_path, self.snapshot_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _throttle(self):
+        """Пауза, чтобы обход занимал не больше budget от времени"""
+        worked = time.monotonic() - self._resumed
+        if worked >= 0.05 and self.budget < 1.0:
+            self._stop.wait(worked * (1 - self.budget) / self.budget)
+            self._resumed = time.monotonic()
+
+    def _scan_dir(self, rel, st):
+        path = os.path.join(self.root, rel)
+        files = {}
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.handler.wanted_dir(entry.path):
+                            subdirs.append(entry.name)
+                    elif entry.is_file() and self.handler.wanted(entry.path):
+                        est = entry.stat()
+                        files[entry.name] = [est.st_mtime_ns, est.st_size, est.st_ino]
+                except OSError:
+                    continue  # файл удалили, пока читали папку
+        return [st.st_mtime_ns, files, sorted(subdirs)]
+
+    def poll(self):
+        """Один проход; возвращает количество отправленных событий"""
+        started = self._resumed = time.monotonic()
+        old = self.dirs
+        full = old is None or self._polls % FULL_CHECK_EVERY == 0
+        self._polls += 1
+
+        new = {}
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            try:
+                # mtime берём до чтения списка: изменение между ними
+                # просто вызовет повторное чтение в следующий раз
+                st = os.stat(os.path.join(self.root, rel))
+            except OSError:
+                continue
+            entry = old.get(rel) if old else None
+            if entry is not None and entry[0] == st.st_mtime_ns and not full:
+                new[rel] = entry
+            else:
+                try:
+                    new[rel] = self._scan_dir(rel, st)
+                except OSError:
+                    continue
+                self._throttle()
+            stack.extend(os.path.join(rel, d) for d in new[rel][2])
+
+        changed = old is None or new.keys() != old.keys()
+        events = []
+        if old is not None:
+            before, after = {}, {}
+            for rel, entry in old.items():
+                if new.get(rel) is not entry:
+                    before.update((os.path.join(rel, n), f) for n, f in entry[1].items())
+            for rel, entry in new.items():
+                if old.get(rel) is not entry:
+                    changed = changed or old.get(rel) != entry
+                    after.update((os.path.join(rel, n), f) for n, f in entry[1].items())
+            events = self._diff(before, after)
+        self.dirs = new
+        if changed:
+            self._save()
+
+        for event in events:
+            poll_events.inc(type=event.event_type)
+            try:
+                self.handler.dispatch(event)
+            except Exception as e:
+                print(f"Ошибка обработки {event.src_path}: {e}")
+        poll_duration.observe(time.monotonic() - started)
+        return len(events)
+
+    def _diff(self, before, after):
+        """События watchdog по разнице файлов изменённых папок"""
+        deleted = [p for p in before if p not in after]
+        created = {p: after[p] for p in after if p not in before}
+        # тот же inode, размер и mtime на новом месте — перемещение
+        by_inode = {(f[2], f[1], f[0]): p for p, f in created.items()}
+        events = []
+        for path in deleted:
+            f = before[path]
+            dest = by_inode.pop((f[2], f[1], f[0]), None)
+            if dest is not None:
+                del created[dest]
+                events.append(FileMovedEvent(self._abs(path), self._abs(dest)))
+            else:
+                events.append(FileDeletedEvent(self._abs(path)))
+        events.extend(FileCreatedEvent(self._abs(p)) for p in created)
+        events.extend(
+            FileModifiedEvent(self._abs(p))
+            for p in after
+            if p in before and before[p] != after[p]
+        )
+        return events
+
+    def _abs(self, rel):
+        return os.path.join(self.root, rel)
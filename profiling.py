@@ -0,0 +1,170 @@
+"""Профилирование отдельных запросов веб-сервера по требованию.
+
+Включается переменной окружения LIBRARY_PROFILE=1 (профилируется каждый
+запрос) или параметром ?profile=1 вместе с ?token=<LIBRARY_ADMIN_TOKEN>.
+Для каждого запроса пишутся .prof (cProfile) и .collapsed (стеки в формате
+flamegraph.pl / speedscope, собранные сэмплированием). Потоковые ответы
+(Server-Sent Events, файлы) и /metrics отдаются как есть, без профиля.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from urllib.parse import parse_qs
+
+from werkzeug.wsgi import ClosingIterator
+
+PROFILE_ALL = os.environ.get("LIBRARY_PROFILE") == "1"
+PROFILE_DIR = os.environ.get("LIBRARY_PROFILE_DIR", "profiles")
+ADMIN_TOKEN = os.environ.get("LIBRARY_ADMIN_TOKEN", "")
+SAMPLE_INTERVAL = 0.001
+KEEP_PROFILES = 200
+# пути, которые не профилируются никогда
+SKIP_PATHS = ("/debug/profiles", "/metrics")
+
+
+def is_admin(args):
+    """args — словарь параметров запроса (request.args или parse_qs)"""
+    token = args.get("token")
+    if isinstance(token, list):
+        token = token[0]
+    return bool(ADMIN_TOKEN) and token == ADMIN_TOKEN
+
+
+def profiles_enabled(args):
+    return PROFILE_ALL or is_admin(args)
+
+
+class _StackSampler(threading.Thread):
+    """Снимает стек профилируемого потока каждые SAMPLE_INTERVAL секунд"""
+
+    def __init__(self, thread_id):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class ProfilingMiddleware:
+    """WSGI-обёртка: профилирует весь запрос, включая рендеринг шаблона"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        args = parse_qs(environ.get("QUERY_STRING", ""))
+        path = environ.get("PATH_INFO", "")
+        wanted = PROFILE_ALL or (args.get("profile") == ["1"] and is_admin(args))
+        if not wanted or path.startswith(SKIP_PATHS):
+            return self.wsgi_app(environ, start_response)
+
+        headers = {}
+
+        def capture(status, response_headers, *args):
+            headers.update((k.lower(), v) for k, v in response_headers)
+            return start_response(status, response_headers, *args)
+
+        profiler = cProfile.Profile()
+        sampler = _StackSampler(threading.get_ident())
+        sampler.start()
+        started = time.perf_counter()
+        profiler.enable()
+        body = None
+        try:
+            result = self.wsgi_app(environ, capture)
+            if _streaming(headers, result):
+                return result
+            # тело ответа материализуем здесь, чтобы в профиль попал рендеринг
+            try:
+                body = list(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        finally:
+            profiler.disable()
+            sampler.stop()
+            if body is not None:
+                _save(profiler, sampler.stacks, path, time.perf_counter() - started)
+        return body
+
+
+def _streaming(headers, result):
+    """Ответ, который нельзя собрать в память: поток событий или файл
+    (direct_passthrough — werkzeug отдаёт его без ClosingIterator)"""
+    if headers.get("content-type", "").startswith("text/event-stream"):
+        return True
+    return not isinstance(result, (list, ClosingIterator))
+
+
+def _save(profiler, stacks, path, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = path.strip("/").replace("/", "_") or "index"
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+    name = f"{stamp}-{int(elapsed * 1000)}ms-{slug}"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name + ".prof"))
+    with open(os.path.join(PROFILE_DIR, name + ".collapsed"), "w") as f:
+        for stack, count in stacks.items():
+            f.write(f"{stack} {count}\n")
+
+    # старые профили удаляем, чтобы каталог не рос бесконечно
+    captures = sorted(p for p in os.listdir(PROFILE_DIR) if p.endswith(".prof"))
+    for old in captures[:-KEEP_PROFILES]:
+        for ext in (".prof", ".collapsed"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old[: -len(".prof")] + ext))
+            except OSError:
+                pass
+
+
+_top_cache = {}  # имя файла → текст топа функций (только для файлов на диске)
+
+
+def list_profiles(limit=30, top=15):
+    """Последние профили: имя и топ функций по накопленному времени"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    on_disk = {
+        p[: -len(".prof")] for p in os.listdir(PROFILE_DIR) if p.endswith(".prof")
+    }
+    # топы удалённых профилей больше не нужны
+    for name in set(_top_cache) - on_disk:
+        _top_cache.pop(name, None)
+    names = sorted(on_disk, reverse=True)[:limit]
+    result = []
+    for name in names:
+        if name not in _top_cache:
+            out = io.StringIO()
+            stats = pstats.Stats(os.path.join(PROFILE_DIR, name + ".prof"), stream=out)
+            stats.sort_stats("cumulative").print_stats(top)
+            _top_cache[name] = out.getvalue()
+        result.append({"name": name, "top": _top_cache[name]})
+    return result
+
+
+def profile_file(name, ext):
+    """Путь к файлу профиля или None (защищает от выхода из каталога)"""
+    if ext not in (".prof", ".collapsed") or os.path.basename(name) != name:
+        return None
+    path = os.path.join(PROFILE_DIR, name + ext)
+    return path if os.path.exists(path) else None
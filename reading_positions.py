@@ -0,0 +1,80 @@
+"""Места, где остановилось чтение книги.
+
+Позиция хранится отдельно для каждой версии текста: «md» у книг ru/en и
+«ru», «en», «en-ru» у двуязычных. Страница книги копит прокрутку у себя и
+присылает позицию пачкой раз в несколько секунд или при уходе со страницы;
+сервер ставит запись в очередь писателя и отвечает сразу.
+"""
+
+import time
+
+# версии двуязычной книги (?ver=); без ver открывается параллельный текст
+EN_RU_VERSIONS = ("ru", "en", "en-ru")
+
+
+def position_version(lang, ver=None):
+    """Ключ позиции для языка книги и запрошенной версии; None — нет такой версии"""
+    if lang == "en-ru":
+        return ver if ver in EN_RU_VERSIONS else "en-ru"
+    if lang in ("ru", "en"):
+        return "md"
+    return None
+
+
+def get_positions(conn, book_id):
+    """версия → {"anchor", "line", "updated_at"} для книги"""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT version, anchor, line, updated_at FROM reading_positions
+        WHERE book_id=?
+    """,
+        (book_id,),
+    )
+    return {
+        version: {"anchor": anchor, "line": line, "updated_at": updated_at}
+        for version, anchor, line, updated_at in cur.fetchall()
+    }
+
+
+def last_version(positions):
+    """Версия, которую читали последней, или None"""
+    if not positions:
+        return None
+    return max(positions, key=lambda v: positions[v]["updated_at"])
+
+
+def parse_positions(items):
+    """Проверяет пачку от клиента: [(book_id, version, anchor, line, updated_at)]"""
+    now = time.time()
+    rows = []
+    for item in items if isinstance(items, list) else ():
+        if not isinstance(item, dict):
+            continue
+        try:
+            book_id = int(item["book_id"])
+            line = max(1, int(item.get("line") or 1))
+        except (KeyError, TypeError, ValueError):
+            continue
+        version = item.get("ver")
+        if version not in EN_RU_VERSIONS + ("md",):
+            continue
+        anchor = item.get("anchor")
+        anchor = str(anchor)[:200] if anchor else None
+        rows.append((book_id, version, anchor, line, now))
+    return rows
+
+
+def save_positions(cur, rows):
+    """Записывает позиции (команда писателя); позиции удалённых книг пропускаются"""
+    cur.executemany(
+        """
+        INSERT INTO reading_positions (book_id, version, anchor, line, updated_at)
+        SELECT ?1, ?2, ?3, ?4, ?5 WHERE EXISTS (SELECT 1 FROM books WHERE id = ?1)
+        ON CONFLICT (book_id, version) DO UPDATE SET
+            anchor = excluded.anchor,
+            line = excluded.line,
+            updated_at = excluded.updated_at
+    """,
+        rows,
+    )
@@ -0,0 +1,303 @@
+"""Похожие книги по тегам.
+
+Книга — разреженный вектор тегов с весом IDF (редкий тег говорит о книге
+больше, чем «роман»), похожесть — косинус таких векторов. Для каждой книги
+в таблице book_neighbors хранятся NEIGHBORS_K ближайших.
+
+Триггеры (см. migrations.py) помечают в neighbors_dirty книги, у которых
+изменились теги, книги редких тегов, чей вес при этом сдвинулся, и книги,
+в списках которых была удалённая книга. Писатель в конце транзакции ставит
+пересчёт в очередь, а пометки, оставленные записями других процессов, раз
+в REFRESH_INTERVAL секунд находит фоновая проверка (start_background). Одна
+команда пересчитывает не больше REFRESH_BATCH помеченных книг (остальные —
+следующими командами, чтобы не держать блокировку записи). Заодно
+пересчитываются списки, где эти книги были, а в списки их новых соседей они
+добавляются — без перебора всех пар книг.
+Небольшой сдвиг весов частых тегов при этом не учитывается: всё целиком
+пересчитывает python recommend.py --rebuild.
+"""
+
+import argparse
+import heapq
+import json
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import library_watcher
+import metrics
+from db_writer import writer
+from migrations import migrate
+
+NEIGHBORS_K = 10
+REFRESH_BATCH = 100
+# у тега с бо́льшим числом книг кандидаты не перебираются целиком: он только
+# добавляет вес кандидатам, найденным по более редким тегам
+MAX_POSTING = 1000
+# как часто фоновая проверка ищет пометки других процессов, с
+REFRESH_INTERVAL = 60
+
+neighbors_refreshed = metrics.counter(
+    "library_neighbors_refreshed_total",
+    "Books whose similar-books lists were recomputed",
+)
+neighbors_duration = metrics.histogram(
+    "library_neighbors_refresh_seconds", "Similar-books refresh command time"
+)
+
+_available = None
+_matrix_cache = (None, None)  # (версия book_tags_version, BookTagMatrix)
+_scheduled = threading.Event()
+
+
+def available(conn):
+    """Есть ли в БД таблицы соседей (миграция 8)"""
+    global _available
+    if not _available:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='book_neighbors'"
+        ).fetchone()
+        _available = row is not None
+    return _available
+
+
+class BookTagMatrix:
+    """Матрица книга × тег в виде строк (теги книги) и столбцов (книги тега)"""
+
+    def __init__(self, book_count, pairs):
+        self.rows = defaultdict(set)  # id книги → id тегов
+        columns = defaultdict(list)  # id тега → id книг по возрастанию
+        for book_id, tag_id in pairs:
+            self.rows[book_id].add(tag_id)
+            columns[tag_id].append(book_id)
+        self.columns = dict(columns)
+        # квадрат IDF: вклад общего тега в скалярное произведение
+        self.weights = {
+            tag_id: math.log((book_count + 1) / len(books)) ** 2
+            for tag_id, books in self.columns.items()
+        }
+        self.norms = {
+            book_id: math.sqrt(sum(self.weights[t] for t in tags))
+            for book_id, tags in self.rows.items()
+        }
+
+    def neighbors(self, book_id, k=NEIGHBORS_K):
+        """[(id соседа, похожесть)] по убыванию похожести"""
+        tags = self.rows.get(book_id)
+        if not tags or not self.norms[book_id]:
+            return []
+        scores = defaultdict(float)
+        for tag_id in sorted(tags, key=lambda t: len(self.columns[t])):
+            books = self.columns[tag_id]
+            weight = self.weights[tag_id]
+            if len(books) <= MAX_POSTING or not scores:
+                for other in books[:MAX_POSTING]:
+                    scores[other] += weight
+            else:
+                for other in scores:
+                    if tag_id in self.rows[other]:
+                        scores[other] += weight
+        scores.pop(book_id, None)
+        norm = self.norms[book_id]
+        best = heapq.nlargest(
+            k,
+            (
+                (score / (norm * self.norms[other]), -other)
+                for other, score in scores.items()
+                if score > 0
+            ),
+        )
+        return [(-neg_id, round(score, 4)) for score, neg_id in best]
+
+
+def _matrix(cur):
+    """Матрица текущих связей книга–тег; перечитывается, только когда они
+    изменились (счётчик book_tags_version), а не при любой записи в БД"""
+    global _matrix_cache
+    cur.execute("SELECT version FROM book_tags_version WHERE id=1")
+    version = cur.fetchone()[0]
+    cached_version, matrix = _matrix_cache
+    if matrix is None or cached_version != version:
+        cur.execute("SELECT COUNT(*) FROM books")
+        book_count = cur.fetchone()[0]
+        # строки book_tags удалённых книг (внешние ключи выключены) не берём
+        cur.execute("""
+            SELECT book_tags.book_id, book_tags.tag_id FROM book_tags
+            JOIN books ON books.id = book_tags.book_id
+            ORDER BY book_tags.tag_id, book_tags.book_id
+        """)
+        matrix = BookTagMatrix(book_count, cur.fetchall())
+        _matrix_cache = (version, matrix)
+    return matrix
+
+
+def _ids_param(ids):
+    return (json.dumps(sorted(ids)),)
+
+
+def refresh_neighbors(cur, limit=REFRESH_BATCH):
+    """Пересчитать соседей помеченных книг (команда писателя); сколько осталось"""
+    cur.execute("SELECT book_id FROM neighbors_dirty")
+    pending = {row[0] for row in cur.fetchall()}
+    if not pending:
+        return 0
+    dirty = sorted(pending)[:limit]
+    matrix = _matrix(cur)
+    rows = {book_id: matrix.neighbors(book_id) for book_id in dirty}
+
+    # списки, где была изменённая книга, пересчитываем целиком: она могла
+    # из них выпасть; ещё помеченные книги дождутся своей очереди
+    cur.execute(
+        """
+        SELECT DISTINCT book_id FROM book_neighbors
+        WHERE neighbor_id IN (SELECT value FROM json_each(?))
+    """,
+        _ids_param(dirty),
+    )
+    for (book_id,) in cur.fetchall():
+        if book_id not in pending:
+            rows[book_id] = matrix.neighbors(book_id)
+
+    # в списки своих новых соседей изменённая книга только добавляется
+    # (похожесть симметрична), остальное в них не меняется
+    added = defaultdict(list)
+    for book_id in dirty:
+        for other, score in rows[book_id]:
+            if other not in rows and other not in pending:
+                added[other].append((book_id, score))
+    if added:
+        cur.execute(
+            """
+            SELECT book_id, neighbor_id, score FROM book_neighbors
+            WHERE book_id IN (SELECT value FROM json_each(?))
+        """,
+            _ids_param(added),
+        )
+        current = defaultdict(list)
+        for book_id, other, score in cur.fetchall():
+            current[book_id].append((other, score))
+        for book_id, new in added.items():
+            replaced = {other for other, _ in new}
+            found = [item for item in current[book_id] if item[0] not in replaced]
+            found += new
+            # тот же порядок, что у BookTagMatrix.neighbors
+            found.sort(key=lambda item: (-item[1], item[0]))
+            rows[book_id] = found[:NEIGHBORS_K]
+
+    cur.execute(
+        "DELETE FROM book_neighbors WHERE book_id IN (SELECT value FROM json_each(?))",
+        _ids_param(rows),
+    )
+    cur.executemany(
+        """
+        INSERT INTO book_neighbors (book_id, rank, neighbor_id, score)
+        VALUES (?, ?, ?, ?)
+    """,
+        [
+            (book_id, rank, other, score)
+            for book_id, found in rows.items()
+            for rank, (other, score) in enumerate(found)
+        ],
+    )
+    cur.execute(
+        "DELETE FROM neighbors_dirty WHERE book_id IN (SELECT value FROM json_each(?))",
+        _ids_param(dirty),
+    )
+    neighbors_refreshed.inc(len(rows))
+    return len(pending) - len(dirty)
+
+
+def _refresh_command(cur):
+    _scheduled.clear()
+    started = time.perf_counter()
+    left = refresh_neighbors(cur)
+    neighbors_duration.observe(time.perf_counter() - started)
+    return left
+
+
+def schedule_refresh(cur):
+    """Поставить пересчёт в очередь писателя, если есть помеченные книги.
+
+    Вызывается перед COMMIT каждой транзакции писателя (в том числе после
+    самого пересчёта — так он продолжается пачками) и из start_background.
+    """
+    if _scheduled.is_set() or not available(cur.connection):
+        return
+    cur.execute("SELECT EXISTS (SELECT 1 FROM neighbors_dirty)")
+    if cur.fetchone()[0]:
+        _scheduled.set()
+        writer.submit(_refresh_command)
+
+
+def start_background(connect, interval=REFRESH_INTERVAL):
+    """Фоновый поток: при запуске и затем раз в interval секунд ставит пересчёт
+    пометок, которые оставили записи другого процесса (desktop-приложение,
+    bnf_batch) — в своём процессе их пересчитать было некому"""
+
+    def run():
+        while True:
+            conn = connect()
+            try:
+                schedule_refresh(conn.cursor())
+            except Exception as e:
+                print(f"Похожие книги: {e}")
+            finally:
+                conn.close()
+            time.sleep(interval)
+
+    threading.Thread(target=run, name="neighbors-refresh", daemon=True).start()
+
+
+def similar_books(conn, book_id):
+    """Похожие книги для страницы книги: [{"id", "title", "author", "score"}]"""
+    if not available(conn):
+        return []
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT books.id, books.title, books.author, book_neighbors.score
+        FROM book_neighbors JOIN books ON books.id = book_neighbors.neighbor_id
+        WHERE book_neighbors.book_id=?
+        ORDER BY book_neighbors.rank
+    """,
+        (book_id,),
+    )
+    return [
+        {"id": row[0], "title": row[1], "author": row[2], "score": row[3]}
+        for row in cur.fetchall()
+    ]
+
+
+def rebuild(cur):
+    """Пометить все книги для пересчёта (IDF изменился у всех)"""
+    cur.execute("DELETE FROM book_neighbors")
+    cur.execute("INSERT OR IGNORE INTO neighbors_dirty (book_id) SELECT id FROM books")
+
+
+writer.before_commit(schedule_refresh)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rebuild", action="store_true", help="пересчитать соседей всех книг"
+    )
+    args = parser.parse_args(argv)
+
+    conn = library_watcher.connect()
+    migrate(conn)
+    conn.close()
+    if args.rebuild:
+        writer.call(rebuild)
+    # пачки по очереди, пока помеченных не останется
+    while True:
+        left = writer.call(refresh_neighbors)
+        print(f"Осталось пересчитать: {left}")
+        if not left:
+            break
+
+
+if __name__ == "__main__":
+    sys.exit(main())
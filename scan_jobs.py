@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from concurrent.futures import wait
+
+import metrics
+from manifests import DirectoryReader
+
+
+class ScanCancelled(Exception):
+    pass
+
+
+class ScanJob:
+    """Состояние одного сканирования библиотеки"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.state = "running"  # running | done | cancelled | failed
+        self.discovered = 0  # найдено .bnf файлов
+        self.parsed = 0  # прочитано и поставлено в очередь записи
+        self.written = 0  # записано в БД
+        self.errors = 0
+        self.error = None
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.discovery_done = False
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """Точка кооперативной отмены — вызывается воркером между файлами"""
+        if self._cancel.is_set():
+            raise ScanCancelled()
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def elapsed(self):
+        end = self.finished_at or time.monotonic()
+        return end - self.started_at
+
+    def rate(self):
+        """Записанных книг в секунду"""
+        elapsed = self.elapsed()
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """Оценка оставшегося времени в секундах (None, пока неизвестно)"""
+        if not self.running:
+            return 0.0
+        rate = self.rate()
+        if not self.discovery_done or rate <= 0:
+            return None
+        return max(self.discovered - self.written, 0) / rate
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "folder": self.folder,
+                "state": self.state,
+                "discovered": self.discovered,
+                "parsed": self.parsed,
+                "written": self.written,
+                "errors": self.errors,
+                "error": self.error,
+                "discovery_done": self.discovery_done,
+                "elapsed": round(self.elapsed(), 2),
+                "rate": round(self.rate(), 1),
+                "eta": None if self.eta() is None else round(self.eta(), 1),
+            }
+
+
+class ScanManager:
+    """Не больше одного сканирования на библиотеку; общий для веба и Tk"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}  # путь библиотеки → последний ScanJob
+
+    @staticmethod
+    def _key(folder):
+        return os.path.realpath(folder)
+
+    def start(self, folder, target, on_done=None):
+        """Запускает target(job) в фоне или возвращает уже идущее сканирование"""
+        key = self._key(folder)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job and job.running:
+                return job
+            job = ScanJob(folder)
+            self._jobs[key] = job
+
+        def run():
+            try:
+                target(job)
+                job.state = "cancelled" if job.cancelled else "done"
+            except ScanCancelled:
+                job.state = "cancelled"
+            except Exception as e:
+                job.error = str(e)
+                job.state = "failed"
+            finally:
+                job.finished_at = time.monotonic()
+                if on_done:
+                    on_done(job)
+
+        threading.Thread(target=run, name="library-scan", daemon=True).start()
+        return job
+
+    def get(self, folder):
+        with self._lock:
+            return self._jobs.get(self._key(folder))
+
+    def cancel(self, folder):
+        job = self.get(folder)
+        if job and job.running:
+            job.cancel()
+        return job
+
+
+scan_manager = ScanManager()
+
+
+def _scan_metrics():
+    """Показатели последних сканирований для /metrics"""
+    lines = [
+        "# TYPE library_scan_files gauge",
+        "# TYPE library_scan_rate gauge",
+        "# TYPE library_scan_running gauge",
+    ]
+    with scan_manager._lock:
+        jobs = list(scan_manager._jobs.values())
+    for job in jobs:
+        p = job.snapshot()
+        label = p["folder"].replace("\\", "\\\\").replace('"', '\\"')
+        for stage in ("discovered", "parsed", "written", "errors"):
+            lines.append(
+                f'library_scan_files{{library="{label}",stage="{stage}"}} {p[stage]}'
+            )
+        lines.append(f'library_scan_rate{{library="{label}"}} {p["rate"]}')
+        lines.append(f'library_scan_running{{library="{label}"}} {int(job.running)}')
+    return lines
+
+
+metrics.register_collector(_scan_metrics)
+
+
+def scan_library(folder, job, ingest):
+    """Общий проход сканирования: поиск .bnf, разбор и запись через ingest.
+
+    ingest(...) имеет сигнатуру add_or_update_book и возвращает Future
+    писателя БД. Возвращает число успешно записанных книг.
+    """
+    folders = []  # (папка, имена .bnf)
+    for root, _, files in os.walk(folder):
+        job.check_cancelled()
+        names = [file for file in files if file.endswith(".bnf")]
+        if names:
+            folders.append((root, names))
+            job.add(discovered=len(names))
+    job.discovery_done = True
+
+    def on_written(future):
+        if future.cancelled():
+            return
+        if future.exception() is None:
+            job.add(written=1)
+        else:
+            job.add(errors=1)
+            print(f"Ошибка {future.path}: {future.exception()}")
+
+    pending = []
+    try:
+        for root, names in folders:
+            # .bnf папки читаются через её манифест (см. manifests.py)
+            reader = DirectoryReader(root)
+            for name in names:
+                job.check_cancelled()
+                try:
+                    data = reader.read(name)
+                except Exception as e:
+                    job.add(errors=1)
+                    print(f"Ошибка {name}: {e}")
+                    continue
+
+                future = ingest(
+                    data.get("title", ""),
+                    data.get("orig_name", ""),
+                    data.get("author", ""),
+                    data.get("description", ""),
+                    lang=data.get("lang"),
+                    bnf_path=os.path.join(root, name),
+                    tags=data.get("tags", []),
+                )
+                future.path = name
+                future.add_done_callback(on_written)
+                pending.append(future)
+                job.add(parsed=1)
+            reader.save()
+    finally:
+        # дожидаемся записи поставленного в очередь; при отмене снимаем
+        # с очереди то, что писатель ещё не начал выполнять
+        not_done = set(pending)
+        while not_done:
+            if job.cancelled:
+                for future in not_done:
+                    future.cancel()
+            _, not_done = wait(not_done, timeout=0.2)
+
+    job.check_cancelled()
+    return sum(1 for f in pending if not f.cancelled() and f.exception() is None)
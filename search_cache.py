@@ -0,0 +1,101 @@
+"""Кэш результатов поиска: нормализованный запрос → упорядоченные id книг.
+
+С главной страницы снова и снова приходят одни и те же запросы и сочетания
+тегов. Результат запоминается вместе с поколением БД (последняя запись
+change_log, см. catalog_cache): если поколение сдвинулось, кэш очищается
+целиком, так что после любой записи — и из другого процесса — старые
+результаты не отдаются. Размер ограничен, вытесняются давно не
+запрошенные записи. Строки книг по id всё равно читаются заново.
+
+Размер — LIBRARY_SEARCH_CACHE_SIZE, отключается LIBRARY_SEARCH_CACHE=0.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from authors import fold_author
+
+ENABLED = os.environ.get("LIBRARY_SEARCH_CACHE", "1") != "0"
+CACHE_SIZE = int(os.environ.get("LIBRARY_SEARCH_CACHE_SIZE", "256"))
+
+search_cache_lookups = metrics.counter(
+    "library_search_cache_total", "Search result cache lookups by result"
+)
+search_cache_evictions = metrics.counter(
+    "library_search_cache_evictions_total",
+    "Search results evicted by size or generation change",
+)
+
+
+def _fold(s):
+    return "" if s is None else str(s).casefold()
+
+
+def make_key(scope, query=None, tags=None, author=None, sort="title", favorite=False):
+    """Ключ запроса: регистр, порядок и повторы тегов на результат не влияют.
+
+    scope различает вызывающих с разными правилами поиска (web, desktop).
+    """
+    return (
+        scope,
+        _fold(query),
+        tuple(sorted({_fold(t) for t in tags or ()})),
+        fold_author(author) if author else "",
+        sort,
+        bool(favorite),
+    )
+
+
+def in_order(rows, ids):
+    """Строки (первая колонка — id) в порядке ids"""
+    position = {book_id: i for i, book_id in enumerate(ids)}
+    return sorted(rows, key=lambda row: position[row[0]])
+
+
+class SearchCache:
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._generation = None
+        self._entries = OrderedDict()  # ключ → кортеж id
+
+    def lookup(self, generation, key, compute):
+        """id книг для key; compute() считает их при промахе.
+
+        generation нужно прочитать до запроса: если запись успеет пройти
+        между ними, результат ляжет под старое поколение и больше не выдастся.
+        """
+        if not ENABLED or self.size <= 0:
+            return compute()
+        with self._lock:
+            ids = self._entries.get(key) if generation == self._generation else None
+            if ids is not None:
+                self._entries.move_to_end(key)
+        if ids is not None:
+            search_cache_lookups.inc(result="hit")
+            return ids
+        search_cache_lookups.inc(result="miss")
+        ids = tuple(compute())
+        with self._lock:
+            if generation != self._generation:
+                if self._entries:
+                    search_cache_evictions.inc(len(self._entries), reason="generation")
+                self._entries.clear()
+                self._generation = generation
+            self._entries[key] = ids
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                search_cache_evictions.inc(reason="size")
+        return ids
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation = None
+
+
+# Общий кэш процесса (веб-сервер или desktop-приложение)
+search_cache = SearchCache()
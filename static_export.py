@@ -0,0 +1,444 @@
+"""Статическая копия библиотеки: все страницы в виде HTML-файлов.
+
+    python static_export.py ПАПКА [--workers N] [--page-size 100] [--force]
+
+Списки книг (по страницам, по тегам, по авторам) и страницы книг со всеми
+версиями текста, включая параллельную таблицу en-ru, рендерятся тем же кодом,
+что и в web_server (render_markdown со StrictHeadersExtension, parallel_table).
+В ПАПКЕ хранится .export-state.json с отпечатками входных данных каждой
+страницы: повторный экспорт перерисовывает только страницы, у которых
+изменились книги, теги или файлы текстов, и удаляет лишние. Страницы книг
+рендерятся в пуле процессов. Запускать из папки приложения — там library.db.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from jinja2 import Environment
+
+import text_access
+import web_server
+from migrations import fold_title
+
+PAGE_SIZE = 100
+STATE_FILE = ".export-state.json"
+# меняется вместе с шаблонами — тогда экспорт перерисовывает всё
+EXPORT_VERSION = 1
+
+_STYLE = """
+    <style>
+        body { font-family: sans-serif; margin: 20px; }
+        table { border-collapse: collapse; width: 100%; }
+        th, td { border: 1px solid #ddd; padding: 8px; vertical-align: top; }
+        th { background: #f2f2f2; }
+        a { text-decoration: none; color: blue; }
+        .tag { display: inline-block; background: #e0e0e0; padding: 3px 8px; margin: 2px;
+               border-radius: 12px; font-size: 14px; }
+        .lang-btn { margin-right: 10px; padding: 6px 10px; border: 1px solid #ccc;
+                    background: #f8f8f8; display: inline-block; color: black; }
+        .markdown-body pre { background: #f4f4f4; padding: 10px; overflow-x: auto; }
+    </style>
+"""
+
+_NAV = """
+    <p>
+        <a href="{{ root }}index.html">Все книги</a> ·
+        <a href="{{ root }}authors.html">Авторы</a> ·
+        <a href="{{ root }}tags.html">Теги</a>
+    </p>
+"""
+
+LIST_HTML = (
+    """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>{{ title }}</title>"""
+    + _STYLE
+    + """</head>
+<body>"""
+    + _NAV
+    + """
+    <h1>{{ title }}</h1>
+    <table>
+        <tr><th>Название</th><th>Автор</th><th>Язык</th><th>Описание</th><th>Теги</th><th>⭐</th></tr>
+        {% for book in books %}
+        <tr>
+            <td>
+                <a href="{{ root }}book/{{ book.id }}/index.html">{{ book.title }}</a>
+                {% if book.orig_name %}<br><small>{{ book.orig_name }}</small>{% endif %}
+            </td>
+            <td><a href="{{ root }}author/{{ book.author_id }}/index.html">{{ book.author }}</a></td>
+            <td>{{ book.lang }}</td>
+            <td>{{ book.description_snippet }}</td>
+            <td>
+            {% for tag_id, tag in book.tags %}
+                <a class="tag" href="{{ root }}tag/{{ tag_id }}/index.html">{{ tag }}</a>
+            {% endfor %}
+            </td>
+            <td>{% if book.favorite %}⭐{% endif %}</td>
+        </tr>
+        {% endfor %}
+    </table>
+    {% if pages|length > 1 %}
+    <p>
+    {% for n, href in pages %}
+        {% if n == page %}<b>{{ n }}</b>{% else %}<a href="{{ href }}">{{ n }}</a>{% endif %}
+    {% endfor %}
+    </p>
+    {% endif %}
+</body>
+</html>
+"""
+)
+
+NAMES_HTML = (
+    """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>{{ title }}</title>"""
+    + _STYLE
+    + """</head>
+<body>"""
+    + _NAV
+    + """
+    <h1>{{ title }}</h1>
+    <ul>
+    {% for href, name, count in items %}
+        <li><a href="{{ href }}">{{ name }}</a> ({{ count }})</li>
+    {% endfor %}
+    </ul>
+</body>
+</html>
+"""
+)
+
+BOOK_HTML = (
+    """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>{{ book.title }}</title>"""
+    + _STYLE
+    + """</head>
+<body>"""
+    + _NAV
+    + """
+    <h1>{{ book.title }}</h1>
+    {% if book.orig_name %}<h2>{{ book.orig_name }}</h2>{% endif %}
+    <p><b>Автор:</b> <a href="{{ root }}author/{{ book.author_id }}/index.html">{{ book.author }}</a></p>
+    <p><b>Теги:</b>
+    {% for tag_id, tag in book.tags %}
+        <a class="tag" href="{{ root }}tag/{{ tag_id }}/index.html">{{ tag }}</a>
+    {% endfor %}
+    </p>
+    <p><b>Описание:</b></p>
+    <div style="margin:10px 0; padding:10px; border:1px solid #ccc; background:#fafafa;">
+        {{ book.description }}
+    </div>
+    <p><b>Язык:</b> {{ book.lang }}{% if book.favorite %} ⭐{% endif %}</p>
+    {% if book.lang == "en-ru" %}
+    <div>
+        <a href="ru.html" class="lang-btn">RU</a>
+        <a href="en.html" class="lang-btn">EN</a>
+        <a href="index.html" class="lang-btn">EN-RU</a>
+    </div>
+    {% endif %}
+    <hr>
+    {% if parallel %}
+    {{ content|safe }}
+    {% else %}
+    <div class="markdown-body">{{ content|safe }}</div>
+    {% endif %}
+</body>
+</html>
+"""
+)
+
+_env = Environment(autoescape=True)
+_list_template = _env.from_string(LIST_HTML)
+_names_template = _env.from_string(NAMES_HTML)
+_book_template = _env.from_string(BOOK_HTML)
+
+
+def _fingerprint(*parts):
+    payload = json.dumps([EXPORT_VERSION, *parts], ensure_ascii=False, default=list)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _write(path, text):
+    """Атомарная запись: сервер статики не увидит наполовину записанную страницу"""
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".export.", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _text_files(book):
+    """версия → путь текста (ключи как у view_book: md или ru/en для en-ru)"""
+    if book["lang"] == "en-ru":
+        return {
+            ver: text_access.text_path(book["bnf_path"], "en-ru", ver)
+            for ver in ("ru", "en")
+        }
+    if book["lang"] in ("ru", "en"):
+        return {"md": text_access.text_path(book["bnf_path"], book["lang"])}
+    return {}
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _markdown_page(path):
+    if not os.path.exists(path):
+        return f"[Файл {path} не найден]"
+    with open(path, "r", encoding="utf-8") as f:
+        html_content, toc_html = web_server.render_markdown(f.read())
+    return f'<div class="toc">{toc_html}</div>{html_content}'
+
+
+def export_book(out_dir, book):
+    """Все страницы одной книги (выполняется в процессе пула)"""
+    folder = os.path.join(out_dir, "book", str(book["id"]))
+    files = _text_files(book)
+    pages = {}
+    if book["lang"] == "en-ru":
+        en_file, ru_file = files["en"], files["ru"]
+        if os.path.exists(en_file) and os.path.exists(ru_file):
+            total = max(
+                text_access.line_index(en_file).line_count,
+                text_access.line_index(ru_file).line_count,
+            )
+            pages["index.html"] = (
+                web_server.parallel_table(en_file, ru_file, 0, total),
+                True,
+            )
+        else:
+            pages["index.html"] = ("[Файлы EN и RU не найдены]", False)
+        pages["ru.html"] = (_markdown_page(ru_file), False)
+        pages["en.html"] = (_markdown_page(en_file), False)
+    elif "md" in files:
+        pages["index.html"] = (_markdown_page(files["md"]), False)
+    else:
+        pages["index.html"] = ("", False)
+
+    for name, (content, parallel) in pages.items():
+        _write(
+            os.path.join(folder, name),
+            _book_template.render(
+                book=book, content=content, parallel=parallel, root="../../"
+            ),
+        )
+    return book["id"]
+
+
+def load_library(conn):
+    """Книги с тегами (порядок по названию), теги и авторы с книгами"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT book_tags.book_id, tags.id, tags.name FROM book_tags
+        JOIN tags ON tags.id = book_tags.tag_id
+        ORDER BY book_tags.book_id, book_tags.tag_id
+    """)
+    book_tags = {}
+    for book_id, tag_id, name in cur.fetchall():
+        book_tags.setdefault(book_id, []).append((tag_id, name))
+    cur.execute("""
+        SELECT id, title, orig_name, author, author_id, description,
+               description_snippet, lang, bnf_path, favorite
+        FROM books
+    """)
+    books = []
+    for row in cur.fetchall():
+        book = dict(zip(row.keys(), row))
+        book["tags"] = book_tags.get(book["id"], [])
+        books.append(book)
+    books.sort(key=lambda b: (fold_title(b["title"]), b["id"]))
+    return books
+
+
+def _list_pages(prefix, root, title, books, page_size):
+    """относительный путь → (отпечаток, функция рендера) для списка по страницам"""
+    count = max(1, -(-len(books) // page_size))
+    names = ["index.html"] + [f"page-{n}.html" for n in range(2, count + 1)]
+    links = list(zip(range(1, count + 1), names))
+    pages = {}
+    for n, name in enumerate(names, 1):
+        chunk = books[(n - 1) * page_size : n * page_size]
+        rows = [
+            {key: b[key] for key in _LIST_FIELDS} | {"tags": b["tags"]} for b in chunk
+        ]
+        pages[prefix + name] = (
+            _fingerprint("list", title, n, count, rows),
+            lambda rows=rows, n=n: _list_template.render(
+                title=title, books=rows, page=n, pages=links, root=root
+            ),
+        )
+    return pages
+
+
+_LIST_FIELDS = (
+    "id",
+    "title",
+    "orig_name",
+    "author",
+    "author_id",
+    "description_snippet",
+    "lang",
+    "favorite",
+)
+
+
+def _names_page(title, items):
+    return (
+        _fingerprint("names", title, items),
+        lambda: _names_template.render(title=title, items=items, root=""),
+    )
+
+
+def _load_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {"books": {}, "pages": {}}
+    if state.get("version") != EXPORT_VERSION:
+        return {"books": {}, "pages": {}}
+    return state
+
+
+def export(out_dir, workers=None, page_size=PAGE_SIZE, force=False):
+    """Экспорт библиотеки в out_dir; возвращает (книг, страниц списков) перерисовано"""
+    out_dir = os.path.abspath(out_dir)
+    state = {"books": {}, "pages": {}} if force else _load_state(out_dir)
+    conn = web_server.connect()
+    try:
+        books = load_library(conn)
+    finally:
+        conn.close()
+
+    # страницы книг — в пуле процессов, только изменившиеся
+    book_prints = {}
+    tasks = []
+    for book in books:
+        stamps = {ver: _file_stamp(path) for ver, path in _text_files(book).items()}
+        fp = _fingerprint("book", book, stamps)
+        book_prints[str(book["id"])] = fp
+        if state["books"].get(str(book["id"])) != fp:
+            tasks.append(book)
+    done = {}
+    errors = 0
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(export_book, out_dir, book): book for book in tasks}
+            for future in as_completed(futures):
+                book = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    errors += 1
+                    print(f"Ошибка {book['bnf_path']}: {e}")
+                    continue
+                done[str(book["id"])] = book_prints[str(book["id"])]
+    for book_id in set(state["books"]) - set(book_prints):
+        shutil.rmtree(os.path.join(out_dir, "book", book_id), ignore_errors=True)
+    # неудачные книги останутся со старым отпечатком и перерисуются в следующий раз
+    state["books"] = {
+        book_id: done.get(book_id, state["books"].get(book_id))
+        for book_id in book_prints
+        if book_id in done or book_id in state["books"]
+    }
+
+    # списки: все книги, по тегам и по авторам
+    pages = _list_pages("", "", "Библиотека", books, page_size)
+    by_tag, by_author = {}, {}
+    for book in books:
+        for tag_id, name in book["tags"]:
+            by_tag.setdefault((tag_id, name), []).append(book)
+        by_author.setdefault((book["author_id"], book["author"]), []).append(book)
+    for (tag_id, name), tagged in by_tag.items():
+        pages.update(
+            _list_pages(f"tag/{tag_id}/", "../../", f"Тег: {name}", tagged, page_size)
+        )
+    for (author_id, name), written in by_author.items():
+        pages.update(
+            _list_pages(f"author/{author_id}/", "../../", name or "", written, page_size)
+        )
+    pages["tags.html"] = _names_page(
+        "Теги",
+        sorted(
+            (
+                (f"tag/{tag_id}/index.html", name, len(tagged))
+                for (tag_id, name), tagged in by_tag.items()
+            ),
+            key=lambda item: fold_title(item[1]),
+        ),
+    )
+    pages["authors.html"] = _names_page(
+        "Авторы",
+        sorted(
+            (
+                (f"author/{author_id}/index.html", name, len(written))
+                for (author_id, name), written in by_author.items()
+            ),
+            key=lambda item: fold_title(item[1]),
+        ),
+    )
+
+    rendered = 0
+    for rel, (fp, render) in pages.items():
+        if state["pages"].get(rel) != fp:
+            _write(os.path.join(out_dir, rel), render())
+            rendered += 1
+    for rel in set(state["pages"]) - set(pages):
+        path = os.path.join(out_dir, rel)
+        if os.path.exists(path):
+            os.remove(path)
+    state["pages"] = {rel: fp for rel, (fp, _) in pages.items()}
+    state["version"] = EXPORT_VERSION
+
+    _write(os.path.join(out_dir, STATE_FILE), json.dumps(state))
+    print(
+        f"Книг: {len(books)}, перерисовано страниц книг: {len(done)}, "
+        f"списков: {rendered}, ошибок: {errors}"
+    )
+    return len(done), rendered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument(
+        "--force", action="store_true", help="перерисовать всё, не глядя на отпечатки"
+    )
+    args = parser.parse_args(argv)
+    export(args.out_dir, args.workers, max(1, args.page_size), args.force)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""Подсказки при вводе: теги, авторы и названия по началу слова.
+
+Для каждого поля держится отсортированный массив пар (ключ, значение), где
+ключ — значение в свёрнутом виде, начиная с каждого слова: «толс» находит и
+«Толстой», и «Лев Толстой». Диапазон по префиксу ищется bisect; из него
+берутся самые частые значения (вес — число книг). Если префикс короткий и
+диапазон большой, вместо него просматривается список значений по убыванию
+веса — нужные встречаются в нём густо. Индекс обновляется в тех же местах
+записи, что и tag_index, а записи других процессов, как и tag_index, находит
+по журналу изменений (ensure_loaded).
+"""
+
+import bisect
+import heapq
+import threading
+
+from authors import fold_author
+from catalog_cache import FULL_REBUILD_RATIO, generation
+
+FIELDS = ("tag", "author", "title")
+LABELS = {"tag": "тег", "author": "автор", "title": "книга"}
+LIMIT = 10
+# диапазон больше этого — ищем по списку популярных, а не по диапазону
+RANGE_SCAN_MAX = 2000
+
+_HIGH = "\U0010ffff"
+
+
+def _word_keys(folded):
+    """Ключи значения: хвосты строки с начала каждого слова"""
+    keys = [folded]
+    i = folded.find(" ")
+    while i != -1:
+        keys.append(folded[i + 1 :])
+        i = folded.find(" ", i + 1)
+    return keys
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.loaded = False
+        self.generation = 0  # поколение БД, на котором прочитан индекс
+        self._reset()
+
+    def _reset(self):
+        self.keys = {field: [] for field in FIELDS}  # [(ключ, свёрнутое значение)]
+        self.values = {field: {} for field in FIELDS}  # свёрнутое → [значение, вес]
+        self._popular = {}  # поле → свёрнутые значения по убыванию веса
+        self._book_values = {}  # id книги → [(поле, значение, свёрнутое)]
+
+    def build(self, conn):
+        """Полная перестройка по содержимому БД"""
+        cur = conn.cursor()
+        # поколение и строки читаем в одной транзакции чтения
+        cur.execute("BEGIN")
+        try:
+            gen = generation(cur)[1]
+            cur.execute("SELECT id, title, orig_name, author FROM books")
+            books = cur.fetchall()
+            cur.execute("""
+                SELECT book_tags.book_id, tags.name FROM book_tags
+                JOIN tags ON tags.id = book_tags.tag_id
+            """)
+            book_tags = {}
+            for book_id, name in cur.fetchall():
+                book_tags.setdefault(book_id, []).append(name)
+        finally:
+            conn.rollback()
+
+        with self._lock:
+            self._reset()
+            entries = {field: {} for field in FIELDS}
+            for book_id, title, orig_name, author in books:
+                values = _book_values(
+                    book_tags.get(book_id, ()), author, title, orig_name
+                )
+                self._book_values[book_id] = values
+                for field, value, folded in values:
+                    entry = entries[field].setdefault(folded, [value, 0])
+                    entry[1] += 1
+            for field in FIELDS:
+                self.values[field] = entries[field]
+                self.keys[field] = sorted(
+                    (key, folded)
+                    for folded in entries[field]
+                    for key in _word_keys(folded)
+                )
+            self.generation = gen
+            self.loaded = True
+
+    def ensure_loaded(self, connect):
+        """Построить индекс или догнать текущее поколение БД"""
+        conn = connect()
+        try:
+            self.sync(conn)
+        finally:
+            conn.close()
+
+    def sync(self, conn):
+        """Перечитать книги из журнала изменений после поколения индекса"""
+        if self.loaded and generation(conn.cursor())[1] == self.generation:
+            return
+        with self._sync_lock:
+            if not self.loaded:
+                self.build(conn)
+                return
+            cur = conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                first, gen = generation(cur)
+                if gen == self.generation:
+                    return
+                changed = None
+                # журнал могли почистить — тогда только полная перестройка
+                if first <= self.generation + 1:
+                    cur.execute(
+                        "SELECT DISTINCT book_id FROM change_log WHERE seq > ?",
+                        (self.generation,),
+                    )
+                    changed = [row[0] for row in cur.fetchall()]
+                    if len(changed) > FULL_REBUILD_RATIO * max(
+                        len(self._book_values), 1
+                    ):
+                        changed = None
+                if changed is not None:
+                    self.refresh_books(conn, changed)
+            finally:
+                conn.rollback()
+            if changed is None:
+                self.build(conn)
+            else:
+                self.generation = gen
+
+    def refresh_books(self, conn, book_ids):
+        """Перечитать из БД значения указанных книг (вызывается после записи)"""
+        if not self.loaded:
+            return
+        cur = conn.cursor()
+        for book_id in book_ids:
+            cur.execute(
+                "SELECT title, orig_name, author FROM books WHERE id=?", (book_id,)
+            )
+            row = cur.fetchone()
+            if not row:
+                self.remove_book(book_id)
+                continue
+            cur.execute(
+                """
+                SELECT tags.name FROM tags
+                JOIN book_tags ON tags.id = book_tags.tag_id
+                WHERE book_tags.book_id=?
+            """,
+                (book_id,),
+            )
+            tags = [r[0] for r in cur.fetchall()]
+            values = _book_values(tags, row[2], row[0], row[1])
+            with self._lock:
+                self._remove(book_id)
+                self._add(book_id, values)
+
+    def remove_book(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def suggest(self, field, prefix, limit=LIMIT):
+        """[(значение, число книг)] для префикса, самые частые первыми"""
+        prefix = fold_author(prefix)
+        if field not in self.values or not prefix:
+            return []
+        with self._lock:
+            keys = self.keys[field]
+            values = self.values[field]
+            lo = bisect.bisect_left(keys, (prefix,))
+            hi = bisect.bisect_left(keys, (prefix + _HIGH,), lo)
+            if hi - lo <= RANGE_SCAN_MAX:
+                found = {folded for _, folded in keys[lo:hi]}
+                best = heapq.nsmallest(
+                    limit, found, key=lambda folded: (-values[folded][1], folded)
+                )
+            else:
+                best = []
+                inner = " " + prefix
+                for folded in self._popular_order(field):
+                    if folded.startswith(prefix) or inner in folded:
+                        best.append(folded)
+                        if len(best) >= limit:
+                            break
+            return [tuple(values[folded]) for folded in best]
+
+    # --- внутреннее, вызывать под self._lock ---
+    def _popular_order(self, field):
+        order = self._popular.get(field)
+        if order is None:
+            values = self.values[field]
+            order = sorted(values, key=lambda folded: (-values[folded][1], folded))
+            self._popular[field] = order
+        return order
+
+    def _add(self, book_id, values):
+        self._book_values[book_id] = values
+        for field, value, folded in values:
+            entry = self.values[field].get(folded)
+            if entry is None:
+                self.values[field][folded] = [value, 1]
+                for key in _word_keys(folded):
+                    bisect.insort(self.keys[field], (key, folded))
+            else:
+                entry[1] += 1
+            self._popular.pop(field, None)
+
+    def _remove(self, book_id):
+        for field, _, folded in self._book_values.pop(book_id, ()):
+            entry = self.values[field][folded]
+            entry[1] -= 1
+            if not entry[1]:
+                del self.values[field][folded]
+                keys = self.keys[field]
+                for key in _word_keys(folded):
+                    del keys[bisect.bisect_left(keys, (key, folded))]
+            self._popular.pop(field, None)
+
+
+def _book_values(tags, author, title, orig_name):
+    """[(поле, значение, свёрнутое)] книги без пустых и повторов"""
+    values = []
+    seen = set()
+    for field, value in [("tag", t) for t in tags] + [
+        ("author", author),
+        ("title", title),
+        ("title", orig_name),
+    ]:
+        folded = fold_author(value)
+        if folded and (field, folded) not in seen:
+            seen.add((field, folded))
+            values.append((field, " ".join(str(value).split()), folded))
+    return values
+
+
+# Общий индекс процесса; обновляется рядом с tag_index после записей в БД
+suggest_index = SuggestIndex()
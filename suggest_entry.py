@@ -0,0 +1,146 @@
+import tkinter as tk
+
+from suggest import LABELS
+
+
+class SuggestPopup:
+    """Выпадающий список подсказок под полем ввода.
+
+    fetch(prefix) возвращает [(строка в списке, значение)]. С separator=","
+    подсказывается последний элемент списка через запятую (теги). ↓ переводит
+    в список, Enter или двойной щелчок выбирает, Esc закрывает.
+    """
+
+    def __init__(
+        self, entry, variable, fetch, separator=None, on_pick=None, delay=150
+    ):
+        self.entry = entry
+        self.variable = variable
+        self.fetch = fetch
+        self.separator = separator
+        self.on_pick = on_pick
+        self.delay = delay
+        self.popup = None
+        self.listbox = None
+        self._items = []
+        self._head = ""
+        self._pending = None
+
+        entry.bind("<KeyRelease>", self._on_key, add="+")
+        entry.bind("<Down>", self._focus_list, add="+")
+        entry.bind("<Escape>", lambda e: self.hide(), add="+")
+        entry.bind(
+            "<FocusOut>", lambda e: entry.after(200, self._hide_if_away), add="+"
+        )
+
+    def _on_key(self, event):
+        if event.keysym in ("Down", "Up", "Return", "KP_Enter", "Escape", "Tab"):
+            return
+        if self._pending is not None:
+            self.entry.after_cancel(self._pending)
+        self._pending = self.entry.after(self.delay, self.update)
+
+    def _split(self):
+        """(уже введённая часть, префикс для подсказки)"""
+        text = self.variable.get()
+        if self.separator is None:
+            return "", text.strip()
+        head, sep, last = text.rpartition(self.separator)
+        return (head + sep + " " if sep else ""), last.strip()
+
+    def update(self):
+        self._pending = None
+        head, prefix = self._split()
+        items = self.fetch(prefix) if prefix else []
+        if not items:
+            self.hide()
+            return
+        self._head = head
+        self._items = items
+        if self.popup is None:
+            self._create()
+        self.listbox.delete(0, tk.END)
+        for label, _ in items:
+            self.listbox.insert(tk.END, label)
+        self.listbox.configure(height=min(len(items), 10))
+        self.popup.update_idletasks()
+        x = self.entry.winfo_rootx()
+        y = self.entry.winfo_rooty() + self.entry.winfo_height()
+        width = max(self.entry.winfo_width(), self.listbox.winfo_reqwidth())
+        self.popup.geometry(f"{width}x{self.listbox.winfo_reqheight()}+{x}+{y}")
+        self.popup.deiconify()
+        self.popup.lift()
+
+    def hide(self):
+        if self.popup is not None:
+            self.popup.withdraw()
+
+    def _create(self):
+        self.popup = tk.Toplevel(self.entry)
+        self.popup.withdraw()
+        self.popup.overrideredirect(True)
+        self.listbox = tk.Listbox(self.popup, exportselection=False)
+        self.listbox.pack(fill=tk.BOTH, expand=True)
+        self.listbox.bind("<Return>", self._pick)
+        self.listbox.bind("<Double-1>", self._pick)
+        self.listbox.bind("<Escape>", self._back_to_entry)
+        self.listbox.bind(
+            "<FocusOut>", lambda e: self.entry.after(200, self._hide_if_away)
+        )
+
+    def _focus_list(self, event=None):
+        if self.popup is None or not self._items or not self.popup.winfo_viewable():
+            return None
+        self.listbox.focus_set()
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(0)
+        self.listbox.activate(0)
+        return "break"
+
+    def _back_to_entry(self, event=None):
+        self.hide()
+        self.entry.focus_set()
+        return "break"
+
+    def _hide_if_away(self):
+        # фокус ушёл не в список подсказок и не обратно в поле
+        try:
+            focus = self.entry.focus_get()
+        except KeyError:  # фокус во всплывающем меню Tk
+            focus = None
+        if focus not in (self.entry, self.listbox):
+            self.hide()
+
+    def _pick(self, event=None):
+        selection = self.listbox.curselection()
+        if not selection:
+            return "break"
+        value = self._items[selection[0]][1]
+        self.variable.set(self._head + value)
+        self._back_to_entry()
+        self.entry.icursor(tk.END)
+        if self.on_pick:
+            self.on_pick(value)
+        return "break"
+
+
+def index_fetch(index, fields, limit=10, connect=None):
+    """fetch для SuggestPopup: подсказки SuggestIndex по указанным полям.
+
+    С connect индекс перед каждым запросом догоняет журнал изменений БД —
+    видны и записи других процессов.
+    """
+
+    def fetch(prefix):
+        if connect is not None:
+            index.ensure_loaded(connect)
+        items = []
+        for field in fields:
+            for value, count in index.suggest(field, prefix, limit):
+                if len(fields) > 1:
+                    items.append((f"{value}  ({LABELS[field]}, {count})", value))
+                else:
+                    items.append((f"{value}  ({count})", value))
+        return items
+
+    return fetch
@@ -0,0 +1,194 @@
+import threading
+
+from authors import fold_author
+from catalog_cache import FULL_REBUILD_RATIO, generation
+
+
+def _fold(s):
+    return "" if s is None else str(s).casefold()
+
+
+def _bits_to_ids(bits):
+    """Разворачивает битовую карту в отсортированный список id"""
+    ids = []
+    s = bin(bits)[:1:-1]  # младший бит первым
+    i = s.find("1")
+    while i != -1:
+        ids.append(i)
+        i = s.find("1", i + 1)
+    return ids
+
+
+class TagIndex:
+    """Инвертированный индекс в памяти: тег / автор / избранное → битовая карта id книг.
+
+    Битовая карта — обычный int, поэтому пересечение нескольких тегов
+    сводится к побитовому AND и не требует обращения к SQLite.
+
+    Индекс помнит поколение БД (catalog_cache.generation), на котором был
+    прочитан, и ensure_loaded перечитывает книги, изменённые после него, —
+    так видны и записи других процессов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.loaded = False
+        self.generation = 0
+        self.tags = {}  # тег (casefold) → битовая карта
+        self.authors = {}  # fold_author → битовая карта
+        self.favorites = 0
+        self.all_books = 0
+        self._book_tags = {}  # id книги → множество тегов
+        self._book_author = {}  # id книги → автор
+
+    def build(self, conn):
+        """Полная перестройка индекса по содержимому БД"""
+        cur = conn.cursor()
+        # поколение и строки читаем в одной транзакции чтения
+        cur.execute("BEGIN")
+        try:
+            gen = generation(cur)[1]
+            cur.execute("SELECT id, author, favorite FROM books")
+            books = cur.fetchall()
+            cur.execute("""
+                SELECT book_tags.book_id, tags.name FROM book_tags
+                JOIN tags ON tags.id = book_tags.tag_id
+            """)
+            book_tags = {}
+            for book_id, name in cur.fetchall():
+                book_tags.setdefault(book_id, set()).add(_fold(name))
+        finally:
+            conn.rollback()
+
+        with self._lock:
+            self.tags = {}
+            self.authors = {}
+            self.favorites = 0
+            self.all_books = 0
+            self._book_tags = {}
+            self._book_author = {}
+            for book_id, author, favorite in books:
+                self._add(book_id, book_tags.get(book_id, set()), author, favorite)
+            self.generation = gen
+            self.loaded = True
+
+    def ensure_loaded(self, connect):
+        """Построить индекс или догнать текущее поколение БД"""
+        conn = connect()
+        try:
+            self.sync(conn)
+        finally:
+            conn.close()
+
+    def sync(self, conn):
+        """Перечитать книги из журнала изменений после поколения индекса"""
+        if self.loaded and generation(conn.cursor())[1] == self.generation:
+            return
+        with self._sync_lock:
+            if not self.loaded:
+                self.build(conn)
+                return
+            cur = conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                first, gen = generation(cur)
+                if gen == self.generation:
+                    return
+                changed = None
+                # журнал могли почистить — тогда только полная перестройка
+                if first <= self.generation + 1:
+                    cur.execute(
+                        "SELECT DISTINCT book_id FROM change_log WHERE seq > ?",
+                        (self.generation,),
+                    )
+                    changed = [row[0] for row in cur.fetchall()]
+                    if len(changed) > FULL_REBUILD_RATIO * max(len(self._book_tags), 1):
+                        changed = None
+                if changed is not None:
+                    self.refresh_books(conn, changed)
+            finally:
+                conn.rollback()
+            if changed is None:
+                self.build(conn)
+            else:
+                self.generation = gen
+
+    def refresh_books(self, conn, book_ids):
+        """Перечитать из БД состояние указанных книг (вызывается после записи)"""
+        if not self.loaded:
+            return
+        cur = conn.cursor()
+        for book_id in book_ids:
+            cur.execute("SELECT author, favorite FROM books WHERE id=?", (book_id,))
+            row = cur.fetchone()
+            if not row:
+                self.remove_book(book_id)
+                continue
+            cur.execute(
+                """
+                SELECT tags.name FROM tags
+                JOIN book_tags ON tags.id = book_tags.tag_id
+                WHERE book_tags.book_id=?
+            """,
+                (book_id,),
+            )
+            tags = {_fold(r[0]) for r in cur.fetchall()}
+            with self._lock:
+                self._remove(book_id)
+                self._add(book_id, tags, row[0], row[1])
+
+    def remove_book(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def select(self, tags=None, author=None, favorite=False):
+        """Отсортированный список id книг, у которых есть все теги из tags"""
+        with self._lock:
+            bits = self.all_books
+            for tag in tags or ():
+                bits &= self.tags.get(_fold(tag), 0)
+                if not bits:
+                    return []
+            if author:
+                bits &= self.authors.get(fold_author(author), 0)
+            if favorite:
+                bits &= self.favorites
+        return _bits_to_ids(bits)
+
+    # --- внутреннее, вызывать под self._lock ---
+    def _add(self, book_id, tags, author, favorite):
+        bit = 1 << book_id
+        self.all_books |= bit
+        for tag in tags:
+            self.tags[tag] = self.tags.get(tag, 0) | bit
+        key = fold_author(author)
+        self.authors[key] = self.authors.get(key, 0) | bit
+        if favorite:
+            self.favorites |= bit
+        self._book_tags[book_id] = tags
+        self._book_author[book_id] = key
+
+    def _remove(self, book_id):
+        if book_id not in self._book_tags:
+            return
+        mask = ~(1 << book_id)
+        self.all_books &= mask
+        self.favorites &= mask
+        for tag in self._book_tags.pop(book_id):
+            bits = self.tags[tag] & mask
+            if bits:
+                self.tags[tag] = bits
+            else:
+                del self.tags[tag]
+        key = self._book_author.pop(book_id)
+        bits = self.authors[key] & mask
+        if bits:
+            self.authors[key] = bits
+        else:
+            del self.authors[key]
+
+
+# Общий индекс процесса: и веб-сервер, и desktop-приложение, и watcher
+# обновляют его после своих записей в БД, чужие записи он находит в журнале
+tag_index = TagIndex()
@@ -0,0 +1,68 @@
+"""Запросы списка, поиска и watcher идут по индексам, а не полным проходом.
+
+Библиотека генерируется во временной папке, схема создаётся
+migrations.migrate; для каждого сценария из bench/check_query_plans.py
+выполненные SQL проверяются через EXPLAIN QUERY PLAN.
+"""
+
+import os
+
+import pytest
+
+import catalog_cache
+import library_watcher
+import main as desktop
+import search_cache
+import web_server as ws
+from bench.check_query_plans import (
+    partial_indexes,
+    pick_sample,
+    plan_problems,
+    scenarios,
+)
+from bench.generate_library import generate
+from migrations import migrate
+
+SCENARIOS = list(scenarios(desktop, ws, library_watcher, (None,) * 6))
+
+
+@pytest.fixture(scope="module")
+def sample(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("plans")
+    library = str(workdir / "library")
+    # столько же книг, сколько в bench: на меньшей библиотеке планировщику
+    # по статистике бывает дешевле пройти таблицу целиком
+    generate(library, books=500, md_size_kb=(1, 2), seed=1)
+    cwd = os.getcwd()
+    patch = pytest.MonkeyPatch()
+    # проверяем SQL-вариант get_books: снимок каталога читает таблицы целиком,
+    # а попадание в кэш поиска не выполнило бы запрос вовсе
+    patch.setattr(catalog_cache, "ENABLED", False)
+    patch.setattr(search_cache, "ENABLED", False)
+    patch.setattr(ws, "get_library_path", lambda: library)
+    os.chdir(workdir)
+    try:
+        conn = ws.connect()
+        migrate(conn)
+        conn.close()
+        ws.scan_folder_worker(library)
+        ws.writer.call(
+            lambda cur: cur.execute("UPDATE books SET favorite = (id % 10 = 0)")
+        )
+        # индекс тегов строится один раз при первом обращении
+        ws.tag_index.ensure_loaded(ws.connect)
+        yield pick_sample(ws)
+    finally:
+        os.chdir(cwd)
+        patch.undo()
+
+
+@pytest.mark.parametrize("name", SCENARIOS)
+def test_no_full_scan(sample, name):
+    fn, allowed = scenarios(desktop, ws, library_watcher, sample)[name]
+    conn = ws.connect()
+    try:
+        problems, plans = plan_problems(conn, fn, allowed, partial_indexes(conn))
+    finally:
+        conn.close()
+    assert not problems, plans
@@ -0,0 +1,226 @@
+"""Доступ к текстам книг по строкам без чтения файла целиком.
+
+Для каждого файла один раз строится индекс смещений начала строк (в байтах);
+он перестраивается, когда меняется mtime или размер файла. Сами строки
+читаются из mmap, поэтому выборка диапазона стоит O(размер диапазона).
+"""
+
+import mmap
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+import metrics
+
+# сколько индексов держать в памяти (по одному на файл)
+MAX_INDEXES = 64
+# самый длинный раздел, который страница книги отдаёт за раз
+SECTION_MAX_LINES = 400
+
+# заголовок, как его понимает StrictHeaderProcessor в web_server.py
+HEADING_RE = re.compile(rb"(#{1,6})\s+(.*?)\s*#*\r?\n?$")
+# открывающая строка блока кода, как у fenced_code в Python-Markdown:
+# с начала строки; закрывает блок та же строка из ` или ~
+_FENCE_RE = re.compile(rb"(`{3,}|~{3,})")
+
+line_index_builds = metrics.counter(
+    "library_line_index_builds_total", "Line offset indexes built or rebuilt"
+)
+
+# суффиксы текстов книги по языку и версии (?ver=) — как в view_book
+TEXT_SUFFIXES = {
+    ("ru", None): ".md",
+    ("en", None): ".md",
+    ("en-ru", "en"): ".en.md",
+    ("en-ru", "ru"): ".ru.md",
+}
+
+
+def text_path(bnf_path, lang, ver=None):
+    """Путь к тексту книги рядом с .bnf или None для неизвестной версии"""
+    suffix = TEXT_SUFFIXES.get((lang, ver if lang == "en-ru" else None))
+    if suffix is None:
+        return None
+    return os.path.splitext(bnf_path)[0] + suffix
+
+
+def markdown_lines(f):
+    """(строка, заголовок, забор) для строк файла, открытого в "rb".
+
+    заголовок — match HEADING_RE или None; забор — True у строк, которые
+    открывают или закрывают блок кода ``` / ~~~. Внутри блока кода
+    заголовков нет, как и при отрисовке страницы книги.
+    """
+    fence = None
+    for line in f:
+        if fence is not None:
+            if line[:1] == fence[:1] and line.rstrip(b" \r\n") == fence:
+                fence = None
+                yield line, None, True
+            else:
+                yield line, None, False
+        elif line[:1] == b"#":
+            yield line, HEADING_RE.match(line), False
+        elif line[:1] in (b"`", b"~") and _FENCE_RE.match(line):
+            fence = _FENCE_RE.match(line).group(1)
+            yield line, None, True
+        else:
+            yield line, None, False
+
+
+class LineIndex:
+    __slots__ = (
+        "path",
+        "mtime_ns",
+        "size",
+        "offsets",
+        "headings",
+        "heading_titles",
+        "sections",
+    )
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        # offsets[i] — начало строки i, offsets[-1] — конец файла
+        self.offsets = array("q", [0])
+        self.headings = array("q")  # номера строк-заголовков (с нуля)
+        self.heading_titles = []  # (уровень, текст) для каждого из headings
+        fences = []  # [начало, конец) блоков кода
+        pos = 0
+        with open(path, "rb") as f:
+            for n, (line, match, fence) in enumerate(markdown_lines(f)):
+                pos += len(line)
+                self.offsets.append(pos)
+                if match:
+                    self.headings.append(n)
+                    self.heading_titles.append(
+                        (
+                            len(match.group(1)),
+                            match.group(2).decode("utf-8", errors="replace"),
+                        )
+                    )
+                elif fence:
+                    if fences and len(fences[-1]) == 1:
+                        fences[-1].append(n + 1)
+                    else:
+                        fences.append([n])
+        if fences and len(fences[-1]) == 1:  # незакрытый блок — до конца файла
+            fences[-1].append(self.line_count)
+        self.sections = self._split_sections(fences)
+
+    @property
+    def line_count(self):
+        return len(self.offsets) - 1
+
+    def byte_range(self, start, end):
+        """Смещения [начало, конец) строк start..end-1 (границы обрезаются)"""
+        start = max(0, min(start, self.line_count))
+        end = max(start, min(end, self.line_count))
+        return self.offsets[start], self.offsets[end]
+
+    def section(self, line):
+        """Строки [начало, конец) раздела со строкой line (с нуля).
+
+        Раздел идёт от заголовка до следующего заголовка; длинный текст без
+        заголовков режется на куски по SECTION_MAX_LINES строк, но не внутри
+        блока кода.
+        """
+        line = max(0, min(line, self.line_count - 1))
+        i = bisect_right(self.sections, line)
+        start = self.sections[i - 1]
+        end = self.sections[i] if i < len(self.sections) else self.line_count
+        return start, end
+
+    def _split_sections(self, fences):
+        """Начала разделов: заголовки и разрезы длинных разделов"""
+        fence_starts = [start for start, _ in fences]
+        bounds = [0, *self.headings, self.line_count]
+        sections = array("q")
+        for start, end in zip(bounds, bounds[1:]):
+            if not sections or sections[-1] != start:
+                sections.append(start)
+            cut = start
+            while end - cut > SECTION_MAX_LINES:
+                cut_at = cut + SECTION_MAX_LINES
+                i = bisect_right(fence_starts, cut_at - 1)
+                if i and fences[i - 1][1] > cut_at:
+                    # разрез внутри блока кода: переносим на его начало, а если
+                    # блок начинается с раздела — на конец (раздел выйдет длиннее)
+                    fence_start, fence_end = fences[i - 1]
+                    cut_at = fence_start if fence_start > cut else fence_end
+                if cut_at >= end:
+                    break
+                sections.append(cut_at)
+                cut = cut_at
+        return sections
+
+
+_indexes = OrderedDict()  # путь → LineIndex, в порядке последнего обращения
+_lock = threading.Lock()
+
+
+def line_index(path):
+    """Индекс строк файла; перестраивается, если файл изменился"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    with _lock:
+        index = _indexes.get(path)
+        if index is not None and (index.mtime_ns, index.size) == (
+            stat.st_mtime_ns,
+            stat.st_size,
+        ):
+            _indexes.move_to_end(path)
+            return index
+    index = LineIndex(path, stat)
+    line_index_builds.inc()
+    with _lock:
+        _indexes[path] = index
+        _indexes.move_to_end(path)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def invalidate(path):
+    with _lock:
+        _indexes.pop(os.path.abspath(path), None)
+
+
+def read_bytes(path, start, end):
+    """Байты [start, end) файла через mmap"""
+    if end <= start:
+        return b""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[start:end]
+
+
+def read_lines(path, start, end):
+    """Строки start..end-1 (с нуля) без завершающих переводов строк"""
+    index = line_index(path)
+    begin, finish = index.byte_range(start, end)
+    data = read_bytes(path, begin, finish).decode("utf-8", errors="replace")
+    if not data:
+        return []
+    lines = data.split("\n")
+    if data.endswith("\n"):
+        lines.pop()
+    return [line.rstrip("\r") for line in lines]
+
+
+def parse_line_range(value):
+    """«120-180», «120-» или «120» (нумерация с 1) → (start, end) с нуля; None при ошибке"""
+    first, sep, last = (value or "").partition("-")
+    try:
+        start = int(first)
+        end = int(last) if last else (None if sep else start)
+    except ValueError:
+        return None
+    if start < 1 or (end is not None and end < start):
+        return None
+    return start - 1, end if end is not None else 2**62
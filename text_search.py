@@ -0,0 +1,168 @@
+"""Поиск по подстроке и с опечатками через триграммный индекс FTS5.
+
+Таблица book_search (см. migrations.py) хранит название, оригинальное
+название, автора, теги и описание каждой книги. Функции записи помечают
+изменённые книги через refresh_books, а писатель переиндексирует их перед
+COMMIT той же транзакции.
+Подстрока от трёх символов ищется фразой из триграмм по индексу; если точных
+совпадений нет, книги ранжируются по доле общих с запросом триграмм.
+"""
+
+import json
+
+import metrics
+from db_writer import writer
+
+# короче трёх символов триграммы не помогают — вызывающий ищет по-старому
+MIN_QUERY = 3
+# доля триграмм запроса, которая должна найтись в одном из полей книги
+FUZZY_MIN_SCORE = 0.5
+FUZZY_CANDIDATES = 1000
+
+search_queries = metrics.counter(
+    "library_search_queries_total", "Text searches by kind of result"
+)
+
+_available = None
+
+_SEARCH_COLUMNS = "title, orig_name, author, tags, description"
+_SEARCH_SELECT = """
+    SELECT id, title, orig_name, author, (
+        SELECT group_concat(tags.name, ', ') FROM book_tags
+        JOIN tags ON tags.id = book_tags.tag_id
+        WHERE book_tags.book_id = books.id
+    ), description
+    FROM books
+"""
+
+
+def available(conn):
+    """Есть ли в БД триграммный индекс (FTS5 может быть не собран в SQLite)"""
+    global _available
+    if not _available:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='book_search'"
+        ).fetchone()
+        _available = row is not None
+    return _available
+
+
+def refresh_books(cur, book_ids):
+    """Пометить книги для переиндексации (вызывается в транзакции записи).
+
+    Сам индекс обновляется один раз на транзакцию писателя в flush_pending —
+    FTS5 дорого обходится запись по одной строке в каждом SAVEPOINT.
+    """
+    if not available(cur.connection):
+        return
+    cur.execute(
+        "INSERT OR IGNORE INTO search_dirty (book_id) SELECT value FROM json_each(?)",
+        (json.dumps(list(book_ids)),),
+    )
+
+
+def flush_pending(cur):
+    """Переиндексировать помеченные книги (writer.before_commit)"""
+    if not available(cur.connection):
+        return
+    cur.execute("SELECT book_id FROM search_dirty")
+    ids = json.dumps([row[0] for row in cur.fetchall()])
+    if ids == "[]":
+        return
+    cur.execute(_SEARCH_SELECT + " WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+    rows = {row[0]: tuple(row) for row in cur.fetchall()}
+    cur.execute(
+        f"""
+        SELECT rowid, {_SEARCH_COLUMNS} FROM book_search
+        WHERE rowid IN (SELECT value FROM json_each(?))
+    """,
+        (ids,),
+    )
+    indexed = {row[0]: tuple(row) for row in cur.fetchall()}
+    # повторное сканирование пишет те же данные — такие строки не трогаем
+    for book_id in set(rows) | set(indexed):
+        if rows.get(book_id) == indexed.get(book_id):
+            continue
+        if book_id in indexed:
+            cur.execute("DELETE FROM book_search WHERE rowid=?", (book_id,))
+        if book_id in rows:
+            cur.execute(
+                f"INSERT INTO book_search (rowid, {_SEARCH_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                rows[book_id],
+            )
+    cur.execute("DELETE FROM search_dirty")
+
+
+def rebuild(cur):
+    cur.execute("DELETE FROM book_search")
+    cur.execute(f"INSERT INTO book_search (rowid, {_SEARCH_COLUMNS}) " + _SEARCH_SELECT)
+
+
+def trigrams(text):
+    """Триграммы слов с отбивкой пробелами (как в pg_trgm): начало и конец
+    слова дают свои триграммы, и перестановка букв в середине меньше вредит"""
+    result = set()
+    for word in text.casefold().split():
+        word = f"  {word} "
+        result.update(word[i : i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def search(conn, query, columns=None):
+    """(id книг, fuzzy) или None, если запрос слишком короткий для индекса.
+
+    При точных совпадениях fuzzy=False и порядок id не важен; иначе id
+    упорядочены по убыванию похожести. columns — поля book_search, по которым
+    искать (по умолчанию все, включая описание).
+    """
+    query = " ".join(query.split())
+    if len(query) < MIN_QUERY or not available(conn):
+        return None
+    columns = columns or _SEARCH_COLUMNS.split(", ")
+    # фильтр колонок FTS5: {title author}: (выражение)
+    scope = "{" + " ".join(columns) + "}: "
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT rowid FROM book_search WHERE book_search MATCH ?",
+        (scope + _phrase(query),),
+    )
+    ids = [row[0] for row in cur.fetchall()]
+    if ids:
+        search_queries.inc(kind="substring")
+        return ids, False
+
+    wanted = trigrams(query)
+    folded = query.casefold()
+    cur.execute(
+        f"""
+        SELECT rowid, {", ".join(columns)} FROM book_search
+        WHERE book_search MATCH ? ORDER BY rank LIMIT ?
+    """,
+        (
+            scope
+            + "("
+            + " OR ".join(
+                sorted({_phrase(folded[i : i + 3]) for i in range(len(folded) - 2)})
+            )
+            + ")",
+            FUZZY_CANDIDATES,
+        ),
+    )
+    scored = []
+    for book_id, *fields in cur.fetchall():
+        score = max(
+            (len(wanted & trigrams(field)) / len(wanted) for field in fields if field),
+            default=0,
+        )
+        if score >= FUZZY_MIN_SCORE:
+            scored.append((-score, book_id))
+    scored.sort()
+    search_queries.inc(kind="fuzzy" if scored else "empty")
+    return [book_id for _, book_id in scored], True
+
+
+writer.before_commit(flush_pending)
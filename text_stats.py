@@ -0,0 +1,288 @@
+"""Статистика текстов книг: слова, знаки, заголовки и время чтения.
+
+Считается одним проходом по .md построчно (файл целиком в память не
+читается) и хранится в таблице text_stats по книге и версии текста: «md» у
+книг ru/en, «ru» и «en» у двуязычных (как в reading_positions). Рядом
+хранятся mtime и размер файла — пересчитываются только изменившиеся тексты.
+
+Наблюдатель за библиотекой пересчитывает изменённый текст (refresh_text) и
+тексты новой книги (refresh_bnf); всё остальное досчитывает backfill, в
+нескольких процессах. Изменения статистики триггеры пишут в change_log, так
+что списки с сортировкой по объёму обновляются обычной сверкой поколения.
+"""
+
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import library_watcher
+import metrics
+from db_writer import writer
+from migrations import migrate
+from text_access import TEXT_SUFFIXES, markdown_lines, text_path
+
+# средняя скорость чтения художественного текста
+WORDS_PER_MINUTE = 180
+# строк статистики в одной команде писателя при заполнении
+STORE_BATCH = 200
+
+_WORD_RE = re.compile(r"\w+(?:['’-]\w+)*")
+
+texts_counted = metrics.counter(
+    "library_text_stats_counted_total", "Book texts whose statistics were counted"
+)
+backfill_duration = metrics.histogram(
+    "library_text_stats_backfill_seconds", "Text statistics backfill time"
+)
+
+_backfill_lock = threading.Lock()
+
+
+def text_versions(lang):
+    """[(версия, ver для text_path)] текстов книги с языком lang"""
+    return [
+        (ver or "md", ver) for text_lang, ver in TEXT_SUFFIXES if text_lang == lang
+    ]
+
+
+def count_file(path):
+    """(слова, знаки, заголовки) текста; знаки — без переводов строк.
+
+    Заголовки — те же, что у разделов страницы книги (text_access.LineIndex).
+    """
+    words = chars = headings = 0
+    with open(path, "rb") as f:
+        for line, heading, _ in markdown_lines(f):
+            if heading:
+                headings += 1
+            text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+            chars += len(text)
+            words += len(_WORD_RE.findall(text))
+    return words, chars, headings
+
+
+def reading_minutes(words):
+    return max(1, round(words / WORDS_PER_MINUTE)) if words else 0
+
+
+def reading_time(words):
+    """Время чтения для показа: «40 мин», «3 ч 5 мин»"""
+    minutes = reading_minutes(words)
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} ч {minutes} мин" if minutes else f"{hours} ч"
+
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _count_task(item):
+    """Подсчёт для пула процессов: item — (id, версия, путь, mtime_ns, размер)"""
+    book_id, version, path, mtime_ns, size = item
+    try:
+        return (book_id, version, mtime_ns, size, *count_file(path))
+    except OSError:
+        return None
+
+
+def _store(cur, rows, gone=()):
+    """rows — (id, версия, mtime_ns, размер, слова, знаки, заголовки)"""
+    cur.executemany(
+        """
+        INSERT INTO text_stats
+            (book_id, version, mtime_ns, size, words, chars, headings)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (book_id, version) DO UPDATE SET
+            mtime_ns=excluded.mtime_ns, size=excluded.size, words=excluded.words,
+            chars=excluded.chars, headings=excluded.headings
+    """,
+        rows,
+    )
+    cur.executemany(
+        "DELETE FROM text_stats WHERE book_id=? AND version=?", list(gone)
+    )
+
+
+def stale_texts(conn):
+    """Тексты, которые надо пересчитать, и записи, у которых нет файла.
+
+    Возвращает ([(id, версия, путь, mtime_ns, размер)], [(id, версия)]).
+    """
+    stored = {
+        (book_id, version): (mtime_ns, size)
+        for book_id, version, mtime_ns, size in conn.execute(
+            "SELECT book_id, version, mtime_ns, size FROM text_stats"
+        )
+    }
+    stale = []
+    gone = []
+    for book_id, lang, bnf_path in conn.execute(
+        "SELECT id, lang, bnf_path FROM books WHERE bnf_path IS NOT NULL"
+    ):
+        for version, ver in text_versions(lang):
+            path = text_path(bnf_path, lang, ver)
+            key = _file_key(path)
+            if key is None:
+                if (book_id, version) in stored:
+                    gone.append((book_id, version))
+            elif stored.get((book_id, version)) != key:
+                stale.append((book_id, version, path, *key))
+    return stale, gone
+
+
+def backfill(conn, workers=None, progress=None):
+    """Досчитать статистику новых и изменённых текстов; сколько посчитано.
+
+    workers > 1 считает в процессах (spawn: вызывается и из потоков
+    веб-сервера); progress(готово, всего) — по мере подсчёта.
+    """
+    with _backfill_lock:
+        started = time.perf_counter()
+        stale, gone = stale_texts(conn)
+        if gone:
+            writer.call(_store, [], gone)
+        if not stale:
+            return 0
+        if workers and workers > 1 and len(stale) > 1:
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            results = pool.map(_count_task, stale, chunksize=16)
+        else:
+            pool = None
+            results = map(_count_task, stale)
+        rows = []
+        counted = 0
+        try:
+            for n, row in enumerate(results, 1):
+                if row is not None:
+                    rows.append(row)
+                    counted += 1
+                if len(rows) >= STORE_BATCH:
+                    writer.submit(_store, rows)
+                    rows = []
+                if progress:
+                    progress(n, len(stale))
+        finally:
+            if pool:
+                pool.shutdown()
+        writer.call(_store, rows)
+        # файлы, исчезнувшие до подсчёта, не считаются
+        texts_counted.inc(counted)
+        backfill_duration.observe(time.perf_counter() - started)
+        return counted
+
+
+def start_backfill(connect, workers=None):
+    """backfill в фоновом потоке (при запуске приложения)"""
+
+    def run():
+        conn = connect()
+        try:
+            backfill(conn, workers or os.cpu_count())
+        except Exception as e:
+            print(f"Статистика текстов: {e}")
+        finally:
+            conn.close()
+
+    threading.Thread(target=run, name="text-stats", daemon=True).start()
+
+
+def _store_text(cur, candidates, counts):
+    """Записать (или удалить) статистику текста для подходящей книги"""
+    for bnf_path, version in candidates:
+        cur.execute("SELECT id, lang FROM books WHERE bnf_path=?", (bnf_path,))
+        for book_id, lang in cur.fetchall():
+            if version not in dict(text_versions(lang)):
+                continue
+            if counts is None:
+                _store(cur, [], [(book_id, version)])
+            else:
+                _store(cur, [(book_id, version, *counts)])
+
+
+def refresh_text(path):
+    """Пересчитать текст после события наблюдателя; Future писателя"""
+    # (путь .bnf, версия) книг, текстом которых может быть path
+    candidates = list(
+        dict.fromkeys(
+            (path[: -len(suffix)] + ".bnf", ver or "md")
+            for (_, ver), suffix in TEXT_SUFFIXES.items()
+            if path.endswith(suffix)
+        )
+    )
+    key = _file_key(path)
+    counts = None
+    if key is not None:
+        try:
+            counts = (*key, *count_file(path))
+            texts_counted.inc()
+        except OSError:
+            pass
+    return writer.submit(_store_text, candidates, counts)
+
+
+def refresh_bnf(bnf_path, lang):
+    """Посчитать тексты книги, только что записанной из .bnf"""
+    for _, ver in text_versions(lang):
+        path = text_path(bnf_path, lang, ver)
+        if os.path.exists(path):
+            refresh_text(path)
+
+
+def get_stats(conn, book_id):
+    """версия → {"words", "chars", "headings", "reading_time"} для книги"""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT version, words, chars, headings FROM text_stats
+        WHERE book_id=? ORDER BY version DESC
+    """,
+        (book_id,),
+    )
+    return {
+        version: {
+            "words": words,
+            "chars": chars,
+            "headings": headings,
+            "reading_time": reading_time(words),
+        }
+        for version, words, chars, headings in cur.fetchall()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="процессов для подсчёта",
+    )
+    args = parser.parse_args(argv)
+
+    conn = library_watcher.connect()
+    migrate(conn)
+
+    def progress(done, total):
+        if done == total or done % 500 == 0:
+            print(f"Тексты: {done}/{total}", file=sys.stderr)
+
+    counted = backfill(conn, args.workers, progress)
+    conn.close()
+    print(f"Посчитано текстов: {counted}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,28 +5,74 @@ import re
 import sqlite3
 import sys
 import threading
+import time
 from pathlib import Path
 
 import markdown
 from flask import (
     Flask,
+    Response,
     abort,
+    g,
+    jsonify,
     make_response,
     redirect,
     render_template_string,
     request,
+    send_file,
+    stream_with_context,
     url_for,
 )
 from markdown import Extension
 from markdown.blockprocessors import HashHeaderProcessor
 from markdown.extensions.toc import TocExtension
+from markupsafe import escape
 from watchdog.observers import Observer
 
+import catalog_cache
+import dedup
+import metrics
+import profiling
+import reading_positions
+import recommend
+import suggest
+import text_access
+import text_search
+import text_stats
+from authors import fold_author, get_author_id, list_authors
+from bnf_io import write_bnf
+from books_db import _delete_books, _save_tags, add_or_update_book
+from catalog_cache import catalog, generation, prune_change_log
+from db_writer import writer
 from library_watcher import LibraryWatcher
+from metrics import TimedConnection
+from migrations import description_snippet, fold_title, migrate, update_statistics
+from polling_watcher import PollingWatcher, use_polling
+from scan_jobs import ScanJob, scan_library, scan_manager
+from search_cache import in_order, make_key, search_cache
+from suggest import suggest_index
+from tag_index import tag_index
 
 DB_FILE = "library.db"
+# колонки списка книг (get_books)
+LIST_COLUMNS = (
+    "books.id, books.title, books.orig_name, books.author, "
+    "books.description_snippet, books.lang, books.favorite, "
+    "(SELECT MAX(words) FROM text_stats WHERE book_id = books.id) AS words"
+)
+# параллельный текст при открытии на позиции: строк до неё и всего на странице
+PARALLEL_CONTEXT = 50
+PARALLEL_WINDOW = 400
 
 app = Flask(__name__)
+app.wsgi_app = profiling.ProfilingMiddleware(app.wsgi_app)
+
+http_duration = metrics.histogram(
+    "library_http_request_duration_seconds", "Flask request latency by route"
+)
+http_requests = metrics.counter(
+    "library_http_requests_total", "Flask requests by route and status"
+)
 
 # --- HTML шаблоны ---
 BASE_HTML = """
@@ -44,11 +90,14 @@ BASE_HTML = """
         a { text-decoration: none; color: blue; }
         .tag { color: blue; cursor: pointer; }
         .lang-btn { margin-right: 10px; padding: 4px 8px; border: 1px solid #ccc; background: #f8f8f8; display: inline-block; }
+        .suggestion { display: inline-block; margin: 3px 10px 3px 0; }
     </style>
 </head>
 <body>
     <h1>Библиотека</h1>
     <a href="/update_books" style="margin-left:10px;">Обновить библиотеку</a>
+    <a href="/authors" style="margin-left:10px;">Авторы</a>
+    <a href="/duplicates" style="margin-left:10px;">Похожие тексты</a>
     <br>
     <form method="get">
         <input type="search" name="q" placeholder="Поиск..." value="{{ query }}">
@@ -58,6 +107,46 @@ BASE_HTML = """
         {% endif %}
         <a href="/?favorite=1" style="margin-left:10px;">Избранное</a>
     </form>
+    <div id="suggestions"></div>
+    <script>
+        // подсказки тегов, авторов и названий при вводе в поиск
+        const searchInput = document.querySelector('input[name=q]');
+        const suggestBox = document.getElementById('suggestions');
+        const suggestLabels = {tag: 'тег', author: 'автор', title: 'книга'};
+        let suggestTimer = null;
+        searchInput.addEventListener('input', () => {
+            clearTimeout(suggestTimer);
+            suggestTimer = setTimeout(showSuggestions, 150);
+        });
+        async function showSuggestions() {
+            const prefix = searchInput.value.trim();
+            if (!prefix) {
+                suggestBox.replaceChildren();
+                return;
+            }
+            const fields = Object.keys(suggestLabels);
+            const results = await Promise.all(fields.map(field =>
+                fetch('/api/suggest?limit=5&field=' + field + '&prefix=' + encodeURIComponent(prefix))
+                    .then(response => response.json())));
+            if (searchInput.value.trim() !== prefix) return;  // пока ждали, ввели дальше
+            const links = [];
+            fields.forEach((field, i) => {
+                for (const item of results[i]) {
+                    const params = new URLSearchParams(location.search);
+                    params.delete('q');
+                    if (field === 'tag') params.append('tag', item.value);
+                    else if (field === 'author') params.set('author', item.value);
+                    else params.set('q', item.value);
+                    const link = document.createElement('a');
+                    link.href = '/?' + params.toString();
+                    link.className = 'suggestion';
+                    link.textContent = item.value + ' (' + suggestLabels[field] + ', ' + item.count + ')';
+                    links.push(link);
+                }
+            });
+            suggestBox.replaceChildren(...links);
+        }
+    </script>
     <br>
     {% if tags %}
     <div style="margin:10px 0;">
@@ -78,6 +167,7 @@ BASE_HTML = """
             <th><a href="/?sort=title{% if query %}&q={{ query }}{% endif %}{% if tag %}&tag={{ tag }}{% endif %}{% if author %}&author={{ author }}{% endif %}">Название</a></th>
             <th>Оригинальное название</th>
             <th>Язык</th>
+            <th><a href="/?sort=words{% if query %}&q={{ query }}{% endif %}{% if tag %}&tag={{ tag }}{% endif %}{% if author %}&author={{ author }}{% endif %}">Объём</a></th>
             <th>Описание</th>
             <th>Теги</th>
         </tr>
@@ -95,7 +185,8 @@ BASE_HTML = """
             <td><a href="/book/{{ book['id'] }}">{{ book['title'] }}</a></td>
             <td>{{ book['orig_name'] }}</td>
             <td>{{ book['lang'] }}</td>
-            <td>{{ book['description'] }}</td>
+            <td>{% if book['words'] %}{{ book['words'] }} сл., {{ reading_time(book['words']) }}{% endif %}</td>
+            <td>{{ book['description_snippet'] }}</td>
             <td>
                 {% for tag in book['tags'] %}
                     <a
@@ -225,6 +316,16 @@ BOOK_HTML = """
         {{ book['description'] }}
     </div>
     <p><b>Язык:</b> {{ book['lang'] }}</p>
+    {% if stats %}
+    <p><b>Объём:</b></p>
+    <ul>
+      {% for version, st in stats.items() %}
+        <li>{% if version != 'md' %}{{ version }}: {% endif %}{{ st['words'] }} слов,
+            {{ st['chars'] }} знаков, заголовков: {{ st['headings'] }},
+            чтение ~{{ st['reading_time'] }}</li>
+      {% endfor %}
+    </ul>
+    {% endif %}
     <p><b>Избранное:</b>
         {% if book['favorite'] %}
             <a href="/toggle_fav/{{ book['id'] }}?from=book" style="font-size:22px; text-decoration:none;">⭐</a>
@@ -232,6 +333,14 @@ BOOK_HTML = """
             <a href="/toggle_fav/{{ book['id'] }}?from=book" style="font-size:22px; text-decoration:none;">☆</a>
         {% endif %}
     </p>
+    {% if similar %}
+    <p><b>Похожие книги:</b></p>
+    <ul>
+      {% for other in similar %}
+        <li><a href="/book/{{ other['id'] }}">{{ other['title'] }}</a> — {{ other['author'] }}</li>
+      {% endfor %}
+    </ul>
+    {% endif %}
 
 
     {% if book['lang'] == "en-ru" %}
@@ -243,11 +352,99 @@ BOOK_HTML = """
     {% endif %}
     <hr>
 
+    {% macro book_nav() %}
+    {% if nav %}
+        <p>
+        {% if nav.prev %}<a href="{{ nav.prev }}" class="lang-btn">← Назад</a>{% endif %}
+        {% if nav.next %}<a href="{{ nav.next }}" class="lang-btn">Дальше →</a>{% endif %}
+        {% if nav.full %}<a href="{{ nav.full }}" class="lang-btn">Весь текст</a>{% endif %}
+        </p>
+    {% endif %}
+    {% endmacro %}
+
+    {{ book_nav() }}
+    <div id="reader" data-book="{{ reader.book_id }}" data-ver="{{ reader.ver or '' }}"
+         data-start="{{ reader.start }}" data-end="{{ reader.end }}"
+         data-line="{{ reader.line or '' }}" data-anchor="{{ reader.anchor or '' }}">
     {% if parallel %}
     {{ content|safe }}
     {% else %}
         <div class="markdown-body">{{ content|safe }}</div>
     {% endif %}
+    </div>
+    {{ book_nav() }}
+
+    {% if reader.ver and reader.end %}
+    <script>
+        // Позиция чтения: прокрутку копим на странице и отправляем раз
+        // в 15 секунд или при уходе со страницы (см. reading_positions.py)
+        (() => {
+            const reader = document.getElementById('reader');
+            const start = Number(reader.dataset.start);
+            const end = Number(reader.dataset.end);
+            const rows = reader.querySelectorAll('tr[id^="l"]');
+            const headings = reader.querySelectorAll(
+                'h1[id], h2[id], h3[id], h4[id], h5[id], h6[id]');
+
+            function current() {
+                let anchor = null;
+                for (const h of headings) {
+                    if (h.getBoundingClientRect().top > 1) break;
+                    anchor = h.id;
+                }
+                for (const row of rows) {
+                    if (row.getBoundingClientRect().bottom > 0) {
+                        return {line: Number(row.id.slice(1)), anchor};
+                    }
+                }
+                // в markdown строки не размечены — оцениваем по доле прокрутки
+                const rect = reader.getBoundingClientRect();
+                const part = Math.min(Math.max(-rect.top / rect.height, 0), 1);
+                const line = Math.min(end, start + Math.floor(part * (end - start + 1)));
+                return {line, anchor};
+            }
+
+            function restore() {
+                const line = Number(reader.dataset.line);
+                if (line) {
+                    const row = document.getElementById('l' + line);
+                    if (row) {
+                        row.scrollIntoView();
+                        return;
+                    }
+                    const rect = reader.getBoundingClientRect();
+                    const part = (line - start) / (end - start + 1);
+                    window.scrollTo(0, window.scrollY + rect.top + part * rect.height);
+                } else if (reader.dataset.anchor) {
+                    const heading = document.getElementById(reader.dataset.anchor);
+                    if (heading) heading.scrollIntoView();
+                }
+            }
+
+            let dirty = false;
+            window.addEventListener('scroll', () => { dirty = true; }, {passive: true});
+
+            function flush() {
+                if (!dirty) return;
+                dirty = false;
+                const pos = current();
+                navigator.sendBeacon('/api/positions', JSON.stringify([{
+                    book_id: Number(reader.dataset.book),
+                    ver: reader.dataset.ver,
+                    line: pos.line,
+                    anchor: pos.anchor,
+                }]));
+            }
+
+            setInterval(flush, 15000);
+            document.addEventListener('visibilitychange', () => {
+                if (document.visibilityState === 'hidden') flush();
+            });
+            window.addEventListener('pagehide', flush);
+            restore();
+        })();
+    </script>
+    {% endif %}
 </body>
 </html>
 """
@@ -284,7 +481,30 @@ EDIT_HTML = """
         <textarea name="description" rows="6">{{ book['description'] }}</textarea>
 
         <label>Теги (через запятую):</label>
-        <input type="text" name="tags" value="{{ tags }}">
+        <input type="text" name="tags" value="{{ tags }}" list="tag-suggestions" autocomplete="off">
+        <datalist id="tag-suggestions"></datalist>
+        <script>
+            // подсказки для последнего тега в списке через запятую
+            const tagsInput = document.querySelector('input[name=tags]');
+            const tagList = document.getElementById('tag-suggestions');
+            tagsInput.addEventListener('input', async () => {
+                const parts = tagsInput.value.split(',');
+                const prefix = parts.pop().trim();
+                if (!prefix) {
+                    tagList.replaceChildren();
+                    return;
+                }
+                const head = parts.map(tag => tag.trim()).filter(Boolean);
+                const response = await fetch('/api/suggest?field=tag&prefix=' + encodeURIComponent(prefix));
+                const items = await response.json();
+                tagList.replaceChildren(...items.map(item => {
+                    const option = document.createElement('option');
+                    option.value = head.concat(item.value).join(', ');
+                    option.label = item.value + ' (' + item.count + ')';
+                    return option;
+                }));
+            });
+        </script>
 
         <label>Язык:</label>
         <select name="lang">
@@ -300,6 +520,120 @@ EDIT_HTML = """
 </html>
 """
 
+AUTHORS_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>Авторы</title>
+    <style>
+        body { font-family: sans-serif; margin: 20px; }
+        table { border-collapse: collapse; }
+        th, td { border: 1px solid #ddd; padding: 6px 12px; }
+        th { background: #f2f2f2; }
+        a { text-decoration: none; color: blue; }
+    </style>
+</head>
+<body>
+    <p><a href="/">Назад к списку</a></p>
+    <h1>Авторы</h1>
+    <table>
+        <tr><th>Автор</th><th>Книг</th></tr>
+        {% for a in authors %}
+        <tr>
+            <td><a href="/?author={{ a['name'] }}">{{ a['name'] }}</a></td>
+            <td>{{ a['book_count'] }}</td>
+        </tr>
+        {% endfor %}
+    </table>
+</body>
+</html>
+"""
+
+DUPLICATES_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>Похожие тексты</title>
+    <style>
+        body { font-family: sans-serif; margin: 20px; }
+        table { border-collapse: collapse; margin-bottom: 20px; }
+        th, td { border: 1px solid #ddd; padding: 6px 12px; }
+        th { background: #f2f2f2; }
+        a { text-decoration: none; color: blue; }
+    </style>
+</head>
+<body>
+    <p><a href="/">Назад к списку</a></p>
+    <h1>Похожие тексты</h1>
+    <form method="get">
+        Порог сходства:
+        <input type="number" name="threshold" min="{{ min_threshold }}" max="1" step="0.05" value="{{ threshold }}">
+        <button type="submit">Найти</button>
+    </form>
+    <form method="post" action="/duplicates/refresh">
+        <input type="hidden" name="threshold" value="{{ threshold }}">
+        {% if refreshing %}
+        Идёт расчёт — обновите страницу позже.
+        {% elif computed_at %}
+        Рассчитано {{ computed_at }}.
+        {% else %}
+        Расчёта ещё не было.
+        {% endif %}
+        <button type="submit" {% if refreshing %}disabled{% endif %}>Пересчитать</button>
+    </form>
+    <p>Групп: {{ clusters|length }}</p>
+    {% for cluster in clusters %}
+    <h3>Группа {{ loop.index }}</h3>
+    <table>
+        <tr><th>Книга</th><th>Автор</th><th>Текст</th><th>Сходство</th></tr>
+        {% for b in cluster['books'] %}
+        <tr>
+            <td><a href="/book/{{ b['id'] }}{% if b['version'] %}?ver={{ b['version'] }}{% endif %}">{{ b['title'] }}</a></td>
+            <td>{{ b['author'] }}</td>
+            <td>{{ b['version'] or b['lang'] }}</td>
+            <td>{{ '%.2f'|format(b['score']) }}</td>
+        </tr>
+        {% endfor %}
+    </table>
+    {% endfor %}
+</body>
+</html>
+"""
+
+PROFILES_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>Профили запросов</title>
+    <style>
+        body { font-family: sans-serif; margin: 20px; }
+        pre { background: #fafafa; border: 1px solid #ccc; padding: 10px; font-size: 12px; overflow-x: auto; }
+    </style>
+</head>
+<body>
+    <p><a href="/">Назад к списку</a></p>
+    <h1>Профили запросов</h1>
+    {% if not profiles %}
+        <p>Профилей пока нет. Добавьте к адресу <code>?profile=1&amp;token=...</code>
+        или запустите сервер с <code>LIBRARY_PROFILE=1</code>.</p>
+    {% endif %}
+    {% for p in profiles %}
+        <h3>{{ p['name'] }}</h3>
+        <p>
+            <a href="/debug/profiles/{{ p['name'] }}.prof{{ token_qs }}">.prof</a>
+            <a href="/debug/profiles/{{ p['name'] }}.collapsed{{ token_qs }}" style="margin-left:10px;">.collapsed</a>
+        </p>
+        <details><summary>Топ функций</summary><pre>{{ p['top'] }}</pre></details>
+    {% endfor %}
+</body>
+</html>
+"""
+
 UPDATE_HTML = """
 <!DOCTYPE html>
 <html>
@@ -308,9 +642,43 @@ UPDATE_HTML = """
     <meta name="viewport" content="width=device-width, initial-scale=1">
         <p><a href="/">Назад к списку</a></p>
     <title>Обновление библиотеки</title>
+    <style>
+        body { font-family: sans-serif; margin: 20px; }
+        progress { width: 100%; height: 20px; }
+    </style>
 </head>
 <body>
 <h1>Обновление библиотеки</h1>
+<progress id="bar" value="0" max="1"></progress>
+<p id="status">Сканирование...</p>
+<button id="cancel" type="button">Отменить</button>
+<script>
+    const bar = document.getElementById('bar');
+    const status = document.getElementById('status');
+    const cancelBtn = document.getElementById('cancel');
+    const source = new EventSource('/update_books/progress');
+    source.onmessage = (e) => {
+        const p = JSON.parse(e.data);
+        if (p.state === 'idle') {
+            status.textContent = 'Сканирование не запущено';
+            source.close();
+            return;
+        }
+        bar.max = Math.max(p.discovered, 1);
+        bar.value = p.written;
+        let text = `Найдено: ${p.discovered}, прочитано: ${p.parsed}, записано: ${p.written}`;
+        if (p.errors) text += `, ошибок: ${p.errors}`;
+        text += ` — ${p.rate} книг/с`;
+        if (p.eta !== null && p.state === 'running') text += `, осталось ~${Math.ceil(p.eta)} с`;
+        if (p.state !== 'running') {
+            text += ` (${ {done: 'готово', cancelled: 'отменено', failed: 'ошибка: ' + p.error}[p.state] })`;
+            cancelBtn.disabled = true;
+            source.close();
+        }
+        status.textContent = text;
+    };
+    cancelBtn.onclick = () => fetch('/update_books/cancel', {method: 'POST'});
+</script>
 </body>
 </html>
 """
@@ -318,7 +686,7 @@ UPDATE_HTML = """
 
 # --- БД ---
 def connect():
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, factory=TimedConnection)
     conn.row_factory = sqlite3.Row  # ✅ строки как словари
 
     # Универсальная регистронезависимая коллация (Unicode)
@@ -338,67 +706,46 @@ def connect():
 
 
 def get_books(query=None, tags=None, author=None, sort="title", favorite=False):
-    if sort not in ("title", "author"):
+    if sort not in ("title", "author", "words"):
         sort = "title"
+    key = make_key("web", query, tags, author, sort, favorite)
+
+    if catalog_cache.ENABLED:
+        # список целиком из снимка в памяти; SQLite — только сверка поколения
+        conn = connect()
+        try:
+            snapshot = catalog.snapshot(conn)
+            ids = search_cache.lookup(
+                snapshot.generation,
+                key,
+                lambda: [
+                    record.id
+                    for record in catalog.select(
+                        conn, query, tags, author, sort, favorite, snapshot
+                    )
+                ],
+            )
+        finally:
+            conn.close()
+        return [snapshot.books[book_id].as_dict() for book_id in ids]
 
     conn = connect()
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
-
-    if tags and len(tags) > 0:
-        placeholders = ",".join("?" for _ in tags)
-        sql = f"""
-            SELECT books.* FROM books
-            JOIN book_tags ON books.id = book_tags.book_id
-            JOIN tags ON tags.id = book_tags.tag_id
-            WHERE tags.name IN ({placeholders})
-            GROUP BY books.id
-            HAVING COUNT(DISTINCT tags.name) = ?
-            ORDER BY books.{sort} COLLATE UNI_NOCASE
-        """
-        params = list(tags) + [len(tags)]
-        cur.execute(sql, tuple(params))
-
-    else:
-        # старый код для остальных случаев
-        sql = "SELECT DISTINCT books.* FROM books "
-        joins = []
-        where = []
-        params = []
-
-        if author:
-            where.append("books.author = ? COLLATE UNI_NOCASE")
-            params.append(author)
-        if query:
-            joins.append(
-                "LEFT JOIN book_tags ON books.id = book_tags.book_id LEFT JOIN tags ON tags.id = book_tags.tag_id"
-            )
-            where.append(
-                "(UNI_LOWER(books.title) LIKE UNI_LOWER(?) "
-                + "OR UNI_LOWER(books.orig_name) LIKE UNI_LOWER(?) "
-                + "OR UNI_LOWER(books.author) LIKE UNI_LOWER(?) "
-                + "OR UNI_LOWER(tags.name) LIKE UNI_LOWER(?)) "
-                + "OR UNI_LOWER(books.description) LIKE UNI_LOWER(?)"
-            )
-            params += [
-                f"%{query}%",
-                f"%{query}%",
-                f"%{query}%",
-                f"%{query}%",
-                f"%{query}%",
-            ]
-        if favorite:
-            where.append("books.favorite=1")
-
-        if joins:
-            sql += " " + " ".join(joins)
-        if where:
-            sql += " WHERE " + " AND ".join(where)
-
-        sql += f" ORDER BY books.{sort} COLLATE UNI_NOCASE"
-        cur.execute(sql, tuple(params))
-
-    rows = cur.fetchall()
+    ids = search_cache.lookup(
+        generation(cur)[1],
+        key,
+        lambda: _search_book_ids(cur, query, tags, author, sort, favorite),
+    )
+    # только колонки списка: полное описание читает view_book
+    cur.execute(
+        f"""
+        SELECT {LIST_COLUMNS} FROM books
+        WHERE books.id IN (SELECT value FROM json_each(?))
+    """,
+        (json.dumps(ids),),
+    )
+    rows = in_order(cur.fetchall(), ids)
     conn.close()
 
     books = []
@@ -408,16 +755,89 @@ def get_books(query=None, tags=None, author=None, sort="title", favorite=False):
                 "id": row["id"],
                 "title": row["title"],
                 "orig_name": row["orig_name"],
-                "description": row["description"],
+                "description_snippet": row["description_snippet"],
                 "author": row["author"],
                 "lang": row["lang"],
                 "tags": get_tags_for_book(row["id"]),
                 "favorite": row["favorite"],
+                "words": row["words"],
             }
         )
     return books
 
 
+def _search_book_ids(cur, query, tags, author, sort, favorite):
+    """id книг списка в порядке сортировки (SQL-вариант, без снимка каталога)"""
+    sql = "SELECT DISTINCT books.id FROM books "
+    joins = []
+    where = []
+    params = []
+
+    if tags and len(tags) > 0:
+        # пересечение тегов (вместе с автором и избранным) считаем по индексу
+        # в памяти, из SQLite только забираем готовые строки
+        tag_index.ensure_loaded(connect)
+        ids = tag_index.select(tags, author=author, favorite=favorite)
+        if not ids:
+            return []
+        where.append("books.id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(ids))
+    else:
+        if author:
+            where.append("books.author_id = (SELECT id FROM authors WHERE key=?)")
+            params.append(fold_author(author))
+        if favorite:
+            where.append("books.favorite=1")
+
+    match = text_search.search(cur.connection, query) if query else None
+    if match is not None:
+        # триграммный индекс: подстрока или похожие книги
+        where.append("books.id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(match[0]))
+    elif query:
+        joins.append(
+            "LEFT JOIN book_tags ON books.id = book_tags.book_id LEFT JOIN tags ON tags.id = book_tags.tag_id"
+        )
+        where.append(
+            "(UNI_LOWER(books.title) LIKE UNI_LOWER(?) "
+            + "OR UNI_LOWER(books.orig_name) LIKE UNI_LOWER(?) "
+            + "OR UNI_LOWER(books.author) LIKE UNI_LOWER(?) "
+            + "OR UNI_LOWER(tags.name) LIKE UNI_LOWER(?) "
+            + "OR UNI_LOWER(books.description) LIKE UNI_LOWER(?))"
+        )
+        params += [
+            f"%{query}%",
+            f"%{query}%",
+            f"%{query}%",
+            f"%{query}%",
+            f"%{query}%",
+        ]
+
+    if joins:
+        sql += " " + " ".join(joins)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+
+    # title_key упорядочен так же, как UNI_NOCASE, и идёт по индексу
+    if sort == "title":
+        sql += " ORDER BY books.title_key"
+    elif sort == "words":
+        # как в снимке каталога: по убыванию объёма самой длинной версии
+        sql += (
+            " ORDER BY COALESCE((SELECT MAX(words) FROM text_stats"
+            " WHERE book_id = books.id), 0) DESC, books.id"
+        )
+    else:
+        sql += " ORDER BY books.author COLLATE UNI_NOCASE"
+    cur.execute(sql, tuple(params))
+
+    ids = [row[0] for row in cur.fetchall()]
+    if match is not None and match[1]:
+        position = {book_id: i for i, book_id in enumerate(match[0])}
+        ids.sort(key=position.__getitem__)
+    return ids
+
+
 def get_book(id):
     conn = connect()
     conn.row_factory = sqlite3.Row
@@ -457,6 +877,28 @@ def get_tags_for_book(book_id):
 
 
 # --- Маршруты ---
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    http_duration.observe(
+        time.perf_counter() - g.request_started, route=route, method=request.method
+    )
+    http_requests.inc(route=route, status=response.status_code)
+    return response
+
+
+@app.route("/metrics")
+def metrics_page():
+    return Response(
+        metrics.render_prometheus(), mimetype="text/plain; version=0.0.4"
+    )
+
+
 @app.route("/")
 def index():
     q = request.args.get("q", "").strip()
@@ -482,118 +924,225 @@ def index():
             author=author,
             sort=sort,
             favorite=(favorite == "1"),
+            reading_time=text_stats.reading_time,
         )
     )
 
 
 @app.route("/book/<int:book_id>")
 def view_book(book_id):
-    ver = request.args.get("ver")
     book = get_book(book_id)
     if not book:
         abort(404)
+    conn = connect()
+    positions = reading_positions.get_positions(conn, book_id)
+    similar = recommend.similar_books(conn, book_id)
+    stats = text_stats.get_stats(conn, book_id)
+    conn.close()
 
-    folder = os.path.dirname(book["bnf_path"])
-    base_name = os.path.splitext(os.path.basename(book["bnf_path"]))[0]
+    ver = request.args.get("ver")
+    if book["lang"] == "en-ru" and ver not in reading_positions.EN_RU_VERSIONS:
+        # без явной версии открываем ту, что читали последней
+        ver = reading_positions.last_version(positions) or "en-ru"
+    version = reading_positions.position_version(book["lang"], ver)
+    saved = positions.get(version)
+
+    # ?line=N — открыть раздел со строкой N; без него — раздел с сохранённой
+    # позицией (если читали дальше первой строки); ?full=1 или ?lines= —
+    # текст целиком или указанный диапазон
+    line = request.args.get("line", type=int)
+    if (
+        line is None
+        and saved
+        and saved["line"] > 1
+        and request.args.get("full") != "1"
+        and "lines" not in request.args
+    ):
+        line = saved["line"]
 
     content = ""
     parallel = False
+    # что показано на странице — для прокрутки к позиции и её сохранения
+    reader = {
+        "book_id": book_id,
+        "ver": version,
+        "start": 1,
+        "end": 0,
+        "line": line,
+        "anchor": saved["anchor"] if saved and line is None else None,
+    }
+    nav = {}
 
-    if book["lang"] in ("ru", "en"):
-        file_path = os.path.join(folder, f"{base_name}.md")
-        if os.path.exists(file_path):
+    if version in ("md", "ru", "en"):
+        file_path = text_access.text_path(book["bnf_path"], book["lang"], ver)
+        if not os.path.exists(file_path):
+            content = f"[Файл {file_path} не найден]"
+        elif line is None:
             with open(file_path, "r", encoding="utf-8") as f:
-                md_text = f.read()
-            md = markdown.Markdown(
-                extensions=[StrictHeadersExtension(), TocExtension(), "nl2br"]
+                html_content, toc_html = render_markdown(f.read())
+            content = f"""
+                <div class="toc">{toc_html}</div>
+                {html_content}
+            """
+            reader["end"] = text_access.line_index(file_path).line_count
+        else:
+            # только раздел вокруг позиции: индекс строк знает заголовки
+            index = text_access.line_index(file_path)
+            start, end = index.section(line - 1)
+            html_content, _ = render_markdown(
+                "\n".join(text_access.read_lines(file_path, start, end))
             )
-            html_content = md.convert(md_text)
-            toc_html = md.toc
             content = f"""
-                                        <div class="toc">{toc_html}</div>
-                                        {html_content}
-                                    """
+                <div class="toc">{_section_toc(index, book_id, ver)}</div>
+                {html_content}
+            """
+            reader.update(start=start + 1, end=end)
+            if start > 0:
+                nav["prev"] = url_for(
+                    "view_book", book_id=book_id, ver=ver, line=index.section(start - 1)[0] + 1
+                )
+            if end < index.line_count:
+                nav["next"] = url_for("view_book", book_id=book_id, ver=ver, line=end + 1)
+            nav["full"] = url_for("view_book", book_id=book_id, ver=ver, full=1)
+
+    elif version == "en-ru":
+        en_file = text_access.text_path(book["bnf_path"], "en-ru", "en")
+        ru_file = text_access.text_path(book["bnf_path"], "en-ru", "ru")
+        if os.path.exists(en_file) and os.path.exists(ru_file):
+            # ?lines=100-200 — только диапазон строк, без чтения файлов целиком
+            total = max(
+                text_access.line_index(en_file).line_count,
+                text_access.line_index(ru_file).line_count,
+            )
+            line_range = text_access.parse_line_range(request.args.get("lines"))
+            if line_range is None and line is not None:
+                first = max(0, min(line, total) - 1 - PARALLEL_CONTEXT)
+                line_range = (first, first + PARALLEL_WINDOW)
+            start, end = line_range or (0, total)
+            start, end = min(start, total), min(end, total)
+            content = parallel_table(en_file, ru_file, start, end)
+            parallel = True
+            reader.update(start=start + 1, end=end)
+            if start > 0:
+                first = max(0, start - PARALLEL_WINDOW)
+                nav["prev"] = url_for(
+                    "view_book", book_id=book_id, ver=ver, lines=f"{first + 1}-{start}"
+                )
+            if end < total:
+                nav["next"] = url_for(
+                    "view_book",
+                    book_id=book_id,
+                    ver=ver,
+                    lines=f"{end + 1}-{end + PARALLEL_WINDOW}",
+                )
+            if start > 0 or end < total:
+                nav["full"] = url_for("view_book", book_id=book_id, ver=ver, full=1)
         else:
-            content = f"[Файл {file_path} не найден]"
-
-    elif book["lang"] == "en-ru":
-        if ver == "ru":
-            file_path = os.path.join(folder, f"{base_name}.ru.md")
-            if os.path.exists(file_path):
-                with open(file_path, "r", encoding="utf-8") as f:
-                    if file_path.endswith(".md"):
-                        with open(file_path, "r", encoding="utf-8") as f:
-                            md_text = f.read()
-                        md = markdown.Markdown(
-                            extensions=[
-                                StrictHeadersExtension(),
-                                TocExtension(),
-                                "nl2br",
-                            ]
-                        )
-                        html_content = md.convert(md_text)
-                        toc_html = md.toc
-                        content = f"""
-                            <div class="toc">{toc_html}</div>
-                            {html_content}
-                        """
-                    else:
-                        with open(file_path, "r", encoding="utf-8") as f:
-                            content = f"<pre>{f.read()}</pre>"
-            else:
-                content = f"[Файл {file_path} не найден]"
-        elif ver == "en":
-            file_path = os.path.join(folder, f"{base_name}.en.md")
-            if os.path.exists(file_path):
-                with open(file_path, "r", encoding="utf-8") as f:
-                    if file_path.endswith(".md"):
-                        with open(file_path, "r", encoding="utf-8") as f:
-                            md_text = f.read()
-                        md = markdown.Markdown(
-                            extensions=[
-                                StrictHeadersExtension(),
-                                TocExtension(),
-                                "nl2br",
-                            ]
-                        )
-                        html_content = md.convert(md_text)
-                        toc_html = md.toc
-                        content = f"""
-                                          <div class="toc">{toc_html}</div>
-                                          {html_content}
-                                          """
-                    else:
-                        with open(file_path, "r", encoding="utf-8") as f:
-                            content = f"<pre>{f.read()}</pre>"
-            else:
-                content = f"[Файл {file_path} не найден]"
-        else:  # ver == "en-ru"
-            en_file = os.path.join(folder, f"{base_name}.en.md")
-            ru_file = os.path.join(folder, f"{base_name}.ru.md")
-            if os.path.exists(en_file) and os.path.exists(ru_file):
-                with open(en_file, "r", encoding="utf-8") as f:
-                    en_lines = [line.strip() for line in f.readlines()]
-                with open(ru_file, "r", encoding="utf-8") as f:
-                    ru_lines = [line.strip() for line in f.readlines()]
-
-                max_len = max(len(en_lines), len(ru_lines))
-                en_lines += [""] * (max_len - len(en_lines))
-                ru_lines += [""] * (max_len - len(ru_lines))
-
-                # Формируем HTML-таблицу параллельно
-                table_html = "<table border='1' cellpadding='5' style='border-collapse: collapse; width:100%;'>"
-                table_html += "<tr><th style='width:50%;'>EN</th><th style='width:50%;'>RU</th></tr>"
-                for en_line, ru_line in zip(en_lines, ru_lines):
-                    table_html += f"<tr><td>{en_line}</td><td>{ru_line}</td></tr>"
-                table_html += "</table>"
-                content = table_html
-                parallel = True
-            else:
-                content = "[Файлы EN и RU не найдены]"
+            content = "[Файлы EN и RU не найдены]"
 
     return render_template_string(
-        BOOK_HTML, book=book, content=content, parallel=parallel
+        BOOK_HTML,
+        book=book,
+        content=content,
+        parallel=parallel,
+        reader=reader,
+        nav=nav,
+        similar=similar,
+        stats=stats,
+    )
+
+
+def parallel_table(en_file, ru_file, start, end):
+    """HTML-таблица строк start..end-1 двух текстов; id строк — якоря #l<номер>"""
+    en_lines = [text.strip() for text in text_access.read_lines(en_file, start, end)]
+    ru_lines = [text.strip() for text in text_access.read_lines(ru_file, start, end)]
+
+    max_len = max(len(en_lines), len(ru_lines))
+    en_lines += [""] * (max_len - len(en_lines))
+    ru_lines += [""] * (max_len - len(ru_lines))
+
+    rows = [
+        "<table border='1' cellpadding='5' style='border-collapse: collapse; width:100%;'>",
+        "<tr><th style='width:50%;'>EN</th><th style='width:50%;'>RU</th></tr>",
+    ]
+    for n, (en_line, ru_line) in enumerate(zip(en_lines, ru_lines), start + 1):
+        rows.append(f"<tr id='l{n}'><td>{en_line}</td><td>{ru_line}</td></tr>")
+    rows.append("</table>")
+    return "".join(rows)
+
+
+def render_markdown(md_text):
+    """(html, оглавление) текста книги"""
+    md = markdown.Markdown(
+        extensions=[StrictHeadersExtension(), TocExtension(), "fenced_code", "nl2br"]
     )
+    html_content = md.convert(md_text)
+    return html_content, md.toc
+
+
+def _section_toc(index, book_id, ver):
+    """Оглавление всей книги по индексу строк, без разбора текста"""
+    items = [
+        f"<li style='margin-left:{(level - 1) * 20}px'>"
+        f"<a href='{url_for('view_book', book_id=book_id, ver=ver, line=line + 1)}'>"
+        f"{escape(title)}</a></li>"
+        for line, (level, title) in zip(index.headings, index.heading_titles)
+    ]
+    return f"<ul>{''.join(items)}</ul>" if items else ""
+
+
+@app.route("/api/positions", methods=["POST"])
+def save_reading_positions():
+    """Позиции чтения от страницы книги (пачкой); пишутся в фоне"""
+    rows = reading_positions.parse_positions(request.get_json(force=True, silent=True))
+    if rows:
+        writer.submit(reading_positions.save_positions, rows)
+    return "", 204
+
+
+@app.route("/api/suggest")
+def api_suggest():
+    """Подсказки при вводе: ?field=tag|author|title&prefix=..."""
+    field = request.args.get("field", "tag")
+    if field not in suggest.FIELDS:
+        abort(400)
+    limit = min(max(request.args.get("limit", suggest.LIMIT, type=int), 1), 50)
+    suggest_index.ensure_loaded(connect)
+    found = suggest_index.suggest(field, request.args.get("prefix", ""), limit)
+    return jsonify([{"value": value, "count": count} for value, count in found])
+
+
+@app.route("/book/<int:book_id>/raw")
+def book_raw(book_id):
+    """Исходный текст книги: ?lines=a-b — диапазон строк, заголовок Range — байты"""
+    book = get_book(book_id)
+    if not book:
+        abort(404)
+    path = text_access.text_path(book["bnf_path"], book["lang"], request.args.get("ver"))
+    if path is None:
+        # у двуязычной книги два текста — версию надо указать явно
+        versions = sorted(
+            ver for lang, ver in text_access.TEXT_SUFFIXES if lang == book["lang"] and ver
+        )
+        if not versions:
+            abort(404)
+        abort(400, description=f"Укажите ?ver= одно из: {', '.join(versions)}")
+    if not os.path.exists(path):
+        abort(404)
+
+    if "lines" in request.args:
+        line_range = text_access.parse_line_range(request.args["lines"])
+        if line_range is None:
+            abort(400)
+        index = text_access.line_index(path)
+        begin, end = index.byte_range(*line_range)
+        return Response(
+            text_access.read_bytes(path, begin, end),
+            mimetype="text/plain",
+            headers={"X-Line-Count": str(index.line_count)},
+        )
+    # send_file отвечает 206 на Range и 304 на условные запросы
+    return send_file(os.path.abspath(path), mimetype="text/plain", conditional=True)
 
 
 @app.route("/edit/<int:book_id>", methods=["GET", "POST"])
@@ -611,42 +1160,23 @@ def edit_book(book_id):
         tags = [t.strip().lower() for t in request.form["tags"].split(",") if t.strip()]
 
         # --- обновляем в БД ---
-        conn = connect()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            UPDATE books SET title=?, orig_name=?, author=?, description=?, lang=?
-            WHERE id=?
-        """,
-            (title, orig_name, author, description, lang, book_id),
-        )
-        cur.execute("DELETE FROM book_tags WHERE book_id=?", (book_id,))
-        conn.commit()
-        conn.close()
-
-        conn = connect()
         try:
-            cur = conn.cursor()
-            for tag in tags:
-                cur.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
-                cur.execute("SELECT id FROM tags WHERE name=?", (tag,))
-                tag_id = cur.fetchone()[0]
-                cur.execute(
-                    "INSERT INTO book_tags (book_id, tag_id) VALUES (?, ?)",
-                    (book_id, tag_id),
-                )
-
-            conn.commit()
+            writer.call(
+                _update_book,
+                book_id,
+                title,
+                orig_name,
+                author,
+                description,
+                lang,
+                tags,
+            )
         except Exception as e:
             return f"<p>Ошибка при обновлении БД: {e}</p>"
-        finally:
-            conn.close()
 
         # --- обновляем .bnf файл ---
         bnf_path = book["bnf_path"]
         try:
-            import json
-
             if os.path.exists(bnf_path):
                 with open(bnf_path, "r", encoding="utf-8") as f:
                     data = json.load(f)
@@ -658,8 +1188,7 @@ def edit_book(book_id):
             data["description"] = description
             data["lang"] = lang
             data["tags"] = tags
-            with open(bnf_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            write_bnf(bnf_path, data, indent=4)
         except Exception as e:
             return f"<p>Ошибка при обновлении BNF: {e}</p>"
 
@@ -669,17 +1198,34 @@ def edit_book(book_id):
     return render_template_string(EDIT_HTML, book=book, tags=tags)
 
 
+def _update_book(cur, book_id, title, orig_name, author, description, lang, tags):
+    cur.execute(
+        """
+        UPDATE books SET title=?, title_key=?, orig_name=?, author=?, author_id=?,
+                         description=?, description_snippet=?, lang=?
+        WHERE id=?
+    """,
+        (
+            title,
+            fold_title(title),
+            orig_name,
+            author,
+            get_author_id(cur, author),
+            description,
+            description_snippet(description),
+            lang,
+            book_id,
+        ),
+    )
+    _save_tags(cur, book_id, tags)
+    writer.after_commit(tag_index.refresh_books, cur.connection, [book_id])
+    writer.after_commit(suggest_index.refresh_books, cur.connection, [book_id])
+    text_search.refresh_books(cur, [book_id])
+
+
 @app.route("/toggle_fav/<int:book_id>")
 def toggle_fav(book_id):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT favorite FROM books WHERE id=?", (book_id,))
-    row = cur.fetchone()
-    if row:
-        new_val = 0 if row[0] else 1
-        cur.execute("UPDATE books SET favorite=? WHERE id=?", (new_val, book_id))
-        conn.commit()
-    conn.close()
+    writer.call(_toggle_fav, book_id)
 
     # куда вернуться
     back = request.args.get("from", "list")
@@ -698,122 +1244,146 @@ def toggle_fav(book_id):
         return redirect(url_for("index", **params))
 
 
-@app.route("/update_books")
-def scan_folder_async():
-    thread = threading.Thread(
-        target=scan_folder_worker, args=(get_library_path(),), daemon=True
+def _toggle_fav(cur, book_id):
+    # чтение и запись в одной транзакции писателя — параллельные клики
+    # не теряют друг друга
+    cur.execute(
+        "UPDATE books SET favorite = CASE WHEN favorite THEN 0 ELSE 1 END WHERE id=?",
+        (book_id,),
     )
-    thread.start()
+    writer.after_commit(tag_index.refresh_books, cur.connection, [book_id])
 
-    return render_template_string(UPDATE_HTML)
 
+@app.route("/authors")
+def authors_page():
+    conn = connect()
+    authors = list_authors(conn)
+    conn.close()
+    return render_template_string(AUTHORS_HTML, authors=authors)
 
-def scan_folder_worker(folder):
-    count = 0
-
-    for root, _, files in os.walk(folder):
-        for file in files:
-            if file.endswith(".bnf"):
-                try:
-                    with open(os.path.join(root, file), "r", encoding="utf-8") as f:
-                        data = json.load(f)
-
-                    add_or_update_book(
-                        data.get("title", ""),
-                        data.get("orig_name", ""),
-                        data.get("author", ""),
-                        data.get("description", ""),
-                        lang=data.get("lang"),
-                        bnf_path=os.path.join(root, file),
-                        tags=data.get("tags", []),
-                    )
-                    count += 1
-                except Exception as e:
-                    print(f"Ошибка {file}: {e}")
 
-    check_db_files_exist()
+@app.route("/duplicates")
+def duplicates_page():
+    threshold = request.args.get("threshold", dedup.THRESHOLD, type=float)
+    threshold = min(max(threshold, dedup.MIN_THRESHOLD), 1.0)
+    # только чтение сохранённых пар: считает их dedup.refresh
+    conn = connect()
+    try:
+        clusters = dedup.stored_clusters(conn, threshold)
+        computed_at = dedup.computed_at(conn)
+    finally:
+        conn.close()
+    return render_template_string(
+        DUPLICATES_HTML,
+        clusters=clusters,
+        threshold=threshold,
+        min_threshold=dedup.MIN_THRESHOLD,
+        computed_at=(
+            time.strftime("%d.%m.%Y %H:%M", time.localtime(computed_at))
+            if computed_at
+            else None
+        ),
+        refreshing=dedup.refreshing(),
+    )
 
 
-def check_db_files_exist():
-    """Удаляем из БД записи, у которых нет .bnf файла"""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT id, bnf_path FROM books")
-    rows = cur.fetchall()
+@app.route("/duplicates/refresh", methods=["POST"])
+def duplicates_refresh():
+    # повторные нажатия, пока расчёт идёт, ничего не запускают
+    dedup.start_refresh(connect)
+    return redirect(
+        url_for("duplicates_page", threshold=request.form.get("threshold"))
+    )
 
-    deleted = 0
-    for book_id, path in rows:
-        if not os.path.exists(path):
-            cur.execute("DELETE FROM books WHERE id=?", (book_id,))
-            deleted += 1
 
-    if deleted:
-        conn.commit()
-        print(f"Удалено {deleted} записей без файлов.")
+@app.route("/debug/profiles")
+def debug_profiles():
+    if not profiling.profiles_enabled(request.args):
+        abort(404)
+    token = request.args.get("token")
+    return render_template_string(
+        PROFILES_HTML,
+        profiles=profiling.list_profiles(),
+        token_qs=f"?token={token}" if token else "",
+    )
 
 
-def add_or_update_book(
-    title, orig_name, author, description, lang=None, bnf_path=None, tags=None
-):
-    book_id = find_book_id(title, author)
-    conn = connect()
-    cur = conn.cursor()
-    if book_id:
-        cur.execute(
-            """
-            UPDATE books SET title=?, orig_name=?, author=?, description=?, lang=?, bnf_path=?
-            WHERE id=?
-        """,
-            (title, orig_name, author, description, lang, bnf_path, book_id),
-        )
-    else:
-        cur.execute(
-            """
-            INSERT INTO books (title, orig_name, author, description, lang, bnf_path)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """,
-            (title, orig_name, author, description, lang, bnf_path),
-        )
-        book_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    if tags:
-        save_tags(book_id, tags)
+@app.route("/debug/profiles/<name><any('.prof', '.collapsed'):ext>")
+def debug_profile_file(name, ext):
+    if not profiling.profiles_enabled(request.args):
+        abort(404)
+    path = profiling.profile_file(name, ext)
+    if not path:
+        abort(404)
+    return send_file(os.path.abspath(path), as_attachment=True)
 
 
-def find_book_id(title, author):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id FROM books
-        WHERE UNI_LOWER(title)  = UNI_LOWER(?)
-          AND UNI_LOWER(author) = UNI_LOWER(?)
-    """,
-        (title, author),
+@app.route("/update_books")
+def scan_folder_async():
+    # повторные клики присоединяются к уже идущему сканированию
+    folder = get_library_path()
+    scan_manager.start(
+        folder, lambda job: scan_folder_worker(folder, job), on_done=_after_scan
     )
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else None
+
+    return render_template_string(UPDATE_HTML)
+
+
+@app.route("/update_books/progress")
+def scan_progress():
+    """Server-Sent Events с прогрессом текущего сканирования"""
+    folder = get_library_path()
+
+    def events():
+        while True:
+            job = scan_manager.get(folder)
+            snapshot = job.snapshot() if job else {"state": "idle"}
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot["state"] != "running":
+                return
+            time.sleep(0.5)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.route("/update_books/cancel", methods=["POST"])
+def scan_cancel():
+    job = scan_manager.cancel(get_library_path())
+    return jsonify(job.snapshot() if job else {"state": "idle"})
+
+
+def scan_folder_worker(folder, job=None):
+    # писатель сам группирует накопившиеся записи в транзакции
+    scan_library(folder, job or ScanJob(folder), add_or_update_book)
+    check_db_files_exist()
+    writer.call(update_statistics)
+    writer.call(prune_change_log)
+
+
+def _after_scan(job):
+    """Долгие расчёты по текстам — в фоне, когда сканирование уже завершено"""
+    if job.state == "done":
+        text_stats.start_backfill(connect)
+        dedup.start_refresh(connect)
 
 
-def save_tags(book_id, tags):
+def check_db_files_exist():
+    """Удаляем из БД записи, у которых нет .bnf файла"""
     conn = connect()
     cur = conn.cursor()
-    for tag in tags:
-        tag = tag.strip()
-        if not tag:
-            continue
-        cur.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
-        cur.execute("SELECT id FROM tags WHERE name=?", (tag,))
-        tag_id = cur.fetchone()[0]
-        cur.execute(
-            "INSERT OR IGNORE INTO book_tags (book_id, tag_id) VALUES (?, ?)",
-            (book_id, tag_id),
-        )
-    conn.commit()
+    cur.execute("SELECT id, bnf_path FROM books")
+    rows = cur.fetchall()
     conn.close()
 
+    missing = [book_id for book_id, path in rows if not os.path.exists(path)]
+    if missing:
+        writer.call(_delete_books, missing)
+        print(f"Удалено {len(missing)} записей без файлов.")
+
 
 class StrictHeaderProcessor(HashHeaderProcessor):
     """Обрабатывает только заголовки с пробелом после #"""
@@ -833,7 +1403,12 @@ class StrictHeadersExtension(Extension):
 
 
 def start_watcher():
-    event_handler = LibraryWatcher(event_queue)
+    event_handler = LibraryWatcher(event_queue, root=library_path)
+    if use_polling(library_path):
+        # сетевая папка: inotify не работает, сверяем снимки
+        PollingWatcher(event_handler, library_path).start()
+        print(f"Запущен опрос {library_path}")
+        return
     observer = Observer()
     observer.schedule(event_handler, library_path, recursive=True)
     observer.daemon = True
@@ -858,6 +1433,13 @@ def get_library_path():
 if __name__ == "__main__":
     library_path = get_library_path()
     os.makedirs(library_path, exist_ok=True)
+    conn = connect()
+    migrate(conn)
+    conn.close()
+    tag_index.ensure_loaded(connect)
+    writer.start()
+    text_stats.start_backfill(connect)
+    recommend.start_background(connect)
 
     # event_queue = queue.Queue()
     # start_watcher()